@@ -2,7 +2,7 @@
 Sneh Backend - FastAPI + DSPy
 Main application with REST endpoints and WebSocket support
 """
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
@@ -58,6 +58,7 @@ class VoiceRequest(BaseModel):
     audioBase64: str
     conversationHistory: List[Message] = []
     intensity: Optional[str] = "real"  # Intensity level: gentle, real, ruthless
+    audioFormat: Optional[str] = None  # Preferred reply audio: "opus", "mp3" or "pcm" (comma-separated list allowed)
 
 class ContextRequest(BaseModel):
     title: str
@@ -91,6 +92,12 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "ok", "timestamp": __import__('time').time()}
 
+@app.get("/metrics")
+async def get_metrics():
+    """In-process metrics (counters, gauges, timing percentiles)"""
+    from services import metrics
+    return metrics.snapshot()
+
 @app.get("/greeting")
 async def greeting():
     """Get initial greeting message"""
@@ -146,13 +153,35 @@ async def voice(request: VoiceRequest):
         
         history = [{"role": msg.role, "content": msg.content} for msg in request.conversationHistory]
         
-        result = await process_voice_message(request.audioBase64, history, request.intensity or "real")
+        result = await process_voice_message(request.audioBase64, history, request.intensity or "real", request.audioFormat)
         return result
         
     except Exception as e:
         print(f"[Voice] Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/voice/upload")
+async def voice_upload(request: Request):
+    """Voice endpoint for binary audio (multipart or raw body): STT → GPT-4o → TTS"""
+    from services.ai_service import process_voice_audio, voice_reply, negotiate_audio_format, VOICE_UNCLEAR_RESPONSE
+    from services.voice_upload import read_voice_upload, MIN_UPLOAD_BYTES
+
+    upload = await read_voice_upload(request)
+    try:
+        print(f"[Voice] Received {upload.size} byte upload ({upload.content_type}, intensity: '{upload.intensity}')")
+        if upload.size < MIN_UPLOAD_BYTES:
+            print("[Voice] Audio too short")
+            return await voice_reply(VOICE_UNCLEAR_RESPONSE, upload.intensity, negotiate_audio_format(upload.audio_format))
+        return await process_voice_audio(
+            upload.file, upload.history, upload.intensity, upload.audio_format,
+            filename=upload.filename, content_type=upload.content_type
+        )
+    except Exception as e:
+        print(f"[Voice] Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        upload.close()
+
 @app.get("/contexts")
 async def get_contexts():
     """Get all user contexts"""
@@ -286,7 +315,8 @@ async def end_active_session():
 async def generate_recap(request: dict):
     """Generate Mirror/Coach/Challenger perspectives from conversation messages"""
     try:
-        from services.ai_service import client, CHAT_DEPLOYMENT
+        from services.llm_gateway import llm_gateway, CHAT_DEPLOYMENT
+        from services.llm_scheduler import LANE_BACKGROUND
         import json
         
         messages = request.get("messages", [])
@@ -339,7 +369,9 @@ Respond in JSON format:
         result = {}
         for perspective_id, prompt in prompts.items():
             try:
-                response = await client.chat.completions.create(
+                response = await llm_gateway.chat_completion(
+                    f"recap_{perspective_id}",
+                    lane=LANE_BACKGROUND,
                     model=CHAT_DEPLOYMENT,
                     messages=[
                         {"role": "system", "content": "You are an AI that provides therapeutic perspectives. Always respond in valid JSON format."},
@@ -446,9 +478,13 @@ async def websocket_endpoint(websocket: WebSocket):
         
         # Extract intensity from query params
         intensity = websocket.query_params.get("intensity", "real")
-        print(f"[WS] Mobile client connected (intensity: {intensity})", flush=True)
+        # ?audio=opus: assistant audio as binary Opus frames instead of base64 PCM deltas
+        output_audio = websocket.query_params.get("audio", "pcm16")
+        # ?events=type1,type2 (or *): Azure events to forward; defaults to REALTIME_CLIENT_EVENTS
+        events = websocket.query_params.get("events")
+        print(f"[WS] Mobile client connected (intensity: {intensity}, audio: {output_audio})", flush=True)
         
-        await setup_realtime_websocket(websocket, intensity)
+        await setup_realtime_websocket(websocket, intensity, output_audio, events)
         
     except WebSocketDisconnect:
         print("[WS] Mobile disconnected", flush=True)
@@ -462,10 +498,56 @@ async def websocket_endpoint(websocket: WebSocket):
              pass
 
 
+@app.websocket("/voice/stream")
+async def voice_stream_endpoint(websocket: WebSocket):
+    """WebSocket voice endpoint: STT → streaming GPT-4o → per-sentence TTS audio chunks"""
+    try:
+        from services.voice_pipeline import handle_voice_stream
+        await websocket.accept()
+        print(f"[VoiceStream] Client connected from {websocket.client.host}:{websocket.client.port}", flush=True)
+        await handle_voice_stream(websocket)
+    except WebSocketDisconnect:
+        print("[VoiceStream] Client disconnected", flush=True)
+    except Exception as e:
+        print(f"[VoiceStream] Error: {e}", flush=True)
+        import traceback
+        traceback.print_exc()
+        try:
+             await websocket.close(code=1011)
+        except:
+             pass
+
+
 # ============================================
 # STARTUP
 # ============================================
 
+@app.on_event("startup")
+async def startup():
+    """Open the TTS connection pool, prewarm canned phrases and warm realtime sessions"""
+    import asyncio
+    from services.tts_client import tts_client
+    from services.ai_service import prewarm_voice_cache
+    from services.realtime_pool import realtime_pool
+    await tts_client.warm_up()
+    realtime_pool.start()
+    # Prewarm in the background so startup is not held up by TTS round trips
+    app.state.tts_prewarm = asyncio.create_task(prewarm_voice_cache())
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Release shared connection pools and flush logs"""
+    from services.llm_gateway import llm_gateway
+    from services.tts_client import tts_client
+    from services.conversation_logger import conversation_logger
+    from services.audio_workers import conversion_pool
+    from services.realtime_pool import realtime_pool
+    await realtime_pool.close()
+    await llm_gateway.aclose()
+    await tts_client.aclose()
+    conversion_pool.shutdown()
+    conversation_logger.close()
+
 if __name__ == "__main__":
     PORT = int(os.getenv("PORT", 8000))
     
@@ -496,5 +578,8 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=PORT,
         reload=True,
-        log_level="info"
+        log_level="info",
+        # Compress WebSocket messages (JSON events, base64 audio) when the client supports it.
+        # Also uvicorn's default, so CLI deployments get it unless they turn it off
+        ws_per_message_deflate=True
     )
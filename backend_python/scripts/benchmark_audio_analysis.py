@@ -0,0 +1,67 @@
+"""
+Microbenchmark: PCM16 level analysis, per-sample struct loop vs NumPy.
+
+Buffer sizes match what the realtime relay sees: a 250 ms streaming chunk,
+a 2 s push-to-talk append and a 30 s recording, all 24 kHz mono PCM16.
+
+Usage: python scripts/benchmark_audio_analysis.py [iterations]
+"""
+import sys
+import math
+import time
+import struct
+import statistics
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.audio_analysis import analyze_pcm16
+
+SAMPLE_RATE = 24000
+SIZES = [("250 ms chunk", 0.25), ("2 s append", 2.0), ("30 s recording", 30.0)]
+
+
+def legacy_rms(pcm_data: bytes) -> float:
+    """The relay's original per-sample RMS loop"""
+    count = len(pcm_data) // 2
+    sum_squares = 0.0
+    for i in range(count):
+        sample = struct.unpack_from('<h', pcm_data, i * 2)[0]
+        sum_squares += sample * sample
+    return math.sqrt(sum_squares / count) if count > 0 else 0
+
+
+def make_buffer(seconds: float) -> bytes:
+    """Speech-like test signal: modulated tone with pauses and a little noise"""
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    envelope = (np.sin(2 * np.pi * 1.5 * t) > -0.3).astype(np.float32)
+    signal = envelope * 6000 * np.sin(2 * np.pi * 220 * t) + np.random.normal(0, 40, len(t))
+    return np.clip(signal, -32768, 32767).astype("<i2").tobytes()
+
+
+def time_ms(fn, data: bytes, iterations: int) -> float:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(data)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print(f"{'buffer':<16}{'bytes':>10}{'struct loop':>14}{'numpy':>12}{'speedup':>10}")
+    for label, seconds in SIZES:
+        data = make_buffer(seconds)
+        stats = analyze_pcm16(data, SAMPLE_RATE)
+        assert abs(stats["rms"] - legacy_rms(data)) < 0.01 * max(1.0, stats["rms"])
+        legacy = time_ms(legacy_rms, data, max(1, iterations // 4))
+        vectorized = time_ms(lambda d: analyze_pcm16(d, SAMPLE_RATE), data, iterations)
+        print(f"{label:<16}{len(data):>10}{legacy:>12.2f}ms{vectorized:>10.3f}ms{legacy / vectorized:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
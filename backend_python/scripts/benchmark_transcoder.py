@@ -0,0 +1,112 @@
+"""
+Benchmark per-chunk M4A → PCM16 conversion for the realtime relay.
+
+Compares the old path (temp files in the CWD + a fresh `ffmpeg` per chunk via
+subprocess.run) with the transcoder backends (ffmpeg pipes, and PyAV if installed).
+
+Also times WAV input that isn't already 24 kHz mono: the in-process parser +
+NumPy resampler against an ffmpeg pipe decode.
+
+Usage: python scripts/benchmark_transcoder.py [chunk.m4a] [iterations]
+Without a file, a 1 s test tone is generated with ffmpeg.
+"""
+import os
+import sys
+import time
+import uuid
+import struct
+import statistics
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.audio_preprocess import resolve_ffmpeg, decode_to_pcm
+from services.audio_transcoder import AudioTranscoder, av
+
+
+def legacy_convert(audio_bytes: bytes) -> bytes:
+    """The pre-transcoder implementation of convert_audio_to_pcm for M4A"""
+    temp_input = os.path.abspath(f"temp_{uuid.uuid4().hex}.m4a")
+    temp_output = os.path.abspath(f"temp_{uuid.uuid4().hex}.pcm")
+    try:
+        with open(temp_input, "wb") as f:
+            f.write(audio_bytes)
+        cmd = [resolve_ffmpeg(), '-y', '-i', temp_input, '-f', 's16le', '-acodec', 'pcm_s16le',
+               '-ac', '1', '-ar', '24000', temp_output]
+        subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
+        with open(temp_output, 'rb') as f:
+            return f.read()
+    finally:
+        for path in (temp_input, temp_output):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def make_test_chunk() -> bytes:
+    """1 s, 44.1 kHz stereo AAC tone in an M4A container (like a phone recording)"""
+    result = subprocess.run(
+        [resolve_ffmpeg(), "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "sine=frequency=440:duration=1",
+         "-ac", "2", "-ar", "44100", "-c:a", "aac", "-movflags", "frag_keyframe+empty_moov", "-f", "mp4", "pipe:1"],
+        capture_output=True, check=True
+    )
+    return result.stdout
+
+
+def make_test_wav(seconds: float, sample_rate: int = 44100, channels: int = 2) -> bytes:
+    """PCM16 WAV tone with a LIST chunk before the data (as many recorders write)"""
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    tone = (8000 * np.sin(2 * np.pi * 440 * t)).astype("<i2")
+    data = np.repeat(tone[:, None], channels, axis=1).tobytes()
+    info = b"INFOISFT\x05\x00\x00\x00test\x00\x00"
+    block_align = channels * 2
+    fmt = struct.pack("<HHIIHH", 1, channels, sample_rate, sample_rate * block_align, block_align, 16)
+    body = (b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+            + b"LIST" + struct.pack("<I", len(info)) + info
+            + b"data" + struct.pack("<I", len(data)) + data)
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+def bench(name: str, convert, audio_bytes: bytes, iterations: int) -> None:
+    convert(audio_bytes)  # warm-up
+    timings = []
+    out_len = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        out = convert(audio_bytes)
+        timings.append((time.perf_counter() - start) * 1000)
+        out_len = len(out or b"")
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<16} mean {statistics.mean(timings):7.2f}ms   p50 {statistics.median(timings):7.2f}ms   "
+          f"p95 {p95:7.2f}ms   ({out_len} bytes out)")
+
+
+def main():
+    if len(sys.argv) > 1 and os.path.exists(sys.argv[1]):
+        audio_bytes = Path(sys.argv[1]).read_bytes()
+        iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    else:
+        audio_bytes = make_test_chunk()
+        iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    print(f"Chunk: {len(audio_bytes)} bytes, {iterations} iterations\n")
+    bench("legacy (files)", legacy_convert, audio_bytes, iterations)
+    bench("ffmpeg pipes", lambda b: AudioTranscoder("ffmpeg").to_pcm16(b, "m4a"), audio_bytes, iterations)
+    if av is not None:
+        bench("pyav", lambda b: AudioTranscoder("pyav").to_pcm16(b, "m4a"), audio_bytes, iterations)
+    else:
+        print("pyav             (not installed: pip install av)")
+
+    for label, seconds in (("20 ms", 0.02), ("1 s", 1.0)):
+        wav = make_test_wav(seconds)
+        print(f"\nWAV {label}, 44.1 kHz stereo: {len(wav)} bytes")
+        bench("ffmpeg pipes", lambda b: decode_to_pcm(b, 24000), wav, iterations)
+        bench("numpy resample", lambda b: AudioTranscoder().to_pcm16(b, "wav"), wav, iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+End-to-end check of the realtime relay's binary audio path with small frames.
+
+Streams 2 s of speech-like audio as 10 ms binary frames (PCM16 at 16/24 kHz,
+and Opus at 24 kHz when PyAV is installed) through the same pieces the `/`
+WebSocket uses: BinaryAudioStream.decode → OrderedConverter → a sender that
+gates appends with the VAD exactly like send_to_azure, ending with a commit.
+Fails if the audio that reaches the upstream sender is far short of what was sent.
+
+Usage: python scripts/verify_binary_frames.py
+"""
+import sys
+import asyncio
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.audio_frames import FRAME_HEADER, FORMAT_OPUS, FORMAT_PCM16, FLAG_COMMIT, BinaryAudioStream, av
+from services.audio_workers import OrderedConverter
+from services.vad import VoiceActivityDetector
+
+RELAY_RATE = 24000
+FRAME_MS = 10
+SECONDS = 2.0
+# Share of the sent audio that must arrive upstream (resampler/codec edges aside)
+MIN_DELIVERED = 0.95
+
+
+def make_speech(rate: int) -> np.ndarray:
+    """Modulated tone, loud enough to count as speech throughout"""
+    t = np.arange(int(rate * SECONDS)) / rate
+    signal = (4000 + 2000 * np.sin(2 * np.pi * 3 * t)) * np.sin(2 * np.pi * 220 * t)
+    return np.clip(signal, -32768, 32767).astype("<i2")
+
+
+def pcm_frames(rate: int):
+    samples = make_speech(rate)
+    step = rate * FRAME_MS // 1000
+    chunks = [samples[i:i + step].tobytes() for i in range(0, len(samples), step)]
+    return [(FORMAT_PCM16, chunk) for chunk in chunks]
+
+
+def opus_frames(rate: int):
+    encoder = av.CodecContext.create("libopus", "w")
+    encoder.sample_rate = rate
+    encoder.layout = "mono"
+    encoder.format = "s16"
+    encoder.options = {"frame_duration": str(FRAME_MS)}
+    encoder.open()
+    samples = make_speech(rate)
+    step = encoder.frame_size
+    packets = []
+    for pts, i in enumerate(range(0, len(samples) - step + 1, step)):
+        frame = av.AudioFrame.from_ndarray(samples[None, i:i + step], format="s16", layout="mono")
+        frame.sample_rate = rate
+        frame.pts = pts * step
+        packets.extend(bytes(p) for p in encoder.encode(frame))
+    packets.extend(bytes(p) for p in encoder.encode(None))
+    return [(FORMAT_OPUS, packet) for packet in packets]
+
+
+async def stream(frames, rate: int) -> int:
+    """Bytes of PCM16 the upstream sender forwarded for these frames"""
+    vad = VoiceActivityDetector(RELAY_RATE)
+    binary_audio = BinaryAudioStream(RELAY_RATE)
+    delivered = 0
+
+    async def send_to_azure(event):
+        nonlocal delivered
+        if event["type"] == "input_audio_buffer.append":
+            delivered += sum(len(audio) for audio, _ in vad.process(event["audio"]))
+        elif event["type"] == "input_audio_buffer.commit":
+            delivered += len(vad.flush())
+            assert vad.should_forward_commit(), "commit would be skipped: no speech reached the VAD"
+            vad.mark_committed()
+
+    forwarder = OrderedConverter(send_to_azure)
+    sender = asyncio.create_task(forwarder.run())
+    for seq, (fmt, payload) in enumerate(frames):
+        flags = FLAG_COMMIT if seq == len(frames) - 1 else 0
+        pcm, commit = binary_audio.decode(FRAME_HEADER.pack(fmt, flags, seq & 0xFFFF, rate) + payload)
+        if pcm:
+            await forwarder.submit_event({"type": "input_audio_buffer.append", "audio": pcm})
+        if commit:
+            await forwarder.submit_event({"type": "input_audio_buffer.commit"})
+    while not forwarder.queue.empty():
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.01)
+    sender.cancel()
+    return delivered
+
+
+def main():
+    cases = [("pcm16 16 kHz", pcm_frames, 16000), ("pcm16 24 kHz", pcm_frames, 24000)]
+    if av is not None:
+        cases.append(("opus 24 kHz", opus_frames, 24000))
+    else:
+        print("PyAV not installed, skipping the Opus case")
+
+    expected = int(RELAY_RATE * SECONDS) * 2
+    failed = False
+    for label, make_frames, rate in cases:
+        delivered = asyncio.run(stream(make_frames(rate), rate))
+        ok = delivered >= MIN_DELIVERED * expected
+        failed |= not ok
+        print(f"{label:<14} {FRAME_MS} ms frames: {delivered:>6} of {expected} bytes upstream  "
+              f"{'OK' if ok else 'FAIL'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Check request coalescing in the LLM response and TTS caches.
+
+Concurrent identical calls share one create()/synthesize(). If the caller that
+started it is cancelled (e.g. its client disconnected), the callers waiting on
+it must still get a result: one of them takes over instead of all raising
+CancelledError.
+
+Usage: python scripts/verify_request_coalescing.py
+"""
+import sys
+import asyncio
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.llm_cache import LLMResponseCache
+from services.tts_cache import TTSAudioCache
+
+
+async def llm_creator_cancelled() -> bool:
+    cache = LLMResponseCache(cache_dir="")
+    calls = 0
+
+    async def create():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"content": "hello"}
+
+    creator = asyncio.create_task(cache.get_or_create("key", "test", 60, create))
+    await asyncio.sleep(0.01)
+    waiters = [asyncio.create_task(cache.get_or_create("key", "test", 60, create)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    creator.cancel()
+
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    ok = all(isinstance(r, tuple) and r[0] == {"content": "hello"} for r in results) and calls == 2
+    print(f"{'llm_cache: creator cancelled':<36} waiters got {[type(r).__name__ for r in results]}, "
+          f"create() ran {calls}x  {'OK' if ok else 'FAIL'}")
+    return ok
+
+
+async def llm_waiter_cancelled() -> bool:
+    """Cancelling a waiter must still cancel that waiter (and not the shared call)"""
+    cache = LLMResponseCache(cache_dir="")
+
+    async def create():
+        await asyncio.sleep(0.05)
+        return {"content": "hello"}
+
+    creator = asyncio.create_task(cache.get_or_create("key", "test", 60, create))
+    await asyncio.sleep(0.01)
+    waiter = asyncio.create_task(cache.get_or_create("key", "test", 60, create))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    result = await creator
+    await asyncio.gather(waiter, return_exceptions=True)
+    ok = waiter.cancelled() and result[0] == {"content": "hello"}
+    print(f"{'llm_cache: waiter cancelled':<36} waiter cancelled={waiter.cancelled()}  {'OK' if ok else 'FAIL'}")
+    return ok
+
+
+async def tts_creator_cancelled() -> bool:
+    cache = TTSAudioCache(cache_dir="")
+    calls = 0
+
+    async def synthesize():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return b"audio"
+
+    creator = asyncio.create_task(cache.get_or_synthesize("key", synthesize))
+    await asyncio.sleep(0.01)
+    waiters = [asyncio.create_task(cache.get_or_synthesize("key", synthesize)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    creator.cancel()
+
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    ok = all(r == b"audio" for r in results) and calls == 2
+    print(f"{'tts_cache: creator cancelled':<36} waiters got {[type(r).__name__ for r in results]}, "
+          f"synthesize() ran {calls}x  {'OK' if ok else 'FAIL'}")
+    return ok
+
+
+def main():
+    checks = [llm_creator_cancelled, llm_waiter_cancelled, tts_creator_cancelled]
+    results = [asyncio.run(check()) for check in checks]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
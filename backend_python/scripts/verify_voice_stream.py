@@ -0,0 +1,83 @@
+"""
+Check the streaming voice sender's guardrail handling (services/voice_pipeline.py).
+
+Runs AudioChunkSender against a recording WebSocket with TTS and the guardrail
+replaced by fast local functions:
+
+- a chunk flagged UNSAFE is never sent, and the replacement is spoken instead
+- the same holds when the last chunk is only flagged after finish() was called
+  (its check finishes after the stream ended and the sentinel was queued)
+
+Usage: python scripts/verify_voice_stream.py
+"""
+import sys
+import asyncio
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services import ai_service
+from services.voice_pipeline import AudioChunkSender
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+
+async def fake_synthesize(text, intensity="real", output_format="", pin=False):
+    await asyncio.sleep(0.01)
+    return text.encode("utf-8")
+
+
+async def fake_validate(text):
+    # "unsafe" sentences come back last, after everything else has been queued
+    await asyncio.sleep(0.05 if "unsafe" in text else 0.01)
+    return {"status": "UNSAFE" if "unsafe" in text else "SAFE"}
+
+
+async def stream(sentences, finish_early: bool):
+    ws = RecordingWebSocket()
+    sender = AudioChunkSender(ws, "real", "mp3")
+    runner = asyncio.create_task(sender.run())
+    for sentence in sentences:
+        sender.submit(sentence)
+    if not finish_early:
+        await asyncio.sleep(0.1)  # every check is done before the stream ends
+    sender.finish()
+    await asyncio.wait_for(runner, 5)
+    return sender, ws.sent
+
+
+def check(label: str, sender, sent) -> bool:
+    chunks = [m for m in sent if m["type"] == "audio.chunk"]
+    spoken = [m["text"] for m in chunks]
+    ok = (
+        sender.blocked
+        and not any("unsafe" in text for text in spoken)
+        and any(m["type"] == "response.replaced" for m in sent)
+        and spoken[-1:] == [ai_service.GUARDRAIL_REPLACEMENT]
+        and chunks[-1]["replaces"]
+    )
+    print(f"{label:<40} sent {[m['type'] for m in sent]}  {'OK' if ok else 'FAIL'}")
+    return ok
+
+
+def main():
+    ai_service.synthesize_speech = fake_synthesize
+    ai_service.validate_response = fake_validate
+    sentences = ["This first sentence is fine.", "So is the second one here.", "But this one is unsafe."]
+
+    results = [
+        check("blocked while streaming", *asyncio.run(stream(sentences, finish_early=False))),
+        check("last chunk blocked after finish()", *asyncio.run(stream(sentences, finish_early=True))),
+    ]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,14 @@ import os
 import json
 import asyncio
 import base64
-import httpx
-from datetime import datetime
-from pathlib import Path
-from typing import List, Dict, Optional
+from typing import BinaryIO, List, Dict, Optional, Union
 from dotenv import load_dotenv
-from openai import AsyncAzureOpenAI
+from services.llm_gateway import llm_gateway
+from services.tts_client import tts_client
+from services.tts_cache import tts_cache, make_tts_key
+from services.ssml_builder import (
+    get_voice_preset, build_ssml, split_segments, can_concat, concat_audio, TTS_SEGMENT_CONCURRENCY
+)
 
 load_dotenv()
  
@@ -20,22 +22,16 @@ AZURE_OPENAI_KEY = os.getenv("AZURE_OPENAI_KEY")
 AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 CHAT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-4o")
 WHISPER_DEPLOYMENT = os.getenv("AZURE_WHISPER_DEPLOYMENT", "whisper")
+GUARDRAIL_CACHE_TTL = int(os.getenv("GUARDRAIL_CACHE_TTL", "86400"))  # temperature 0, safe to reuse
+STT_PREPROCESS = os.getenv("STT_PREPROCESS", "0") == "1"  # see services/audio_preprocess.py
+STT_CHUNKING = os.getenv("STT_CHUNKING", "0") == "1"  # see services/chunked_transcription.py
  
-# TTS Configuration
-AZURE_TTS_KEY = os.getenv("AZURE_TTS_KEY") or AZURE_OPENAI_KEY
-AZURE_TTS_ENDPOINT = os.getenv("AZURE_TTS_ENDPOINT") or AZURE_OPENAI_ENDPOINT
+# TTS Configuration (key, endpoint and region are resolved in services/tts_client.py)
 AZURE_TTS_DEPLOYMENT = os.getenv("AZURE_TTS_DEPLOYMENT", "tts")
  
 if not AZURE_OPENAI_KEY or not AZURE_OPENAI_ENDPOINT:
     print("⚠️ WARNING: Azure OpenAI Credentials missing. AI features will fail.")
  
-# Initialize Client
-client = AsyncAzureOpenAI(
-    api_key=AZURE_OPENAI_KEY,
-    api_version="2024-08-01-preview",
-    azure_endpoint=AZURE_OPENAI_ENDPOINT
-)
- 
 # -----------------------------------------------------------------------------
 # System Prompts (with broken‑record rule integrated where requested)
 # -----------------------------------------------------------------------------
@@ -160,6 +156,13 @@ HARM_KEYWORDS = [
 ]
  
 
+# Canned replies (also spoken via TTS)
+CRISIS_RESPONSE = "I hear how much pain you're in, and you're not alone. 💛\n\nIf you're in immediate danger, please reach out:\n- KIRAN Mental Health (India): 1800-599-0019\n- Emergency: 112\n\nBut I'm here too. Tell me what's on your mind. 💛"
+HARM_RESPONSE = "I need to be real—what you're talking about worries me. Harming animals or people is never okay.\n\nBut I'm worried about *you*. Can we talk about what's really bothering you? I'm here to listen. 💛"
+GUARDRAIL_REPLACEMENT = "I'm right here with you. Please let's talk about how you're feeling. I'm listening."
+CHAT_ERROR_RESPONSE = "I'm having trouble thinking right now. Please try again."
+
+
 # Helper function to get system prompt based on intensity
 def get_system_prompt(intensity: str = "real") -> str:
     """Get the appropriate system prompt based on intensity level"""
@@ -177,20 +180,9 @@ def get_system_prompt(intensity: str = "real") -> str:
 
 # Logging
 async def log_conversation(msg_type: str, message: str):
-    """Log conversations to daily file"""
-    log_dir = Path(__file__).parent.parent / "log"
-    log_dir.mkdir(exist_ok=True)
-    
-    timestamp = datetime.now().isoformat()
-    log_entry = f"[{timestamp}] {msg_type}: {message}\n"
-    log_file = log_dir / f"conversation_{datetime.now().date()}.txt"
-    
-    try:
-        with open(log_file, "a", encoding="utf-8") as f:
-            f.write(log_entry)
-        print(f"[Log] Saved to {log_file.name}")
-    except Exception as e:
-        print(f"[Log] Error: {e}")
+    """Log conversations to daily file (queued; written by a background thread)"""
+    from services.conversation_logger import conversation_logger
+    await conversation_logger.log(msg_type, message)
 
 
 
@@ -205,7 +197,9 @@ async def analyze_user_need(user_message: str, history: List[Dict]) -> str:
             messages.append({"role": msg["role"], "content": msg["content"]})
         messages.append({"role": "user", "content": user_message})
 
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat_completion(
+            "intensity_analyzer",
+            deadline=10,
             model=CHAT_DEPLOYMENT,
             messages=messages,
             temperature=0.5,
@@ -221,28 +215,68 @@ async def analyze_user_need(user_message: str, history: List[Dict]) -> str:
         print(f"[Analysis] Error: {e}. Defaulting to 'real'")
         return "real"
 
+def _record_prompt_cache_usage(usage, intensity: str) -> None:
+    """Export prompt/cached token counts from response.usage as metrics"""
+    from services import metrics
+
+    if not usage:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        cached_tokens = details.get("cached_tokens", 0) or 0
+    else:
+        cached_tokens = getattr(details, "cached_tokens", 0) or 0
+
+    metrics.increment("chat_prompt_tokens", prompt_tokens, intensity=intensity)
+    metrics.increment("chat_cached_prompt_tokens", cached_tokens, intensity=intensity)
+    metrics.increment("chat_prefix_cache_hits" if cached_tokens else "chat_prefix_cache_misses", intensity=intensity)
+    if prompt_tokens:
+        metrics.observe("chat_prefix_cache_ratio", cached_tokens / prompt_tokens, intensity=intensity)
+    print(f"[AI] Prompt tokens: {prompt_tokens} (cached: {cached_tokens})")
+
+def _build_chat_messages(user_message: str, system_prompt: str, conversation_history: List[Dict],
+                         past_context: str = "", stable_context: str = "") -> List[Dict]:
+    """Lay out the prompt with the cacheable part first: persona prompt + stable context,
+    then history, then the per-turn context (past_context) right before the user message."""
+    system_content = system_prompt
+    if stable_context:
+        system_content += f"\n\nCONTEXT:\n{stable_context}"
+    messages = [{"role": "system", "content": system_content}]
+    
+    # Add history
+    for msg in conversation_history:
+         messages.append({"role": msg["role"], "content": msg["content"]})
+    
+    # Volatile context goes after the history so it does not break the cached prefix
+    if past_context:
+        messages.append({"role": "system", "content": f"CONTEXT (recent memory):\n{past_context}"})
+         
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
 # Core Generation
 async def generate_response(user_message: str, system_prompt: str, 
                            emotion: str, conversation_history: List[Dict],
-                           past_context: str = "") -> str:
+                           past_context: str = "", stable_context: str = "",
+                           intensity: str = "real") -> str:
     """Generate AI response using Azure OpenAI"""
     print(f"[AI] Generating ({emotion}): \"{user_message}\"")
     await log_conversation("USER", user_message)
     
     try:
-        messages = [{"role": "system", "content": f"{system_prompt}\n\nCONTEXT:\n{past_context}"}]
-        
-        # Add history
-        for msg in conversation_history:
-             messages.append({"role": msg["role"], "content": msg["content"]})
-             
-        messages.append({"role": "user", "content": user_message})
+        messages = _build_chat_messages(user_message, system_prompt, conversation_history,
+                                        past_context, stable_context)
 
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat_completion(
+            "chat",
+            deadline=30,
+            hedge=True,
             model=CHAT_DEPLOYMENT,
             messages=messages,
             temperature=0.7
         )
+        _record_prompt_cache_usage(getattr(response, "usage", None), intensity)
         
         ai_response = response.choices[0].message.content
         await log_conversation(f"AI ({emotion})", ai_response)
@@ -250,42 +284,62 @@ async def generate_response(user_message: str, system_prompt: str,
         
     except Exception as e:
         print(f"❌ Azure Chat Error: {e}")
-        return "I'm having trouble thinking right now. Please try again."
+        return CHAT_ERROR_RESPONSE
 
-# Orchestrator
-async def chat_with_emotion(user_message: str, conversation_history: List[Dict] = None, user_context: str = "", intensity: str = "real") -> Dict:
-    """Main chat function with emotion detection and guardrails"""
-    if conversation_history is None:
-        conversation_history = []
-    
-    from services.context_service import get_structured_context
-    from services.memory_service import get_past_conversation_context
+async def stream_response(user_message: str, system_prompt: str,
+                          emotion: str, conversation_history: List[Dict],
+                          past_context: str = "", stable_context: str = ""):
+    """Stream AI response text deltas (same prompt layout as generate_response)"""
+    print(f"[AI] Streaming ({emotion}): \"{user_message}\"")
+    await log_conversation("USER", user_message)
     
-    print(f"[Chat] Intensity level: {intensity}")
+    parts = []
+    try:
+        messages = _build_chat_messages(user_message, system_prompt, conversation_history,
+                                        past_context, stable_context)
+        async for delta in llm_gateway.chat_completion_stream(
+            "chat_stream",
+            deadline=30,
+            model=CHAT_DEPLOYMENT,
+            messages=messages,
+            temperature=0.7
+        ):
+            parts.append(delta)
+            yield delta
+    except Exception as e:
+        print(f"❌ Azure Chat Stream Error: {e}")
+        if not parts:
+            parts.append(CHAT_ERROR_RESPONSE)
+            yield CHAT_ERROR_RESPONSE
     
-    # Safety pre-checks
+    await log_conversation(f"AI ({emotion})", "".join(parts))
+
+# Orchestrator
+async def check_safety(user_message: str) -> Optional[Dict]:
+    """Keyword crisis/harm pre-check; returns the canned reply if one applies"""
     lower_msg = user_message.lower()
     
     # Crisis check
     if any(keyword in lower_msg for keyword in CRISIS_KEYWORDS):
         print("[CRISIS] Crisis keyword detected")
-        response = "I hear how much pain you're in, and you're not alone. 💛\n\nIf you're in immediate danger, please reach out:\n- KIRAN Mental Health (India): 1800-599-0019\n- Emergency: 112\n\nBut I'm here too. Tell me what's on your mind. 💛"
-        await log_conversation("AI (CRISIS)", response)
-        return {"response": response, "emotion": "SADNESS"}
+        await log_conversation("AI (CRISIS)", CRISIS_RESPONSE)
+        return {"response": CRISIS_RESPONSE, "emotion": "SADNESS"}
     
     # Harm check
     if any(keyword in lower_msg for keyword in HARM_KEYWORDS):
         print("[HARM] Harm keyword detected")
-        response = "I need to be real—what you're talking about worries me. Harming animals or people is never okay.\n\nBut I'm worried about *you*. Can we talk about what's really bothering you? I'm here to listen. 💛"
-        await log_conversation("AI (HARM)", response)
-        return {"response": response, "emotion": "ANGER"}
-    
-    # Get context
-    ace_context = get_structured_context()
-    past_context = get_past_conversation_context()
-    full_context = f"{user_context}\n{ace_context}\n{past_context}"
+        await log_conversation("AI (HARM)", HARM_RESPONSE)
+        return {"response": HARM_RESPONSE, "emotion": "ANGER"}
     
+    return None
 
+async def prepare_chat_prompt(user_message: str, conversation_history: List[Dict],
+                              user_context: str = "", intensity: str = "real") -> Dict:
+    """Resolve intensity and assemble the system prompt + budgeted context for a turn"""
+    from services.prompt_builder import build_chat_context
+    
+    # Get context (token-budgeted, stored memory deduped against client history)
+    prompt_context = build_chat_context(user_context, conversation_history, user_message)
     
     # Adaptive Intensity Logic
     final_intensity = intensity
@@ -293,24 +347,21 @@ async def chat_with_emotion(user_message: str, conversation_history: List[Dict]
         final_intensity = await analyze_user_need(user_message, conversation_history)
         print(f"[Chat] Adaptive mode chose: {final_intensity}")
 
-    # Get intensity-based system prompt
-    system_prompt = get_system_prompt(final_intensity)
-    
-    # Generate response
-    response = await generate_response(
-        user_message, 
-        system_prompt,
-        "NEUTRAL",
-        conversation_history,
-        full_context
-    )
-    
+    return {
+        "system_prompt": get_system_prompt(final_intensity),
+        "context": prompt_context,
+        "intensity": final_intensity,
+    }
+
+async def finalize_response(user_message: str, response: str, validation: Optional[Dict] = None) -> str:
+    """Run the guardrail on a generated reply (unless already `validation`) and store the turn in sessions"""
     # Validate with guardrail
-    validation = await validate_response(response)
+    if validation is None:
+        validation = await validate_response(response)
     
     if validation["status"] == "UNSAFE":
         print("!!! GUARDRAIL TRIGGERED !!!")
-        final_response = validation["replacement"]
+        final_response = validation.get("replacement") or GUARDRAIL_REPLACEMENT
     else:
         final_response = response
     
@@ -318,15 +369,47 @@ async def chat_with_emotion(user_message: str, conversation_history: List[Dict]
     from services.session_service import add_message_to_active_session
     await add_message_to_active_session('user', user_message)
     await add_message_to_active_session('assistant', final_response)
+    return final_response
+
+async def chat_with_emotion(user_message: str, conversation_history: List[Dict] = None, user_context: str = "", intensity: str = "real") -> Dict:
+    """Main chat function with emotion detection and guardrails"""
+    if conversation_history is None:
+        conversation_history = []
+    
+    print(f"[Chat] Intensity level: {intensity}")
     
-    return {"response": final_response, "emotion": "NEUTRAL", "intensity": final_intensity}
+    # Safety pre-checks
+    canned = await check_safety(user_message)
+    if canned:
+        return canned
+    
+    prompt = await prepare_chat_prompt(user_message, conversation_history, user_context, intensity)
+    prompt_context = prompt["context"]
+    
+    # Generate response
+    response = await generate_response(
+        user_message, 
+        prompt["system_prompt"],
+        "NEUTRAL",
+        prompt_context["history"],
+        prompt_context["volatile"],
+        stable_context=prompt_context["stable"],
+        intensity=prompt["intensity"]
+    )
+    
+    final_response = await finalize_response(user_message, response)
+    
+    return {"response": final_response, "emotion": "NEUTRAL", "intensity": prompt["intensity"]}
 
 async def validate_response(generated_response: str) -> Dict:
     """Validate response with Azure guardrail"""
     print(f"[Guardrail] Validating: \"{generated_response[:50]}...\"")
     
     try:
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat_completion(
+            "guardrail",
+            deadline=10,
+            cache_ttl=GUARDRAIL_CACHE_TTL,
             model=CHAT_DEPLOYMENT,
             messages=[
                 {"role": "system", "content": SYSTEM_PROMPT_GUARDRAIL},
@@ -344,7 +427,7 @@ async def validate_response(generated_response: str) -> Dict:
             if "UNSAFE" in content:
                 return {
                     "status": "UNSAFE",
-                    "replacement": "I'm right here with you. Please let's talk about how you're feeling. I'm listening."
+                    "replacement": GUARDRAIL_REPLACEMENT
                 }
             return {"status": "SAFE"}
             
@@ -352,6 +435,9 @@ async def validate_response(generated_response: str) -> Dict:
         print(f"❌ Guardrail Error: {e}")
         return {"status": "SAFE"}
 
+GREETING_NEW = "Hey! I'm Sneh, your new friend. I'm so happy to meet you! 😊 What should I call you?"
+GREETING_RETURNING = "Welcome back, {name}! 😊 It's so good to see you again. How have you been?"
+
 def get_initial_greeting() -> str:
     """Get personalized greeting based on context"""
     from services.context_service import get_structured_context
@@ -360,44 +446,204 @@ def get_initial_greeting() -> str:
     match = re.search(r"- Name: ([^\n]+)", ace_context)
     if match:
         name = match.group(1).strip()
-        return f"Welcome back, {name}! 😊 It's so good to see you again. How have you been?"
-    return "Hey! I'm Sneh, your new friend. I'm so happy to meet you! 😊 What should I call you?"
+        return GREETING_RETURNING.format(name=name)
+    return GREETING_NEW
 
 # --- Voice Processing (Azure Whisper + TTS) ---
-async def process_voice_message(audio_base64: str, conversation_history: List[Dict], intensity: str = "real") -> Dict:
-    """Process voice: Whisper STT → GPT-4o Chat → Azure TTS"""
-    print(f"[Voice] Processing audio with Azure (intensity: {intensity})...")
+# Client-selectable TTS output formats: name -> (Azure output format, MIME type)
+TTS_FORMATS = {
+    "opus": ("ogg-24khz-16bit-mono-opus", "audio/ogg"),
+    "mp3": ("audio-24khz-48kbitrate-mono-mp3", "audio/mpeg"),
+    "pcm": ("riff-24khz-16bit-mono-pcm", "audio/wav"),
+}
+TTS_FORMAT_ALIASES = {
+    "ogg": "opus", "audio/ogg": "opus", "audio/opus": "opus",
+    "mpeg": "mp3", "audio/mpeg": "mp3", "audio/mp3": "mp3",
+    "wav": "pcm", "riff": "pcm", "audio/wav": "pcm", "audio/x-wav": "pcm",
+}
+# Compressed by default: mobile clients play MP3 natively and it is ~10x smaller than PCM
+DEFAULT_AUDIO_FORMAT = os.getenv("VOICE_AUDIO_FORMAT", "mp3")
+TTS_OUTPUT_FORMAT = TTS_FORMATS.get(DEFAULT_AUDIO_FORMAT, TTS_FORMATS["mp3"])[0]
+VOICE_UNCLEAR_RESPONSE = "I couldn't hear you clearly."
+VOICE_STT_ERROR_RESPONSE = "I couldn't hear that properly."
+VOICE_EMPTY_RESPONSE = "I couldn't hear anything."
+VOICE_INTENSITIES = ["gentle", "real", "ruthless"]
+
+def negotiate_audio_format(requested: Optional[str]) -> str:
+    """Pick the first supported format from a client preference list.
+
+    Accepts format names or MIME types, comma separated in order of preference
+    (e.g. "opus,mp3" or "audio/mpeg"); falls back to DEFAULT_AUDIO_FORMAT.
+    """
+    for candidate in (requested or "").split(","):
+        name = candidate.split(";")[0].strip().lower()
+        name = TTS_FORMAT_ALIASES.get(name, name)
+        if name in TTS_FORMATS:
+            return name
+    return DEFAULT_AUDIO_FORMAT if DEFAULT_AUDIO_FORMAT in TTS_FORMATS else "mp3"
+
+async def transcribe_audio(audio: Union[bytes, BinaryIO], filename: str = "audio.m4a",
+                           content_type: str = "audio/m4a") -> str:
+    """Speech-to-Text via Azure Whisper (raises on failure)
+
+    `audio` may be bytes or a binary file object (e.g. a spooled upload), which is
+    streamed into the request without being read into memory first.
+    """
+    processed = None
+    if STT_PREPROCESS:
+        # Mono 16 kHz, silence trimmed, Opus-encoded: less to upload and less for Whisper to decode
+        from services.audio_preprocess import preprocess_for_stt
+        processed = await preprocess_for_stt(audio)
+        if processed is not None:
+            if processed.is_silent:
+                print("[Voice] Audio is silent, skipping transcription")
+                return ""
+            audio, filename, content_type = processed.audio, processed.filename, processed.content_type
+
+    if STT_CHUNKING:
+        # Long voice notes: transcribe segments in parallel (None = short enough, or a
+        # segment failed: one request for the whole file instead)
+        from services.chunked_transcription import transcribe_long_audio
+        text = await transcribe_long_audio(
+            audio, WHISPER_DEPLOYMENT, llm_gateway.transcription,
+            pcm=processed.pcm if processed is not None else None
+        )
+        if text is not None:
+            return text
+
+    # Azure Whisper expects a file-like object or specific format.
+    # We can send raw bytes if we filename it .wav or .m4a
+    # IMPORTANT: Azure Whisper via 'audio.transcriptions' works similarly to OpenAI
+    response = await llm_gateway.transcription(
+        "voice_stt",
+        model=WHISPER_DEPLOYMENT,
+        deadline=30,
+        file=(filename, audio, content_type)  # M4A from mobile by default
+    )
+    return response.text
 
-    user_text = ""
-    # 1. Speech-to-Text (Whisper)
+def get_voice_settings(intensity: str) -> Dict:
+    """Select voice and prosody based on intensity (presets live in ssml_builder)"""
+    return get_voice_preset(intensity)
+
+async def _synthesize_segment(text: str, settings: Dict, intensity: str, output_format: str,
+                              pin: bool = False) -> bytes:
+    key = make_tts_key(text, settings, output_format)
+
+    async def synthesize() -> bytes:
+        print(f"[Voice] Using voice: {settings['voice_name']} (intensity: {intensity})")
+        return await tts_client.synthesize(build_ssml(text, settings), output_format)
+
+    return await tts_cache.get_or_synthesize(key, synthesize, pin=pin)
+
+async def synthesize_speech(text: str, intensity: str = "real", output_format: str = TTS_OUTPUT_FORMAT,
+                            pin: bool = False) -> bytes:
+    """Text-to-Speech (Azure TTS - Cognitive Services, cached); returns b"" on failure
+
+    Long replies are split into sentence-aligned segments that are synthesized
+    concurrently (each cached on its own) and joined without re-encoding, for
+    output formats that can be joined that way (not Ogg).
+    """
+    settings = get_voice_settings(intensity)
+    segments = split_segments(text) if can_concat(output_format) else [text]
+    if len(segments) <= 1:
+        return await _synthesize_segment(text, settings, intensity, output_format, pin)
+
+    semaphore = asyncio.Semaphore(TTS_SEGMENT_CONCURRENCY)
+
+    async def bounded(segment: str) -> bytes:
+        async with semaphore:
+            return await _synthesize_segment(segment, settings, intensity, output_format, pin)
+
+    parts = await asyncio.gather(*(bounded(segment) for segment in segments))
+    if not all(parts):
+        print(f"❌ Azure TTS: {parts.count(b'')} of {len(parts)} segments failed")
+        return b""
     try:
-        # Sanitize Base64
-        if "," in audio_base64:
-            audio_base64 = audio_base64.split(",")[1]
-            
-        if len(audio_base64) < 100:
-             print("[Voice] Audio too short")
-             return {"transcription": "", "response": "I couldn't hear you clearly.", "audioBase64": ""}
+        return concat_audio(parts, output_format)
+    except ValueError as e:
+        print(f"❌ Azure TTS: could not join segments: {e}")
+        return b""
+
+def get_canned_voice_phrases() -> List[str]:
+    """Fixed replies that are spoken often enough to keep synthesized"""
+    phrases = [
+        CRISIS_RESPONSE, HARM_RESPONSE, GUARDRAIL_REPLACEMENT, CHAT_ERROR_RESPONSE,
+        VOICE_UNCLEAR_RESPONSE, VOICE_STT_ERROR_RESPONSE, VOICE_EMPTY_RESPONSE,
+        GREETING_NEW,
+    ]
+    try:
+        greeting = get_initial_greeting()  # personalized variant, if a name is known
+        if greeting not in phrases:
+            phrases.append(greeting)
+    except Exception as e:
+        print(f"[Voice] Could not load personalized greeting for prewarm: {e}")
+    return phrases
+
+async def prewarm_voice_cache() -> int:
+    """Synthesize canned phrases for every voice so they play without a TTS round trip"""
+    phrases = get_canned_voice_phrases()
+    items = [(text, intensity) for text in phrases for intensity in VOICE_INTENSITIES]
+    return await tts_cache.prewarm(items, synthesize_speech)
+
+def _voice_result(transcription: str, response: str, audio: bytes, audio_format: str) -> Dict:
+    from services import metrics
+    audio_base64 = base64.b64encode(audio).decode("utf-8") if audio else ""
+    if audio:
+        metrics.observe("voice_response_bytes", len(audio_base64), format=audio_format)
+    return {
+        "transcription": transcription,
+        "response": response,
+        "audioBase64": audio_base64,
+        "audioFormat": audio_format,
+        "mimeType": TTS_FORMATS[audio_format][1],
+    }
+
+async def voice_reply(text: str, intensity: str, audio_format: str) -> Dict:
+    """Spoken canned reply (served from the TTS cache once prewarmed)"""
+    audio = await synthesize_speech(text, intensity, TTS_FORMATS[audio_format][0])
+    return _voice_result("", text, audio, audio_format)
+
+async def process_voice_message(audio_base64: str, conversation_history: List[Dict], intensity: str = "real",
+                                audio_format: Optional[str] = None) -> Dict:
+    """Process a base64 voice message (JSON /voice body)"""
+    audio_format = negotiate_audio_format(audio_format)
 
+    # Sanitize Base64
+    if "," in audio_base64:
+        audio_base64 = audio_base64.split(",")[1]
+
+    if len(audio_base64) < 100:
+        print("[Voice] Audio too short")
+        return await voice_reply(VOICE_UNCLEAR_RESPONSE, intensity, audio_format)
+
+    try:
         audio_bytes = base64.b64decode(audio_base64)
-        
-        # Azure Whisper expects a file-like object or specific format.
-        # We can send raw bytes if we filename it .wav or .m4a
-        # IMPORTANT: Azure Whisper via 'audio.transcriptions' works similarly to OpenAI
-        
-        response = await client.audio.transcriptions.create(
-            model=WHISPER_DEPLOYMENT,
-            file=("audio.m4a", audio_bytes, "audio/m4a")  # M4A from mobile
-        )
-        user_text = response.text
-        print(f"[Voice] Transcription: {user_text}")
+    except Exception as e:
+        print(f"[Voice] STT Error: {e}")
+        return await voice_reply(VOICE_STT_ERROR_RESPONSE, intensity, audio_format)
+    del audio_base64  # keep a single copy of the audio alive
+
+    return await process_voice_audio(audio_bytes, conversation_history, intensity, audio_format)
+
+async def process_voice_audio(audio: Union[bytes, BinaryIO], conversation_history: List[Dict],
+                              intensity: str = "real", audio_format: Optional[str] = None,
+                              filename: str = "audio.m4a", content_type: str = "audio/m4a") -> Dict:
+    """Process voice: Whisper STT → GPT-4o Chat → Azure TTS (in the negotiated audio format)"""
+    audio_format = negotiate_audio_format(audio_format)
+    print(f"[Voice] Processing audio with Azure (intensity: {intensity}, output: {audio_format})...")
 
+    user_text = ""
+    # 1. Speech-to-Text (Whisper)
+    try:
+        user_text = await transcribe_audio(audio, filename, content_type)
+        print(f"[Voice] Transcription: {user_text}")
     except Exception as e:
         print(f"[Voice] STT Error: {e}")
-        return {"transcription": "", "response": "I couldn't hear that properly.", "audioBase64": ""}
+        return await voice_reply(VOICE_STT_ERROR_RESPONSE, intensity, audio_format)
 
     if not user_text:
-         return {"transcription": "", "response": "I couldn't hear anything.", "audioBase64": ""}
+         return await voice_reply(VOICE_EMPTY_RESPONSE, intensity, audio_format)
     
     # 2. Get Response with intensity
     chat_result = await chat_with_emotion(user_text, conversation_history, "", intensity)
@@ -407,118 +653,10 @@ async def process_voice_message(audio_base64: str, conversation_history: List[Di
     resolved_intensity = chat_result.get("intensity", intensity)
     
     # 3. Text-to-Speech (Azure TTS - Cognitive Services)
-    audio_response_base64 = ""
-    try:
-        # Determine Region from Endpoint
-        region = "swedencentral"  # Default to swedencentral since that's where all services are
-        if "swedencentral" in AZURE_TTS_ENDPOINT:
-            region = "swedencentral"
-        elif "northcentralus" in AZURE_TTS_ENDPOINT:
-            region = "northcentralus"
-        elif "eastus" in AZURE_TTS_ENDPOINT:
-            region = "eastus"
-        elif "westus" in AZURE_TTS_ENDPOINT:
-            region = "westus"
-        
-        # Azure Speech REST API URL
-        tts_url = f"https://{region}.tts.speech.microsoft.com/cognitiveservices/v1"
-        
-        # Select voice and style based on intensity
-        if resolved_intensity == "gentle":
-            # Gentle: Soft, motherly, peaceful voice (Female, calm)
-            voice_name = "hi-IN-SwaraNeural"  # Soft female voice
-            rate = "-5%"  # Slower for calm
-            pitch = "+2Hz"  # Slightly higher for warmth
-            volume = "default"
-            
-        elif resolved_intensity == "ruthless":
-            # Ruthless (Valentine Mode): Deep, Warm, Intellectual Male Voice
-            # Using AndrewNeural (US) - Warm and articulate
-            voice_name = "en-US-AndrewNeural" 
-            rate = "-5%"  # Slightly slower for thoughtfulness
-            pitch = "-5Hz"  # Deeper for warmth/masculinity
-            volume = "+5%"
-            
-        else:  # real (default)
-            # Real: Friendly but firm (Female, friendly)
-            voice_name = "hi-IN-SwaraNeural"  # Same voice but different style
-            rate = "+5%"  # Slightly faster than gentle
-            pitch = "+0Hz"  # Normal pitch
-            volume = "default"
-        
-        # SSML Request with prosody control
-        if resolved_intensity == "ruthless":
-            # Valentine style: Empathetic, Warm
-            ssml = f"""
-            <speak version='1.0' xml:lang='en-US' xmlns:mstts='https://www.w3.org/2001/mstts'>
-                <voice name='{voice_name}'>
-                    <mstts:express-as style='empathetic' styledegree='1.2'>
-                        <prosody rate='{rate}' pitch='{pitch}' volume='{volume}'>
-                            {chat_result["response"]}
-                        </prosody>
-                    </mstts:express-as>
-                </voice>
-            </speak>
-            """
-        else:
-            ssml = f"""
-            <speak version='1.0' xml:lang='en-US'>
-                <voice name='{voice_name}'>
-                    <prosody rate='{rate}' pitch='{pitch}'>
-                        {chat_result["response"]}
-                    </prosody>
-                </voice>
-            </speak>
-            """
-        
-        print(f"[Voice] Using voice: {voice_name} (intensity: {resolved_intensity})")
-        
-        headers = {
-            "Ocp-Apim-Subscription-Key": AZURE_TTS_KEY,
-            "Content-Type": "application/ssml+xml",
-            "X-Microsoft-OutputFormat": "riff-24khz-16bit-mono-pcm",
-            "User-Agent": "SnehBackend"
-        }
-        
-        async with httpx.AsyncClient() as http_client:
-            tts_response = await http_client.post(tts_url, headers=headers, content=ssml)
-            
-            if tts_response.status_code == 200:
-                audio_response_base64 = base64.b64encode(tts_response.content).decode("utf-8")
-                print("[Voice] TTS generated successfully (Azure Cognitive Services)")
-            else:
-                print(f"❌ Azure TTS Failed: {tts_response.status_code} - {tts_response.text}")
-        
-    except Exception as e:
-        print(f"❌ Azure TTS Error: {e}")
-        
-    return {
-        "transcription": user_text,
-        "response": chat_result["response"],
-        "audioBase64": audio_response_base64
-    }
+    audio = await synthesize_speech(chat_result["response"], resolved_intensity, TTS_FORMATS[audio_format][0])
+    return _voice_result(user_text, chat_result["response"], audio, audio_format)
 
 # --- DSPy Language Model ---
 def get_dspy_lm():
-    """Get DSPy language model configured with Azure OpenAI"""
-    import dspy
-    
-    try:
-        # Configure DSPy to use Azure OpenAI
-        # Use the correct DSPy Azure OpenAI class
-        return dspy.LM(
-            model=f"azure/{CHAT_DEPLOYMENT}",
-            api_key=AZURE_OPENAI_KEY,
-            api_base=AZURE_OPENAI_ENDPOINT,
-            api_version="2024-08-01-preview",
-            max_tokens=1000
-        )
-    except Exception as e:
-        print(f"[DSPy] Error creating LM: {e}")
-        # Fallback to basic configuration
-        return dspy.LM(
-            model="gpt-4o",
-            api_key=AZURE_OPENAI_KEY,
-            max_tokens=1000
-        )
-
+    """Get DSPy language model configured with Azure OpenAI (settings from the LLM gateway)"""
+    return llm_gateway.build_dspy_lm()
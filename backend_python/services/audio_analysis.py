@@ -0,0 +1,64 @@
+"""
+Audio Analysis - Vectorized level statistics for PCM16 buffers
+RMS, peak, clipping ratio and silence fraction computed with NumPy over a
+zero-copy view of the buffer (no per-sample Python loop)
+"""
+import os
+from typing import Dict
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FRAME_MS = 20
+# Frame RMS below this (int16 units) counts as silence; matches the relay's old RMS < 100 check
+SILENCE_RMS = float(os.getenv("AUDIO_SILENCE_RMS", "100"))
+# Samples at or beyond this magnitude count as clipped
+CLIP_LEVEL = 32767 - 1
+
+
+def as_samples(pcm: bytes) -> np.ndarray:
+    """Zero-copy int16 view of little-endian PCM16 bytes (a trailing odd byte is ignored)"""
+    usable = len(pcm) - (len(pcm) % 2)
+    return np.frombuffer(memoryview(pcm)[:usable], dtype="<i2")
+
+
+def frame_rms(samples: np.ndarray, sample_rate: int, frame_ms: int = FRAME_MS) -> np.ndarray:
+    """RMS of each complete `frame_ms` frame"""
+    frame = sample_rate * frame_ms // 1000
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = samples[:n_frames * frame].reshape(n_frames, frame).astype(np.float32)
+    return np.sqrt(np.einsum("ij,ij->i", frames, frames) / frame)
+
+
+def analyze_pcm16(pcm: bytes, sample_rate: int = 24000, silence_rms: float = SILENCE_RMS) -> Dict:
+    """Level statistics for a mono PCM16 buffer"""
+    samples = as_samples(pcm)
+    count = len(samples)
+    if count == 0:
+        return {"samples": 0, "duration_ms": 0.0, "rms": 0.0, "peak": 0,
+                "clipping_ratio": 0.0, "silence_fraction": 1.0}
+
+    as_float = samples.astype(np.float32)
+    rms = float(np.sqrt(np.dot(as_float, as_float) / count))
+    peak = int(np.max(np.abs(samples.astype(np.int32))))
+    clipped = int(np.count_nonzero((samples >= CLIP_LEVEL) | (samples <= -CLIP_LEVEL)))
+
+    frames = frame_rms(samples, sample_rate)
+    silence_fraction = float(np.mean(frames < silence_rms)) if len(frames) else float(rms < silence_rms)
+
+    return {
+        "samples": count,
+        "duration_ms": count / sample_rate * 1000,
+        "rms": rms,
+        "peak": peak,
+        "clipping_ratio": clipped / count,
+        "silence_fraction": silence_fraction,
+    }
+
+
+def is_silent(stats: Dict, silence_rms: float = SILENCE_RMS) -> bool:
+    """Whole buffer below the silence threshold"""
+    return stats["rms"] < silence_rms
@@ -0,0 +1,242 @@
+"""
+Audio Frames - Binary WebSocket audio for the realtime relay
+Clients can send audio as binary frames instead of base64 inside JSON. Each
+frame is an 8-byte header followed by the payload:
+
+    format   u8   1 = PCM16 little-endian, 2 = Opus packet
+    flags    u8   bit 0 = commit after this frame, bit 1 = stereo
+    seq      u16  frame counter (wraps), used to spot gaps and reordering
+    rate     u32  sample rate of the payload in Hz
+
+Frames are decoded in arrival order with per-connection state (resampler,
+Opus decoder), so small chunks can be forwarded while the user is still talking.
+
+The same header is used downstream when the client connects with
+?audio=opus: response.audio.delta PCM is re-encoded to one Opus packet per
+binary frame (bit 2 of flags marks the last frame of a response).
+"""
+import os
+import time
+import struct
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from services import metrics
+from services.resampler import PolyphaseResampler, downmix, to_pcm16
+
+load_dotenv()
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# Downstream Opus bitrate (bits/s); speech is transparent well below 32k
+REALTIME_OPUS_BITRATE = int(os.getenv("REALTIME_OPUS_BITRATE", "24000"))
+
+FRAME_HEADER = struct.Struct("<BBHI")
+
+FORMAT_PCM16 = 1
+FORMAT_OPUS = 2
+FORMAT_NAMES = {FORMAT_PCM16: "pcm16", FORMAT_OPUS: "opus"}
+
+FLAG_COMMIT = 0x01
+FLAG_STEREO = 0x02
+FLAG_END = 0x04
+
+# Opus only runs at these rates
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+
+
+class FrameError(ValueError):
+    """A binary frame the relay can't use"""
+
+
+def parse_frame(data: bytes) -> Tuple[int, int, int, int, memoryview]:
+    """(format, flags, seq, sample_rate, payload) for one binary frame"""
+    if len(data) < FRAME_HEADER.size:
+        raise FrameError(f"Frame shorter than its {FRAME_HEADER.size}-byte header")
+    fmt, flags, seq, rate = FRAME_HEADER.unpack_from(data)
+    if fmt not in FORMAT_NAMES:
+        raise FrameError(f"Unknown audio format {fmt}")
+    if not 8000 <= rate <= 192000:
+        raise FrameError(f"Unsupported sample rate {rate}")
+    return fmt, flags, seq, rate, memoryview(data)[FRAME_HEADER.size:]
+
+
+class BinaryAudioStream:
+    """Per-connection decoder: binary frames in, 24 kHz mono PCM16 out"""
+
+    def __init__(self, sample_rate: int = 24000):
+        self.sample_rate = sample_rate
+        self.expected_seq: Optional[int] = None
+        self.resampler: Optional[PolyphaseResampler] = None
+        self.resampler_rate = 0
+        self.opus = None
+        self.opus_key: Optional[Tuple[int, int]] = None
+
+    def _check_seq(self, seq: int) -> None:
+        if self.expected_seq is not None and seq != self.expected_seq:
+            gap = (seq - self.expected_seq) & 0xFFFF
+            if gap < 0x8000:
+                metrics.increment("relay_frames_missing", gap)
+                print(f"[Frames] ⚠️ {gap} frame(s) missing before seq {seq}")
+            else:
+                metrics.increment("relay_frames_reordered")
+                print(f"[Frames] ⚠️ Late frame seq {seq} (expected {self.expected_seq})")
+                return
+        self.expected_seq = (seq + 1) & 0xFFFF
+
+    def _resample(self, mono: np.ndarray, rate: int) -> bytes:
+        if rate == self.sample_rate:
+            return to_pcm16(mono)
+        if self.resampler is None or self.resampler_rate != rate:
+            self.resampler = PolyphaseResampler(rate, self.sample_rate)
+            self.resampler_rate = rate
+        return to_pcm16(self.resampler.process(mono))
+
+    def _decode_opus(self, payload: memoryview, rate: int, channels: int) -> Tuple[np.ndarray, int]:
+        """Decoded mono samples and the rate libopus actually produced them at"""
+        if av is None:
+            raise FrameError("Opus frames need PyAV on the server (pip install av)")
+        if rate not in OPUS_RATES:
+            raise FrameError(f"Opus does not support {rate} Hz")
+        if self.opus is None or self.opus_key != (rate, channels):
+            self.opus = av.CodecContext.create("opus", "r")
+            self.opus.sample_rate = rate
+            self.opus.layout = "stereo" if channels == 2 else "mono"
+            self.opus_key = (rate, channels)
+        try:
+            frames = self.opus.decode(av.Packet(bytes(payload)))
+        except Exception as e:
+            raise FrameError(f"Opus decode failed: {e}")
+        decoded = []
+        for frame in frames:
+            rate = frame.sample_rate
+            samples = frame.to_ndarray()
+            if samples.dtype.kind == "f":
+                samples = samples * 32767.0
+            # Planar (channels, n) or packed (1, n * channels) → (n, channels)
+            decoded.append(samples.reshape(-1, channels) if frame.format.is_packed else samples.T)
+        if not decoded:
+            return np.zeros(0, dtype=np.float32), rate
+        return downmix(np.concatenate(decoded)), rate
+
+    def end_turn(self) -> bytes:
+        """Flush the resampler's look-ahead at a commit; the next frame starts fresh"""
+        if self.resampler is None:
+            return b""
+        tail = to_pcm16(self.resampler.flush())
+        self.resampler = None
+        return tail
+
+    def decode(self, data: bytes) -> Tuple[bytes, bool]:
+        """Decode one frame; returns (pcm16 at the relay rate, commit requested)"""
+        fmt, flags, seq, rate, payload = parse_frame(data)
+        self._check_seq(seq)
+        channels = 2 if flags & FLAG_STEREO else 1
+        metrics.increment("relay_binary_frames", format=FORMAT_NAMES[fmt])
+        metrics.increment("relay_binary_bytes", len(data), format=FORMAT_NAMES[fmt])
+
+        if fmt == FORMAT_PCM16:
+            usable = len(payload) - len(payload) % (2 * channels)
+            if rate == self.sample_rate and channels == 1:
+                return bytes(payload[:usable]), bool(flags & FLAG_COMMIT)
+            samples = np.frombuffer(payload[:usable], dtype="<i2").reshape(-1, channels)
+            mono = downmix(samples)
+        else:
+            mono, rate = self._decode_opus(payload, rate, channels)
+
+        pcm = self._resample(mono, rate)
+        if flags & FLAG_COMMIT:
+            return pcm + self.end_turn(), True
+        return pcm, False
+
+
+@lru_cache(maxsize=1)
+def opus_available() -> bool:
+    """PyAV is installed and its FFmpeg build has the libopus encoder (probed once)"""
+    if av is None:
+        return False
+    try:
+        av.CodecContext.create("libopus", "w")
+    except Exception as e:
+        print(f"[Frames] ⚠️ PyAV has no libopus encoder ({e}), Opus output disabled")
+        return False
+    return True
+
+
+class OpusFrameEncoder:
+    """Per-connection downstream encoder: 24 kHz PCM16 deltas in, binary Opus frames out"""
+
+    def __init__(self, sample_rate: int = 24000, bitrate: int = REALTIME_OPUS_BITRATE):
+        self.sample_rate = sample_rate
+        self.bitrate = bitrate
+        self.seq = 0
+        self.pending = b""
+        self.pts = 0
+        self.encoder = None
+        self._open()
+
+    def _open(self) -> None:
+        self.encoder = av.CodecContext.create("libopus", "w")
+        self.encoder.sample_rate = self.sample_rate
+        self.encoder.layout = "mono"
+        self.encoder.format = "s16"
+        self.encoder.bit_rate = self.bitrate
+        self.encoder.options = {"application": "audio"}
+        self.encoder.open()
+        self.frame_bytes = self.encoder.frame_size * 2
+        self.pending = b""
+        self.pts = 0
+
+    @property
+    def active(self) -> bool:
+        """Audio of the current response has been encoded but not finished"""
+        return self.pts > 0 or bool(self.pending)
+
+    def _frame(self, packet: bytes, flags: int = 0) -> bytes:
+        header = FRAME_HEADER.pack(FORMAT_OPUS, flags, self.seq, self.sample_rate)
+        self.seq = (self.seq + 1) & 0xFFFF
+        return header + packet
+
+    def _encode(self, pcm: bytes):
+        frame = av.AudioFrame.from_ndarray(np.frombuffer(pcm, dtype="<i2")[None, :], format="s16", layout="mono")
+        frame.sample_rate = self.sample_rate
+        frame.pts = self.pts
+        self.pts += len(pcm) // 2
+        return [bytes(packet) for packet in self.encoder.encode(frame)]
+
+    def encode(self, pcm: bytes) -> List[bytes]:
+        """Encode a PCM delta; returns binary frames for every complete 20 ms of audio"""
+        start = time.monotonic()
+        data = self.pending + pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self.pending = data[usable:]
+        frames = []
+        for offset in range(0, usable, self.frame_bytes):
+            frames.extend(self._frame(p) for p in self._encode(data[offset:offset + self.frame_bytes]))
+        self._record(pcm, frames, start)
+        return frames
+
+    def finish(self) -> List[bytes]:
+        """End of a response: pad the last partial frame, drain the encoder, mark the end"""
+        start = time.monotonic()
+        packets = []
+        if self.pending:
+            packets += self._encode(self.pending.ljust(self.frame_bytes, b"\x00"))
+        packets += [bytes(p) for p in self.encoder.encode(None)]
+        frames = [self._frame(p) for p in packets[:-1]]
+        frames.append(self._frame(packets[-1] if packets else b"", FLAG_END))
+        self._record(b"", frames, start)
+        # A drained encoder can't take more input: start the next response fresh
+        self._open()
+        return frames
+
+    @staticmethod
+    def _record(pcm: bytes, frames: List[bytes], start: float) -> None:
+        metrics.observe("opus_encode_ms", (time.monotonic() - start) * 1000)
+        # What the base64 JSON delta would have cost vs. what was sent
+        metrics.increment("relay_downstream_pcm_bytes", (len(pcm) + 2) // 3 * 4)
+        metrics.increment("relay_downstream_bytes", sum(len(f) for f in frames), format="opus")
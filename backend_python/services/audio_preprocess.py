@@ -0,0 +1,218 @@
+"""
+Audio Preprocess - Shrink voice uploads before Whisper transcription
+Decodes the client's recording to 16 kHz mono PCM (ffmpeg over pipes), trims
+leading/trailing silence by frame energy and re-encodes it compactly (Ogg/Opus,
+FLAC fallback). Enabled with STT_PREPROCESS=1.
+"""
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+import threading
+import subprocess
+from typing import BinaryIO, List, Optional, Tuple, Union
+import numpy as np
+from dotenv import load_dotenv
+from services import metrics
+from services.audio_analysis import as_samples, frame_rms
+
+load_dotenv()
+
+STT_PREPROCESS = os.getenv("STT_PREPROCESS", "0") == "1"
+STT_SAMPLE_RATE = 16000  # Whisper resamples everything to 16 kHz mono anyway
+# Frames quieter than this (dBFS) count as silence
+STT_SILENCE_THRESHOLD_DB = float(os.getenv("STT_SILENCE_THRESHOLD_DB", "-45"))
+# Silence kept around the voiced region so word onsets/tails aren't clipped
+STT_SILENCE_PADDING_MS = int(os.getenv("STT_SILENCE_PADDING_MS", "250"))
+STT_OPUS_BITRATE = os.getenv("STT_OPUS_BITRATE", "24k")
+
+FRAME_MS = 20
+PIPE_CHUNK = 64 * 1024
+
+# (codec args, filename, content type) tried in order
+ENCODINGS = [
+    (["-c:a", "libopus", "-b:a", STT_OPUS_BITRATE, "-application", "voip", "-f", "ogg"], "audio.ogg", "audio/ogg"),
+    (["-c:a", "flac", "-f", "flac"], "audio.flac", "audio/flac"),
+]
+
+
+def resolve_ffmpeg() -> str:
+    """Bundled ffmpeg_runtime binary if present, otherwise ffmpeg from PATH"""
+    runtime_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "ffmpeg_runtime", "bin"))
+    for name in ("ffmpeg.exe", "ffmpeg"):
+        candidate = os.path.join(runtime_dir, name)
+        if os.path.exists(candidate):
+            return candidate
+    return shutil.which("ffmpeg") or "ffmpeg"
+
+
+class PreprocessedAudio:
+    """Result of preprocessing one recording"""
+
+    def __init__(self, audio: bytes, filename: str, content_type: str,
+                 original_bytes: int, duration_ms: float, trimmed_ms: float, pcm: bytes = b""):
+        self.audio = audio
+        self.pcm = pcm  # trimmed 16 kHz mono PCM, reused by chunked transcription
+        self.filename = filename
+        self.content_type = content_type
+        self.original_bytes = original_bytes
+        self.duration_ms = duration_ms
+        self.trimmed_ms = trimmed_ms
+
+    @property
+    def is_silent(self) -> bool:
+        return not self.audio
+
+
+def _run_ffmpeg(args: List[str], source: Union[bytes, BinaryIO]) -> Tuple[int, bytes, bytes]:
+    """Run ffmpeg with `source` on stdin and return (returncode, stdout, stderr)"""
+    proc = subprocess.Popen(
+        [resolve_ffmpeg(), "-hide_banner", "-loglevel", "error", *args],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+
+    def feed():
+        try:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                proc.stdin.write(source)
+            else:
+                shutil.copyfileobj(source, proc.stdin, PIPE_CHUNK)
+        except (BrokenPipeError, OSError):
+            pass  # ffmpeg exited early; its stderr says why
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    stderr_chunks = []
+    writer = threading.Thread(target=feed, daemon=True)
+    reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+    writer.start()
+    reader.start()
+    stdout = proc.stdout.read()
+    writer.join()
+    reader.join()
+    return proc.wait(), stdout, b"".join(stderr_chunks)
+
+
+def decode_to_pcm(source: Union[bytes, BinaryIO], sample_rate: int = STT_SAMPLE_RATE) -> Optional[bytes]:
+    """Any container/codec → mono s16le PCM at `sample_rate` (blocking; None on failure)"""
+    output_args = ["-vn", "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "pipe:1"]
+    code, pcm, stderr = _run_ffmpeg(["-i", "pipe:0", *output_args], source)
+    if code == 0 and pcm:
+        return pcm
+
+    # MP4/M4A with the moov atom at the end can't be demuxed from a pipe: retry from a temp file
+    if not isinstance(source, (bytes, bytearray)):
+        source.seek(0)
+    fd, path = tempfile.mkstemp(suffix=".audio")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(source, (bytes, bytearray)):
+                f.write(source)
+            else:
+                shutil.copyfileobj(source, f, PIPE_CHUNK)
+        code, pcm, stderr = _run_ffmpeg(["-i", path, *output_args], b"")
+    finally:
+        os.remove(path)
+    if code != 0 or not pcm:
+        print(f"[Preprocess] Decode failed: {stderr.decode('utf-8', 'replace')[-300:]}")
+        return None
+    return pcm
+
+
+def trim_silence(pcm: bytes, sample_rate: int = STT_SAMPLE_RATE) -> bytes:
+    """Drop leading/trailing frames below STT_SILENCE_THRESHOLD_DB (b"" if all silent)"""
+    samples = as_samples(pcm)
+    frame = sample_rate * FRAME_MS // 1000
+    rms = frame_rms(samples, sample_rate, FRAME_MS)
+    if len(rms) == 0:
+        return pcm
+
+    threshold = 32768.0 * (10 ** (STT_SILENCE_THRESHOLD_DB / 20))
+    voiced = np.flatnonzero(rms > threshold)
+    if len(voiced) == 0:
+        return b""
+
+    pad = STT_SILENCE_PADDING_MS // FRAME_MS
+    start = max(0, voiced[0] - pad) * frame
+    end = min(len(samples), (voiced[-1] + 1 + pad) * frame)
+    return samples[start:end].tobytes()
+
+
+def encode_pcm(pcm: bytes) -> Optional[Tuple[bytes, str, str]]:
+    """16 kHz mono PCM → (audio, filename, content type) in the first codec that works (blocking)"""
+    input_args = ["-f", "s16le", "-ar", str(STT_SAMPLE_RATE), "-ac", "1", "-i", "pipe:0"]
+    for codec_args, filename, content_type in ENCODINGS:
+        code, encoded, stderr = _run_ffmpeg([*input_args, *codec_args, "pipe:1"], pcm)
+        if code == 0 and encoded:
+            return encoded, filename, content_type
+        print(f"[Preprocess] {filename} encode failed: {stderr.decode('utf-8', 'replace')[-200:]}")
+    return None
+
+
+def _preprocess(source: Union[bytes, BinaryIO], original_bytes: int) -> Optional[PreprocessedAudio]:
+    pcm = decode_to_pcm(source)
+    if pcm is None:
+        return None
+    duration_ms = len(pcm) / 2 / STT_SAMPLE_RATE * 1000
+
+    trimmed = trim_silence(pcm)
+    trimmed_ms = duration_ms - len(trimmed) / 2 / STT_SAMPLE_RATE * 1000
+    if not trimmed:
+        return PreprocessedAudio(b"", "", "", original_bytes, duration_ms, trimmed_ms)
+
+    encoded = encode_pcm(trimmed)
+    if encoded is None:
+        return None
+    audio, filename, content_type = encoded
+    return PreprocessedAudio(audio, filename, content_type, original_bytes, duration_ms, trimmed_ms, trimmed)
+
+
+def _source_size(source: Union[bytes, BinaryIO]) -> int:
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(0)
+    return size
+
+
+async def preprocess_for_stt(source: Union[bytes, BinaryIO]) -> Optional[PreprocessedAudio]:
+    """Normalize a recording for Whisper; None means "send the original".
+
+    The ffmpeg/NumPy work runs in a worker thread. The result is only used when it
+    is smaller than the original upload (or is all silence).
+    """
+    original_bytes = _source_size(source)
+    start = time.monotonic()
+    try:
+        result = await asyncio.to_thread(_preprocess, source, original_bytes)
+    except FileNotFoundError:
+        print("❌ FFmpeg not found! Skipping STT preprocessing")
+        result = None
+    except Exception as e:
+        print(f"[Preprocess] Error: {e}")
+        result = None
+    finally:
+        if not isinstance(source, (bytes, bytearray)):
+            source.seek(0)
+    elapsed = (time.monotonic() - start) * 1000
+    metrics.observe("stt_preprocess_ms", elapsed)
+
+    if result is None:
+        metrics.increment("stt_preprocess_skipped", reason="error")
+        return None
+    if not result.is_silent and len(result.audio) >= original_bytes:
+        metrics.increment("stt_preprocess_skipped", reason="not_smaller")
+        print(f"[Preprocess] Kept original ({original_bytes} bytes ≤ {len(result.audio)} bytes) after {elapsed:.0f}ms")
+        return None
+
+    saved = original_bytes - len(result.audio)
+    metrics.observe("stt_preprocess_bytes_saved", saved)
+    metrics.observe("stt_trimmed_silence_ms", result.trimmed_ms)
+    print(f"[Preprocess] {original_bytes} → {len(result.audio)} bytes ({result.content_type or 'silent'}), "
+          f"trimmed {result.trimmed_ms:.0f}ms silence from {result.duration_ms:.0f}ms in {elapsed:.0f}ms")
+    return result
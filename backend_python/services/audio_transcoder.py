@@ -0,0 +1,97 @@
+"""
+Audio Transcoder - Client audio → 24 kHz mono PCM16 for the Azure Realtime relay
+WAV is parsed and resampled in-process with NumPy. Anything else is decoded
+with PyAV when it is installed; otherwise the chunk is piped through ffmpeg
+(stdin → stdout). No path writes files to the working directory.
+"""
+import io
+import os
+import time
+from typing import Optional
+from dotenv import load_dotenv
+from services import metrics
+from services.audio_preprocess import decode_to_pcm
+from services.wav_parser import parse_wav
+from services.resampler import resample_pcm16
+
+load_dotenv()
+
+REALTIME_SAMPLE_RATE = 24000
+# "auto" (PyAV if importable, else ffmpeg), "pyav" or "ffmpeg"
+TRANSCODER_BACKEND = os.getenv("TRANSCODER_BACKEND", "auto")
+
+try:
+    import av
+except ImportError:
+    av = None
+
+
+def _decode_pyav(audio_bytes: bytes, sample_rate: int) -> Optional[bytes]:
+    """Demux/decode/resample in-process (the container is read from memory)"""
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=sample_rate)
+    pcm = bytearray()
+    with av.open(io.BytesIO(audio_bytes), mode="r") as container:
+        stream = container.streams.audio[0]
+        for frame in container.decode(stream):
+            for resampled in resampler.resample(frame):
+                pcm += resampled.to_ndarray().tobytes()
+    for resampled in resampler.resample(None):  # flush buffered samples
+        pcm += resampled.to_ndarray().tobytes()
+    return bytes(pcm) or None
+
+
+class AudioTranscoder:
+    """Picks a decode backend once and converts audio chunks with it"""
+
+    def __init__(self, backend: str = TRANSCODER_BACKEND):
+        if backend == "auto":
+            backend = "pyav" if av is not None else "ffmpeg"
+        if backend == "pyav" and av is None:
+            print("[Transcoder] PyAV not installed, falling back to ffmpeg pipes")
+            backend = "ffmpeg"
+        self.backend = backend
+
+    def to_pcm16(self, audio_bytes: bytes, input_format: str,
+                 sample_rate: int = REALTIME_SAMPLE_RATE) -> Optional[bytes]:
+        """Convert one chunk to mono PCM16 (blocking; None on failure)"""
+        start = time.monotonic()
+        if input_format == "wav":
+            pcm = self._wav_to_pcm16(audio_bytes, sample_rate)
+            if pcm is not None:
+                metrics.observe("transcode_ms", (time.monotonic() - start) * 1000, backend="numpy", format="wav")
+                return pcm or None
+            # Not RIFF, or a compressed codec in a WAV container (ADPCM, µ-law...)
+            print(f"⚠️ Not a PCM WAV ({len(audio_bytes)} bytes), decoding with {self.backend}")
+
+        try:
+            if self.backend == "pyav":
+                pcm = _decode_pyav(audio_bytes, sample_rate)
+            else:
+                pcm = decode_to_pcm(audio_bytes, sample_rate)
+        except FileNotFoundError:
+            print("❌ FFmpeg not found! Please ensure FFmpeg is in PATH")
+            return None
+        except Exception as e:
+            print(f"⚠️ {self.backend} decode failed ({input_format}): {e}")
+            metrics.increment("transcode_errors", backend=self.backend, format=input_format)
+            return None
+        metrics.observe("transcode_ms", (time.monotonic() - start) * 1000, backend=self.backend, format=input_format)
+        return pcm
+
+    @staticmethod
+    def _wav_to_pcm16(audio_bytes: bytes, sample_rate: int) -> Optional[bytes]:
+        """Parse + downmix + resample; None if the WAV needs a real decoder"""
+        wav = parse_wav(audio_bytes)
+        if wav is None:
+            return None
+        if wav.is_pcm16(sample_rate):
+            return bytes(wav.data[:wav.frames * 2])
+        try:
+            return resample_pcm16(wav.samples(), wav.sample_rate, sample_rate)
+        except ValueError as e:
+            print(f"⚠️ Unsupported WAV layout: {e}")
+            return None
+
+
+# Singleton instance
+audio_transcoder = AudioTranscoder()
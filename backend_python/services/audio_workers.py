@@ -0,0 +1,170 @@
+"""
+Audio Workers - Off-loop audio conversion for the realtime relay
+Conversions run in a bounded thread pool shared by every connection, so a slow
+decode never blocks the event loop. Each connection forwards its events in the
+order they arrived (a commit never overtakes the audio before it) through a
+bounded queue, and when the pool is saturated new chunks are shed or delayed per
+AUDIO_OVERLOAD_POLICY.
+"""
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional, Union
+from dotenv import load_dotenv
+from services import metrics
+from services.realtime_relay import RELAY_SEND_TIMEOUT, RELAY_UPSTREAM_QUEUE_MAX, RelayStalled
+
+load_dotenv()
+
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Conversions queued or running across all connections before the overload policy applies
+AUDIO_QUEUE_MAX = int(os.getenv("AUDIO_QUEUE_MAX", "32"))
+# "shed" drops new chunks while saturated; "delay" waits up to AUDIO_OVERLOAD_DELAY first
+AUDIO_OVERLOAD_POLICY = os.getenv("AUDIO_OVERLOAD_POLICY", "delay")
+AUDIO_OVERLOAD_DELAY = float(os.getenv("AUDIO_OVERLOAD_DELAY", "0.5"))
+
+
+class ConversionPool:
+    """Shared worker threads plus admission control"""
+
+    def __init__(self, workers: int = AUDIO_WORKERS, max_pending: int = AUDIO_QUEUE_MAX):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="audio-convert")
+        self.max_pending = max_pending
+        self.pending = 0
+        self.capacity: Optional[asyncio.Condition] = None
+        self.notifying = set()
+
+    def _condition(self) -> asyncio.Condition:
+        if self.capacity is None:
+            self.capacity = asyncio.Condition()
+        return self.capacity
+
+    def _report(self) -> None:
+        metrics.set_gauge("audio_convert_queue_depth", self.pending)
+
+    async def admit(self) -> bool:
+        """Reserve a pending slot; False means the chunk should be shed"""
+        if self.pending < self.max_pending:
+            self.pending += 1
+            self._report()
+            return True
+        if AUDIO_OVERLOAD_POLICY != "delay":
+            return False
+
+        start = time.monotonic()
+        condition = self._condition()
+        async with condition:
+            try:
+                await asyncio.wait_for(
+                    condition.wait_for(lambda: self.pending < self.max_pending),
+                    AUDIO_OVERLOAD_DELAY
+                )
+            except asyncio.TimeoutError:
+                return False
+            self.pending += 1
+        metrics.observe("audio_convert_admission_wait_ms", (time.monotonic() - start) * 1000)
+        self._report()
+        return True
+
+    async def _notify(self) -> None:
+        if self.capacity is not None:
+            async with self.capacity:
+                self.capacity.notify()
+
+    def _release(self, start: float) -> None:
+        """The worker thread is done with a conversion (runs on the loop)"""
+        metrics.observe("audio_convert_ms", (time.monotonic() - start) * 1000)
+        self.pending -= 1
+        self._report()
+        if self.capacity is not None:
+            task = asyncio.create_task(self._notify())
+            self.notifying.add(task)
+            task.add_done_callback(self.notifying.discard)
+
+    async def run(self, fn: Callable, *args):
+        """Run an admitted conversion on a worker thread.
+
+        The slot is released when the thread finishes, not when the caller stops
+        waiting: a cancelled caller can't cancel a conversion that has started,
+        so it still counts against the limit until it ends.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda _: loop.is_closed() or loop.call_soon_threadsafe(self._release, start))
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Shared by all connections on this node
+conversion_pool = ConversionPool()
+
+
+class OrderedConverter:
+    """Per-connection forwarder: conversions overlap, sends stay in arrival order.
+
+    The queue is bounded, so when Azure drains slowly the submitters wait, and
+    the client's socket backs up instead of this process buffering without limit.
+    """
+
+    def __init__(self, send: Callable[[Dict], Awaitable[None]],
+                 on_shed: Optional[Callable[[Dict], Awaitable[None]]] = None,
+                 pool: ConversionPool = conversion_pool, maxsize: int = RELAY_UPSTREAM_QUEUE_MAX):
+        self.send = send
+        self.on_shed = on_shed
+        self.pool = pool
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.shed = 0
+        self.max_lag_ms = 0.0
+
+    async def _put(self, event: Dict, task: Optional[asyncio.Task]) -> None:
+        try:
+            await asyncio.wait_for(self.queue.put((event, task, time.monotonic())), RELAY_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            if task is not None:
+                task.cancel()
+            raise RelayStalled(f"upstream queue full for {RELAY_SEND_TIMEOUT:g}s")
+        metrics.set_gauge("relay_queue_depth", self.queue.qsize(), direction="upstream")
+
+    async def submit_audio(self, event: Dict, convert: Callable[..., Optional[Union[str, bytes]]], *args) -> bool:
+        """Queue an audio event whose "audio" is replaced by convert(*args); False if shed"""
+        if not await self.pool.admit():
+            self.shed += 1
+            metrics.increment("audio_convert_shed", policy=AUDIO_OVERLOAD_POLICY)
+            print(f"[Audio] ⚠️ Conversion pool saturated, dropped chunk ({self.shed} this connection)")
+            if self.on_shed:
+                await self.on_shed(event)
+            return False
+        task = asyncio.create_task(self.pool.run(convert, *args))
+        await self._put(event, task)
+        return True
+
+    async def submit_event(self, event: Dict) -> None:
+        """Queue a pass-through event behind any audio still converting"""
+        await self._put(event, None)
+
+    async def run(self) -> None:
+        """Send queued events in order until cancelled"""
+        try:
+            while True:
+                event, task, queued_at = await self.queue.get()
+                metrics.set_gauge("relay_queue_depth", self.queue.qsize(), direction="upstream")
+                if task is not None:
+                    converted = await task
+                    if not converted:
+                        print("   ❌ SKIPPING AUDIO: Conversion failed")
+                        continue
+                    event["audio"] = converted
+                await asyncio.wait_for(self.send(event), RELAY_SEND_TIMEOUT)
+                lag_ms = (time.monotonic() - queued_at) * 1000
+                self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+                metrics.observe("relay_lag_ms", lag_ms, direction="upstream")
+        finally:
+            # Connection is gone: cancel whatever is still queued
+            while not self.queue.empty():
+                _, task, _ = self.queue.get_nowait()
+                if task is not None:
+                    task.cancel()
@@ -0,0 +1,174 @@
+"""
+Chunked Transcription - Parallel Whisper transcription for long voice notes
+Long recordings are cut at the quietest point near each target boundary, with a
+short overlap on both sides, transcribed concurrently and stitched back in order
+with duplicated boundary words removed. Enabled with STT_CHUNKING=1.
+"""
+import os
+import re
+import time
+import asyncio
+from typing import BinaryIO, List, Optional, Tuple, Union
+import numpy as np
+from dotenv import load_dotenv
+from services import metrics
+from services.audio_preprocess import STT_SAMPLE_RATE, FRAME_MS, decode_to_pcm, encode_pcm
+from services.audio_analysis import as_samples, frame_rms
+
+load_dotenv()
+
+STT_CHUNKING = os.getenv("STT_CHUNKING", "0") == "1"
+# Recordings shorter than this are transcribed in one request
+STT_CHUNK_MIN_SECONDS = float(os.getenv("STT_CHUNK_MIN_SECONDS", "60"))
+# Uploads smaller than this can't be long enough to chunk; skips the decode (≈60s of 64 kbps AAC)
+STT_CHUNK_MIN_BYTES = int(os.getenv("STT_CHUNK_MIN_BYTES", str(480 * 1024)))
+STT_CHUNK_SECONDS = float(os.getenv("STT_CHUNK_SECONDS", "30"))
+# How far either side of the target boundary to look for a pause
+STT_CHUNK_SEARCH_SECONDS = float(os.getenv("STT_CHUNK_SEARCH_SECONDS", "5"))
+STT_CHUNK_OVERLAP_MS = int(os.getenv("STT_CHUNK_OVERLAP_MS", "500"))
+STT_CHUNK_CONCURRENCY = int(os.getenv("STT_CHUNK_CONCURRENCY", "4"))
+
+# Longest run of words checked for duplication across a boundary
+MAX_OVERLAP_WORDS = 8
+
+_WORD = re.compile(r"[\w']+")
+
+
+def find_split_points(pcm: bytes, sample_rate: int = STT_SAMPLE_RATE) -> List[int]:
+    """Sample offsets to cut at: the lowest-energy frame near every STT_CHUNK_SECONDS"""
+    frame = sample_rate * FRAME_MS // 1000
+    energy = frame_rms(as_samples(pcm), sample_rate, FRAME_MS)
+    n_frames = len(energy)
+    if n_frames == 0:
+        return []
+
+    target = int(STT_CHUNK_SECONDS * 1000 / FRAME_MS)
+    search = int(STT_CHUNK_SEARCH_SECONDS * 1000 / FRAME_MS)
+    splits = []
+    last = 0
+    while n_frames - last > target + search:
+        lo = max(last + 1, last + target - search)
+        hi = min(n_frames - 1, last + target + search)
+        cut = lo + int(np.argmin(energy[lo:hi]))
+        splits.append(cut * frame)
+        last = cut
+    return splits
+
+
+def segment_bounds(total: int, splits: List[int], overlap: int) -> List[Tuple[int, int]]:
+    """(start, end) sample ranges, each extended by `overlap` past its cut points"""
+    edges = [0] + splits + [total]
+    return [
+        (max(0, edges[i] - overlap), min(total, edges[i + 1] + overlap))
+        for i in range(len(edges) - 1)
+    ]
+
+
+def _normalize(word: str) -> str:
+    return word.lower().strip("'")
+
+
+def stitch_transcripts(parts: List[str]) -> str:
+    """Join segment transcripts, dropping words repeated across each overlap"""
+    text = ""
+    for part in parts:
+        part = part.strip()
+        if not part:
+            continue
+        if not text:
+            text = part
+            continue
+        previous = [_normalize(w) for w in _WORD.findall(text)[-MAX_OVERLAP_WORDS:]]
+        matches = list(_WORD.finditer(part))
+        current = [_normalize(m.group()) for m in matches[:MAX_OVERLAP_WORDS]]
+        dropped = 0
+        for k in range(min(len(previous), len(current)), 0, -1):
+            if previous[-k:] == current[:k]:
+                dropped = k
+                break
+        if dropped:
+            part = part[matches[dropped - 1].end():].lstrip(" ,.;:!?-")
+        if part:
+            text = f"{text} {part}"
+    return text
+
+
+async def _transcribe_segment(index: int, pcm: bytes, semaphore: asyncio.Semaphore,
+                              model: str, transcribe) -> str:
+    async with semaphore:
+        encoded = await asyncio.to_thread(encode_pcm, pcm)
+        if encoded is None:
+            raise RuntimeError(f"Could not encode segment {index}")
+        audio, filename, content_type = encoded
+        start = time.monotonic()
+        response = await transcribe(
+            "voice_stt_chunk",
+            model=model,
+            deadline=60,
+            file=(filename, audio, content_type)
+        )
+        metrics.observe("stt_chunk_ms", (time.monotonic() - start) * 1000)
+        return response.text
+
+
+async def transcribe_long_audio(source: Union[bytes, BinaryIO], model: str, transcribe,
+                                pcm: Optional[bytes] = None) -> Optional[str]:
+    """Transcribe a long recording in parallel segments.
+
+    `transcribe` is the gateway's transcription call. Returns None when the
+    recording is too short to benefit (or can't be decoded), or when a segment
+    fails after the gateway's retries (the other segments are cancelled), so
+    the caller falls back to a single request.
+    """
+    if pcm is None:
+        if isinstance(source, (bytes, bytearray)):
+            size = len(source)
+        else:
+            source.seek(0, os.SEEK_END)
+            size = source.tell()
+            source.seek(0)
+        if size < STT_CHUNK_MIN_BYTES:
+            return None
+        try:
+            pcm = await asyncio.to_thread(decode_to_pcm, source)
+        except FileNotFoundError:
+            print("❌ FFmpeg not found! Skipping chunked transcription")
+            return None
+        finally:
+            if not isinstance(source, (bytes, bytearray)):
+                source.seek(0)
+        if pcm is None:
+            return None
+
+    total = len(pcm) // 2
+    duration = total / STT_SAMPLE_RATE
+    if duration < STT_CHUNK_MIN_SECONDS:
+        return None
+
+    start = time.monotonic()
+    splits = await asyncio.to_thread(find_split_points, pcm)
+    overlap = STT_SAMPLE_RATE * STT_CHUNK_OVERLAP_MS // 1000
+    bounds = segment_bounds(total, splits, overlap)
+    semaphore = asyncio.Semaphore(STT_CHUNK_CONCURRENCY)
+    tasks = [
+        asyncio.create_task(_transcribe_segment(i, pcm[s * 2:e * 2], semaphore, model, transcribe))
+        for i, (s, e) in enumerate(bounds)
+    ]
+    try:
+        parts = await asyncio.gather(*tasks)
+    except Exception as e:
+        print(f"[STT] ⚠️ Segment transcription failed ({e}), falling back to a single request")
+        metrics.increment("stt_chunked_fallbacks")
+        return None
+    finally:
+        # First failure: stop the sibling requests instead of letting them run (and bill) on
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    text = stitch_transcripts(parts)
+
+    elapsed = (time.monotonic() - start) * 1000
+    metrics.observe("stt_chunked_ms", elapsed)
+    metrics.observe("stt_chunk_count", len(bounds))
+    print(f"[STT] Transcribed {duration:.0f}s in {len(bounds)} segments in {elapsed:.0f}ms")
+    return text
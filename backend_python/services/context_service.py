@@ -140,15 +140,23 @@ def delete_context(context_id: str) -> bool:
         print(f"Error deleting context from DB: {e}")
         return False
 
+def get_active_contexts() -> List[Dict]:
+    """Get all non-archived contexts from PostgreSQL"""
+    return [ctx for ctx in get_all_contexts() if ctx.get('status') != 'archived']
+
+def format_context_line(ctx: Dict) -> str:
+    """Format a single context as a line for AI prompts"""
+    priority_emoji = {"high": "🔴", "medium": "🟡", "low": "🟢"}.get(ctx['priority'], "⚪")
+    status_text = ctx['status'].replace('_', ' ').title()
+    
+    line = f"{priority_emoji} {ctx['title']} ({status_text})"
+    if ctx.get('description'):
+        line += f" - {ctx['description']}"
+    return line
+
 def get_contexts_summary_for_ai() -> str:
     """Get formatted summary of contexts from PostgreSQL for AI prompts"""
-    contexts = get_all_contexts()
-    
-    if not contexts:
-        return "No active contexts."
-    
-    # Filter out archived
-    active_contexts = [ctx for ctx in contexts if ctx.get('status') != 'archived']
+    active_contexts = get_active_contexts()
     
     if not active_contexts:
         return "No active contexts."
@@ -156,14 +164,7 @@ def get_contexts_summary_for_ai() -> str:
     summary_lines = ["ACTIVE USER CONTEXTS:"]
     
     for ctx in active_contexts:
-        priority_emoji = {"high": "🔴", "medium": "🟡", "low": "🟢"}.get(ctx['priority'], "⚪")
-        status_text = ctx['status'].replace('_', ' ').title()
-        
-        line = f"{priority_emoji} {ctx['title']} ({status_text})"
-        if ctx.get('description'):
-            line += f" - {ctx['description']}"
-        
-        summary_lines.append(line)
+        summary_lines.append(format_context_line(ctx))
     
     return "\n".join(summary_lines)
 
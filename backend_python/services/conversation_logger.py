@@ -0,0 +1,171 @@
+"""
+Conversation Logger - Non-blocking, buffered daily conversation logs
+Records are queued from the event loop and written in batches by a background
+thread; previous days' files are gzip-compressed on rotation
+"""
+import os
+import gzip
+import time
+import queue
+import atexit
+import asyncio
+import shutil
+import threading
+from datetime import datetime, date
+from pathlib import Path
+from typing import Optional
+from dotenv import load_dotenv
+from services import metrics
+
+load_dotenv()
+
+LOG_DIR = Path(__file__).parent.parent / "log"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.5"))
+LOG_COMPRESS_ROTATED = os.getenv("LOG_COMPRESS_ROTATED", "1") == "1"
+# When the queue is full: "drop" immediately, or "block" (yield to the loop) up to LOG_BLOCK_TIMEOUT
+LOG_FULL_POLICY = os.getenv("LOG_FULL_POLICY", "block")
+LOG_BLOCK_TIMEOUT = float(os.getenv("LOG_BLOCK_TIMEOUT", "0.05"))
+
+_STOP = object()
+
+
+class ConversationLogger:
+    """Background writer thread fed by a bounded queue"""
+
+    def __init__(self, log_dir: Path = LOG_DIR, max_queue: int = LOG_QUEUE_SIZE):
+        self.log_dir = log_dir
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self.thread: Optional[threading.Thread] = None
+        self.start_lock = threading.Lock()
+        self.current_date: Optional[date] = None
+        self.file = None
+        self.dropped = 0
+
+    # ---- producer side (event loop) ---------------------------------------
+
+    def _ensure_started(self) -> None:
+        if self.thread and self.thread.is_alive():
+            return
+        with self.start_lock:
+            if self.thread and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._run, name="conversation-logger", daemon=True)
+            self.thread.start()
+
+    def enqueue(self, msg_type: str, message: str) -> bool:
+        """Queue a record without blocking; returns False if the queue is full"""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait((datetime.now(), msg_type, message))
+        except queue.Full:
+            return False
+        metrics.set_gauge("conversation_log_queue_depth", self.queue.qsize())
+        return True
+
+    async def log(self, msg_type: str, message: str) -> None:
+        """Queue a record from async code, applying the configured full-queue policy"""
+        if self.enqueue(msg_type, message):
+            return
+
+        if LOG_FULL_POLICY == "block":
+            # Backpressure on the calling coroutine only; the event loop keeps running
+            deadline = time.monotonic() + LOG_BLOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.005)
+                if self.enqueue(msg_type, message):
+                    metrics.increment("conversation_log_backpressure")
+                    return
+
+        self.dropped += 1
+        metrics.increment("conversation_log_dropped")
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            print(f"[Log] ⚠️ Log queue full, dropped {self.dropped} records so far")
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Flush pending records and stop the writer thread"""
+        if not self.thread or not self.thread.is_alive():
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            print("[Log] ⚠️ Could not signal logger shutdown (queue full)")
+            return
+        self.thread.join(timeout)
+
+    # ---- writer side (background thread) ----------------------------------
+
+    def _path_for(self, day: date) -> Path:
+        return self.log_dir / f"conversation_{day}.txt"
+
+    def _compress(self, path: Path) -> None:
+        """gzip a finished day's log and remove the plain file"""
+        if not LOG_COMPRESS_ROTATED or not path.exists():
+            return
+        try:
+            with open(path, "rb") as src, gzip.open(f"{path}.gz", "ab") as dst:
+                shutil.copyfileobj(src, dst)
+            path.unlink()
+        except Exception as e:
+            print(f"[Log] Error compressing {path.name}: {e}")
+
+    def _compress_stale(self, today: date) -> None:
+        """Compress any uncompressed logs left over from earlier days"""
+        for path in self.log_dir.glob("conversation_*.txt"):
+            if path != self._path_for(today):
+                self._compress(path)
+
+    def _rotate(self, day: date) -> None:
+        if self.file:
+            self.file.close()
+            self.file = None
+            self._compress(self._path_for(self.current_date))
+        self.current_date = day
+        self.file = open(self._path_for(day), "a", encoding="utf-8")
+
+    def _write_batch(self, batch) -> None:
+        for timestamp, msg_type, message in batch:
+            if timestamp.date() != self.current_date:
+                self._rotate(timestamp.date())
+            self.file.write(f"[{timestamp.isoformat()}] {msg_type}: {message}\n")
+        self.file.flush()
+        metrics.increment("conversation_log_records", len(batch))
+
+    def _run(self) -> None:
+        self.log_dir.mkdir(exist_ok=True)
+        self._compress_stale(date.today())
+        stopping = False
+        while not stopping:
+            try:
+                item = self.queue.get(timeout=LOG_FLUSH_INTERVAL)
+            except queue.Empty:
+                continue
+
+            batch = []
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= LOG_BATCH_SIZE:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    print(f"[Log] Error writing {len(batch)} records: {e}")
+
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+# Singleton instance
+conversation_logger = ConversationLogger()
+atexit.register(conversation_logger.close)
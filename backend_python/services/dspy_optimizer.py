@@ -3,18 +3,17 @@ DSPy Integration - Prompt optimization module
 Uses DSPy for systematic prompt engineering
 """
 import dspy
-import os
 from typing import Optional
 
-# Configure DSPy with Azure OpenAI
-lm = dspy.AzureOpenAI(
-    api_base=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_key=os.getenv("AZURE_OPENAI_KEY"),
-    deployment_id=os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-4o"),
-    api_version="2024-08-01-preview"
-)
+from services.llm_gateway import llm_gateway
 
-dspy.settings.configure(lm=lm)
+# Configure DSPy with Azure OpenAI (shared gateway settings)
+try:
+    lm = llm_gateway.build_dspy_lm()
+    dspy.settings.configure(lm=lm)
+except Exception as e:
+    print(f"[DSPy] ⚠️ Could not configure the LM: {e}")
+    lm = None
 
 # Define DSPy Signatures for different prompts
 class CompanionResponse(dspy.Signature):
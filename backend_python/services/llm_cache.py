@@ -0,0 +1,161 @@
+"""
+LLM Cache - Content-addressed response cache for repeatable LLM calls
+Keyed by model, prompt hash and parameters; in-process LRU tier with TTL plus
+an optional on-disk tier (set LLM_CACHE_DIR). Call sites opt in per call.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+from dotenv import load_dotenv
+from services import metrics
+
+load_dotenv()
+
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "")  # empty = memory tier only
+
+
+def make_cache_key(model: str, params: Dict) -> str:
+    """Hash model + prompt + remaining parameters into a stable key"""
+    params = dict(params)
+    messages = params.pop("messages", None)
+    prompt_hash = hashlib.sha256(
+        json.dumps(messages, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    ).hexdigest()
+    params_json = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{model}|{prompt_hash}|{params_json}".encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """Two-tier (memory LRU + optional disk) cache of serialized LLM responses"""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, cache_dir: str = LLM_CACHE_DIR):
+        self.max_entries = max_entries
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self.lookups: Dict[str, int] = {}
+        self.hits: Dict[str, int] = {}
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # ---- disk tier -------------------------------------------------------
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _disk_read(self, key: str) -> Optional[tuple]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry.get("expires_at", 0) <= time.time():
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            return None
+        return entry["expires_at"], entry["payload"]
+
+    def _disk_write(self, key: str, expires_at: float, payload: Dict) -> None:
+        path = self._disk_path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": expires_at, "payload": payload}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    # ---- lookups ---------------------------------------------------------
+
+    def _record(self, caller: str, tier: Optional[str]) -> None:
+        self.lookups[caller] = self.lookups.get(caller, 0) + 1
+        if tier:
+            self.hits[caller] = self.hits.get(caller, 0) + 1
+            metrics.increment("llm_cache_hits", caller=caller, tier=tier)
+        else:
+            metrics.increment("llm_cache_misses", caller=caller)
+        metrics.set_gauge("llm_cache_hit_ratio", self.hits.get(caller, 0) / self.lookups[caller], caller=caller)
+
+    def _memory_put(self, key: str, expires_at: float, payload: Dict) -> None:
+        self.memory[key] = (expires_at, payload)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    async def get(self, key: str, caller: str) -> Optional[Dict]:
+        """Return the cached payload or None"""
+        entry = self.memory.get(key)
+        if entry:
+            if entry[0] > time.time():
+                self.memory.move_to_end(key)
+                self._record(caller, "memory")
+                return entry[1]
+            del self.memory[key]
+
+        if self.cache_dir:
+            try:
+                entry = await asyncio.to_thread(self._disk_read, key)
+            except Exception as e:
+                print(f"[LLM Cache] Disk read error: {e}")
+                entry = None
+            if entry:
+                self._memory_put(key, *entry)
+                self._record(caller, "disk")
+                return entry[1]
+
+        self._record(caller, None)
+        return None
+
+    async def set(self, key: str, payload: Dict, ttl: float) -> None:
+        expires_at = time.time() + ttl
+        self._memory_put(key, expires_at, payload)
+        if self.cache_dir:
+            try:
+                await asyncio.to_thread(self._disk_write, key, expires_at, payload)
+            except Exception as e:
+                print(f"[LLM Cache] Disk write error: {e}")
+
+    async def get_or_create(self, key: str, caller: str, ttl: float, create):
+        """Return a cached payload, or run `create()` once for concurrent identical calls"""
+        payload = await self.get(key, caller)
+        if payload is not None:
+            return payload, True
+
+        pending = self.in_flight.get(key)
+        if pending:
+            metrics.increment("llm_cache_coalesced", caller=caller)
+            try:
+                return await asyncio.shield(pending), True
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise  # this caller was cancelled
+            # The caller that was creating it went away: take over (or join whoever did first)
+            return await self.get_or_create(key, caller, ttl, create)
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            payload = await create()
+            await self.set(key, payload, ttl)
+            future.set_result(payload)
+            return payload, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            del self.in_flight[key]
+
+
+# Singleton instance
+llm_cache = LLMResponseCache()
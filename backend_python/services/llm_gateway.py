@@ -0,0 +1,373 @@
+"""
+LLM Gateway - Shared Azure OpenAI client for every LLM call site
+Owns one tuned HTTP connection pool and adds retries with jittered backoff,
+deadline-aware timeouts, optional hedging to a second deployment and circuit breaking
+"""
+import os
+import time
+import random
+import asyncio
+import contextlib
+from typing import AsyncIterator, Dict, Optional
+import httpx
+from dotenv import load_dotenv
+from openai import (
+    AsyncAzureOpenAI,
+    APIConnectionError,
+    InternalServerError,
+    RateLimitError,
+)
+from services import metrics
+from services.llm_scheduler import llm_scheduler, LANE_INTERACTIVE
+from services.llm_cache import llm_cache, make_cache_key
+
+load_dotenv()
+
+# Configuration
+AZURE_OPENAI_KEY = os.getenv("AZURE_OPENAI_KEY")
+AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
+API_VERSION = "2024-08-01-preview"
+CHAT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-4o")
+
+# Optional second deployment (may live in another resource) used for hedged requests
+HEDGE_DEPLOYMENT = os.getenv("AZURE_OPENAI_HEDGE_DEPLOYMENT")
+HEDGE_ENDPOINT = os.getenv("AZURE_OPENAI_HEDGE_ENDPOINT") or AZURE_OPENAI_ENDPOINT
+HEDGE_KEY = os.getenv("AZURE_OPENAI_HEDGE_KEY") or AZURE_OPENAI_KEY
+HEDGE_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DELAY_MS", "1500")) / 1000
+
+# Connection pool
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+
+# Timeouts and retries
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "30"))
+DEFAULT_DEADLINE = float(os.getenv("LLM_DEFAULT_DEADLINE", "60"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.25"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "4"))
+
+# Circuit breaker
+BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Transient failures worth retrying (APITimeoutError subclasses APIConnectionError)
+RETRYABLE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+
+def _rewind_upload(file) -> None:
+    """Seek a streamed upload back to the start so a retried attempt sends it whole"""
+    fileobj = file[1] if isinstance(file, tuple) else file
+    if hasattr(fileobj, "seek"):
+        fileobj.seek(0)
+
+
+class CircuitOpenError(Exception):
+    """Raised when a deployment's circuit is open and calls are short-circuited"""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when the caller's deadline runs out before a call could succeed"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+
+    def __init__(self, name: str, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def available(self) -> bool:
+        """Whether a call would currently be let through (without claiming the probe)"""
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.probe_in_flight)
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            print(f"[LLM] Circuit closed for {self.name}")
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        metrics.set_gauge("llm_circuit_open", 0, deployment=self.name)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.probe_in_flight or self.failures >= self.threshold:
+            if self.opened_at is None or self.probe_in_flight:
+                print(f"[LLM] ⚠️ Circuit opened for {self.name} after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self.probe_in_flight = False
+            metrics.set_gauge("llm_circuit_open", 1, deployment=self.name)
+
+
+class LLMGateway:
+    """Single entry point for chat and transcription calls to Azure OpenAI"""
+
+    def __init__(self):
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(ATTEMPT_TIMEOUT, connect=CONNECT_TIMEOUT),
+        )
+        # Retries are handled here, so the SDK's own retry loop is disabled
+        self.client = AsyncAzureOpenAI(
+            api_key=AZURE_OPENAI_KEY,
+            api_version=API_VERSION,
+            azure_endpoint=AZURE_OPENAI_ENDPOINT,
+            http_client=self.http_client,
+            max_retries=0,
+        )
+        self.hedge_client = None
+        if HEDGE_DEPLOYMENT:
+            self.hedge_client = AsyncAzureOpenAI(
+                api_key=HEDGE_KEY,
+                api_version=API_VERSION,
+                azure_endpoint=HEDGE_ENDPOINT,
+                http_client=self.http_client,
+                max_retries=0,
+            )
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def _breaker(self, deployment: str) -> CircuitBreaker:
+        if deployment not in self.breakers:
+            self.breakers[deployment] = CircuitBreaker(deployment)
+        return self.breakers[deployment]
+
+    async def chat_completion(self, caller: str, deadline: Optional[float] = None,
+                              hedge: bool = False, model: Optional[str] = None,
+                              lane: str = LANE_INTERACTIVE, cache_ttl: Optional[float] = None,
+                              **params):
+        """Create a chat completion.
+
+        `caller` labels metrics, `deadline` is a total budget in seconds and `lane`
+        picks the scheduler priority (LANE_BACKGROUND for non-user-facing work).
+        Pass `cache_ttl` (seconds) to serve identical requests from the response cache.
+        """
+        model = model or CHAT_DEPLOYMENT
+        if not cache_ttl:
+            return await self._call("chat", caller, model, params, deadline, hedge, lane)
+
+        from openai.types.chat import ChatCompletion
+
+        async def create():
+            response = await self._call("chat", caller, model, params, deadline, hedge, lane)
+            return response.model_dump(mode="json")
+
+        payload, cached = await llm_cache.get_or_create(
+            make_cache_key(model, params), caller, cache_ttl, create
+        )
+        if cached:
+            print(f"[LLM] {caller}: served from cache")
+        return ChatCompletion.model_validate(payload)
+
+    async def chat_completion_stream(self, caller: str, deadline: Optional[float] = None,
+                                     model: Optional[str] = None, lane: str = LANE_INTERACTIVE,
+                                     **params) -> AsyncIterator[str]:
+        """Stream a chat completion as text deltas.
+
+        Retries only cover opening the stream; once tokens flow, errors propagate.
+        The scheduler slot is held until the stream is fully consumed.
+        """
+        model = model or CHAT_DEPLOYMENT
+        deadline_at = time.monotonic() + (deadline or DEFAULT_DEADLINE)
+        metrics.increment("llm_requests", caller=caller, kind="chat_stream", lane=lane)
+        start = time.monotonic()
+        first_token_at = None
+        try:
+            async with llm_scheduler.slot(lane, timeout=max(0.0, deadline_at - time.monotonic())):
+                stream = await self._with_retries(
+                    "chat", caller, self.client, model, {**params, "stream": True}, deadline_at, None
+                )
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if first_token_at is None:
+                            first_token_at = time.monotonic()
+                            metrics.observe("llm_ttft_ms", (first_token_at - start) * 1000, caller=caller)
+                        yield delta
+        except asyncio.TimeoutError:
+            metrics.increment("llm_failures", caller=caller, kind="chat_stream", error="DeadlineExceededError")
+            raise DeadlineExceededError(f"[{caller}] deadline exceeded waiting for a {lane} slot")
+        except Exception as e:
+            metrics.increment("llm_failures", caller=caller, kind="chat_stream", error=type(e).__name__)
+            raise
+        metrics.observe("llm_latency_ms", (time.monotonic() - start) * 1000, caller=caller, kind="chat_stream")
+
+    async def transcription(self, caller: str, model: str, deadline: Optional[float] = None,
+                            lane: str = LANE_INTERACTIVE, **params):
+        """Create an audio transcription (Whisper deployment passed as `model`)"""
+        return await self._call("transcription", caller, model, params, deadline, False, lane)
+
+    async def _call(self, kind: str, caller: str, model: str, params: Dict,
+                    deadline: Optional[float], hedge: bool, lane: str):
+        deadline_at = time.monotonic() + (deadline or DEFAULT_DEADLINE)
+        metrics.increment("llm_requests", caller=caller, kind=kind, lane=lane)
+        start = time.monotonic()
+        try:
+            if hedge and self.hedge_client:
+                result = await self._hedged(kind, caller, model, params, deadline_at, lane)
+            else:
+                result = await self._with_retries(kind, caller, self.client, model, params, deadline_at, lane)
+        except Exception as e:
+            metrics.increment("llm_failures", caller=caller, kind=kind, error=type(e).__name__)
+            raise
+        metrics.observe("llm_latency_ms", (time.monotonic() - start) * 1000, caller=caller, kind=kind)
+        return result
+
+    async def _attempt(self, kind: str, client: AsyncAzureOpenAI, model: str, params: Dict, timeout: float):
+        scoped = client.with_options(timeout=httpx.Timeout(timeout, connect=min(CONNECT_TIMEOUT, timeout)))
+        if kind == "transcription":
+            _rewind_upload(params.get("file"))
+            return await scoped.audio.transcriptions.create(model=model, **params)
+        return await scoped.chat.completions.create(model=model, **params)
+
+    async def _with_retries(self, kind: str, caller: str, client: AsyncAzureOpenAI,
+                            model: str, params: Dict, deadline_at: float, lane: Optional[str]):
+        """Run attempts until success, a non-retryable error or the deadline.
+        `lane=None` means the caller already holds a scheduler slot."""
+        breaker = self._breaker(model)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                metrics.increment("llm_circuit_rejections", caller=caller, deployment=model)
+                raise CircuitOpenError(f"Circuit open for deployment '{model}'")
+
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceededError(f"[{caller}] deadline exceeded before attempt {attempt + 1}")
+
+            try:
+                slot = llm_scheduler.slot(lane, timeout=remaining) if lane else contextlib.nullcontext()
+                async with slot:
+                    # Time spent queueing counts against the deadline
+                    remaining = deadline_at - time.monotonic()
+                    result = await self._attempt(kind, client, model, params, min(ATTEMPT_TIMEOUT, remaining))
+            except asyncio.TimeoutError:
+                if breaker.probe_in_flight:
+                    breaker.probe_in_flight = False
+                raise DeadlineExceededError(f"[{caller}] deadline exceeded waiting for a {lane} slot")
+            except RETRYABLE_ERRORS as e:
+                breaker.record_failure()
+                attempt += 1
+                metrics.increment("llm_attempt_errors", caller=caller, deployment=model, error=type(e).__name__)
+                if attempt > MAX_RETRIES:
+                    raise
+
+                # Full jitter, but honour Retry-After from rate limiting when it fits the deadline
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+                if isinstance(e, RateLimitError):
+                    retry_after = e.response.headers.get("retry-after") if e.response is not None else None
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except (TypeError, ValueError):
+                        pass
+                if time.monotonic() + delay >= deadline_at:
+                    raise
+                print(f"[LLM] {caller}: {type(e).__name__}, retry {attempt}/{MAX_RETRIES} in {delay:.2f}s")
+                metrics.increment("llm_retries", caller=caller, deployment=model)
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                # Client errors (bad request, auth...) say nothing about deployment health
+                if breaker.probe_in_flight:
+                    breaker.probe_in_flight = False
+                raise
+
+            breaker.record_success()
+            return result
+
+    async def _hedged(self, kind: str, caller: str, model: str, params: Dict, deadline_at: float, lane: str):
+        """Send to the primary deployment; if it is slow, race a copy against the hedge deployment"""
+        primary = asyncio.create_task(
+            self._with_retries(kind, caller, self.client, model, params, deadline_at, lane)
+        )
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=HEDGE_DELAY_SECONDS)
+            if done:
+                return primary.result()
+
+            if not self._breaker(HEDGE_DEPLOYMENT).available():
+                return await primary
+
+            print(f"[LLM] {caller}: primary slow after {HEDGE_DELAY_SECONDS:.2f}s, hedging to {HEDGE_DEPLOYMENT}")
+            metrics.increment("llm_hedges", caller=caller)
+            hedge = asyncio.create_task(
+                self._with_retries(kind, caller, self.hedge_client, HEDGE_DEPLOYMENT, params, deadline_at, lane)
+            )
+            tasks.append(hedge)
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            metrics.increment("llm_hedge_wins", caller=caller)
+                        return task.result()
+            # Both failed: surface the primary's error
+            return primary.result()
+        finally:
+            # The loser, or both requests if the caller was cancelled (e.g. during the hedge delay)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def build_dspy_lm(self):
+        """Build a DSPy LM (dspy-ai 2.4 AzureOpenAI) for the gateway's chat deployment.
+
+        DSPy makes its own blocking requests with its own backoff, so only the
+        circuit breaker check and the per-attempt timeout carry over.
+        """
+        import dspy
+
+        if not self._breaker(CHAT_DEPLOYMENT).available():
+            raise CircuitOpenError(f"Circuit open for deployment '{CHAT_DEPLOYMENT}'")
+        settings = dict(
+            api_base=AZURE_OPENAI_ENDPOINT,
+            api_key=AZURE_OPENAI_KEY,
+            deployment_id=CHAT_DEPLOYMENT,
+            api_version=API_VERSION,
+            max_tokens=1000,
+        )
+        try:
+            # Extra kwargs are passed through to chat.completions.create
+            return dspy.AzureOpenAI(**settings, timeout=ATTEMPT_TIMEOUT)
+        except Exception as e:
+            print(f"[DSPy] Error creating LM: {e}")
+            # Fallback to basic configuration
+            return dspy.AzureOpenAI(**settings)
+
+    async def aclose(self) -> None:
+        """Close the shared connection pool"""
+        await self.http_client.aclose()
+
+
+# Singleton instance
+llm_gateway = LLMGateway()
@@ -0,0 +1,130 @@
+"""
+LLM Scheduler - Priority lanes for outbound LLM calls
+Interactive calls (live chat, STT, guardrail) are always dispatched before background
+work (session titling, recaps, context extraction), which is held back while
+interactive demand is high
+"""
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from dotenv import load_dotenv
+from services import metrics
+
+load_dotenv()
+
+LANE_INTERACTIVE = "interactive"
+LANE_BACKGROUND = "background"
+
+# Per-lane concurrency caps
+INTERACTIVE_CONCURRENCY = int(os.getenv("LLM_INTERACTIVE_CONCURRENCY", "32"))
+BACKGROUND_CONCURRENCY = int(os.getenv("LLM_BACKGROUND_CONCURRENCY", "4"))
+# Background cap while interactive calls are busy (in-flight >= threshold)
+BACKGROUND_CONCURRENCY_UNDER_LOAD = int(os.getenv("LLM_BACKGROUND_CONCURRENCY_UNDER_LOAD", "1"))
+INTERACTIVE_PRESSURE_THRESHOLD = int(os.getenv("LLM_INTERACTIVE_PRESSURE_THRESHOLD", "4"))
+
+
+class LLMScheduler:
+    """Grants call slots per lane; interactive waiters always go first"""
+
+    def __init__(self):
+        self.caps = {
+            LANE_INTERACTIVE: INTERACTIVE_CONCURRENCY,
+            LANE_BACKGROUND: BACKGROUND_CONCURRENCY,
+        }
+        self.in_flight: Dict[str, int] = {lane: 0 for lane in self.caps}
+        self.waiters: Dict[str, deque] = {lane: deque() for lane in self.caps}
+
+    def _background_cap(self) -> int:
+        """Effective background cap given current interactive demand"""
+        if self.waiters[LANE_INTERACTIVE]:
+            return 0  # interactive calls are queueing: dispatch no new background work
+        if self.in_flight[LANE_INTERACTIVE] >= INTERACTIVE_PRESSURE_THRESHOLD:
+            return min(BACKGROUND_CONCURRENCY_UNDER_LOAD, self.caps[LANE_BACKGROUND])
+        return self.caps[LANE_BACKGROUND]
+
+    def _lane_cap(self, lane: str) -> int:
+        return self._background_cap() if lane == LANE_BACKGROUND else self.caps[lane]
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiters, interactive lane first"""
+        for lane in (LANE_INTERACTIVE, LANE_BACKGROUND):
+            queue = self.waiters[lane]
+            while queue and self.in_flight[lane] < self._lane_cap(lane):
+                future, _ = queue.popleft()
+                if future.done():
+                    continue  # waiter was cancelled
+                self.in_flight[lane] += 1
+                future.set_result(None)
+        self._report()
+
+    def _report(self) -> None:
+        for lane in self.caps:
+            metrics.set_gauge("llm_queue_depth", len(self.waiters[lane]), lane=lane)
+            metrics.set_gauge("llm_in_flight", self.in_flight[lane], lane=lane)
+
+    async def acquire(self, lane: str = LANE_INTERACTIVE) -> None:
+        """Wait for a slot in `lane`"""
+        if lane not in self.caps:
+            lane = LANE_INTERACTIVE
+        start = time.monotonic()
+
+        if not self.waiters[lane] and self.in_flight[lane] < self._lane_cap(lane):
+            self.in_flight[lane] += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            entry = (future, start)
+            self.waiters[lane].append(entry)
+            self._report()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self.release(lane)  # slot was granted as we were cancelled
+                else:
+                    try:
+                        self.waiters[lane].remove(entry)
+                    except ValueError:
+                        pass
+                    self._dispatch()  # a departed interactive waiter may unblock background
+                raise
+
+        wait_ms = (time.monotonic() - start) * 1000
+        metrics.observe("llm_queue_wait_ms", wait_ms, lane=lane)
+        if wait_ms > 1000:
+            print(f"[Scheduler] {lane} call waited {wait_ms:.0f}ms for a slot")
+
+    def release(self, lane: str = LANE_INTERACTIVE) -> None:
+        """Return a slot and wake the next waiter"""
+        if lane not in self.caps:
+            lane = LANE_INTERACTIVE
+        self.in_flight[lane] = max(0, self.in_flight[lane] - 1)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, lane: str = LANE_INTERACTIVE, timeout: Optional[float] = None):
+        """Hold a slot in `lane` for the duration of the block"""
+        if timeout is not None:
+            await asyncio.wait_for(self.acquire(lane), timeout)
+        else:
+            await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release(lane)
+
+    def stats(self) -> Dict:
+        return {
+            lane: {
+                "queued": len(self.waiters[lane]),
+                "in_flight": self.in_flight[lane],
+                "cap": self._lane_cap(lane),
+            }
+            for lane in self.caps
+        }
+
+
+# Singleton instance
+llm_scheduler = LLMScheduler()
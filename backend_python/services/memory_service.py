@@ -4,6 +4,7 @@ Provides full conversation memory without RAG/embeddings
 """
 import json
 from datetime import datetime
+from typing import List, Dict
 from services.database import db_service
 
 MAX_CONTEXT_MESSAGES = 50  # Load last 50 messages for context
@@ -29,6 +30,32 @@ def add_message(role: str, content: str, metadata: dict = None) -> None:
     except Exception as e:
         print(f"Error adding message to DB: {e}")
 
+def get_recent_messages(limit: int = MAX_CONTEXT_MESSAGES) -> List[Dict]:
+    """
+    Get recent messages from PostgreSQL in chronological order
+    """
+    try:
+        conn = db_service.get_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT role, content, timestamp FROM messages ORDER BY timestamp DESC LIMIT %s",
+                (limit,)
+            )
+            rows = cur.fetchall()
+        conn.close()
+        # Reverse to get chronological order
+        return [dict(row) for row in rows[::-1]]
+    except Exception as e:
+        print(f"Error getting recent messages from DB: {e}")
+        return []
+
+def format_message_line(msg: Dict) -> str:
+    """Format a stored message as a single timestamped context line"""
+    role_label = "You" if msg['role'] == 'user' else "Sneh"
+    timestamp = msg.get('timestamp')
+    date_str = timestamp.strftime('%b %d, %Y %H:%M') if timestamp else "Unknown time"
+    return f"[{date_str}] {role_label}: {msg['content']}"
+
 def get_recent_context(limit: int = MAX_CONTEXT_MESSAGES) -> str:
     """
     Get recent conversation history from PostgreSQL formatted for AI context
@@ -53,10 +80,7 @@ def get_recent_context(limit: int = MAX_CONTEXT_MESSAGES) -> str:
         context_lines.append(f"(Showing last {len(recent)} messages)\n")
         
         for msg in recent:
-            role_label = "You" if msg['role'] == 'user' else "Sneh"
-            timestamp = msg['timestamp']
-            date_str = timestamp.strftime('%b %d, %Y %H:%M') if timestamp else "Unknown time"
-            context_lines.append(f"[{date_str}] {role_label}: {msg['content']}")
+            context_lines.append(format_message_line(msg))
         
         return "\n".join(context_lines)
     except Exception as e:
@@ -0,0 +1,81 @@
+"""
+Metrics - Lightweight in-process counters, gauges and timings
+Snapshot is served as JSON from the /metrics endpoint
+"""
+import threading
+from collections import deque
+from typing import Dict
+
+SAMPLE_WINDOW = 512  # Recent observations kept per series for percentiles
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, float] = {}
+_observations: Dict[str, Dict] = {}
+
+
+def _series(name: str, labels: Dict) -> str:
+    """Build a series key like name{label=value,...}"""
+    if not labels:
+        return name
+    label_str = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{label_str}}}"
+
+
+def increment(name: str, value: float = 1, **labels) -> None:
+    """Add `value` to a counter"""
+    key = _series(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    """Set a gauge to its current value"""
+    key = _series(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """Record one observation (latency, size, ratio...)"""
+    key = _series(name, labels)
+    with _lock:
+        series = _observations.get(key)
+        if series is None:
+            series = {"count": 0, "sum": 0.0, "min": value, "max": value,
+                      "samples": deque(maxlen=SAMPLE_WINDOW)}
+            _observations[key] = series
+        series["count"] += 1
+        series["sum"] += value
+        series["min"] = min(series["min"], value)
+        series["max"] = max(series["max"], value)
+        series["samples"].append(value)
+
+
+def _percentile(sorted_samples, pct: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(pct * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def snapshot() -> Dict:
+    """Return a JSON-serializable copy of all metrics"""
+    with _lock:
+        observations = {}
+        for key, series in _observations.items():
+            samples = sorted(series["samples"])
+            observations[key] = {
+                "count": series["count"],
+                "avg": series["sum"] / series["count"] if series["count"] else 0.0,
+                "min": series["min"],
+                "max": series["max"],
+                "p50": _percentile(samples, 0.50),
+                "p95": _percentile(samples, 0.95),
+                "p99": _percentile(samples, 0.99),
+            }
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "observations": observations,
+        }
@@ -5,18 +5,14 @@ Uses AI to analyze full conversation sessions and extract deep context.
 import json
 import os
 from typing import Dict, List
-from openai import AsyncAzureOpenAI
 from dotenv import load_dotenv
+from services.llm_gateway import llm_gateway
+from services.llm_scheduler import LANE_BACKGROUND
 
 load_dotenv()
 
-client = AsyncAzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_KEY"),
-    api_version="2024-08-01-preview",
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-)
-
 CHAT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-4o")
+RECAP_CACHE_TTL = int(os.getenv("RECAP_CACHE_TTL", "3600"))  # re-triggered recaps of an unchanged session
 
 async def generate_session_recap(messages: List[Dict]) -> Dict:
     """
@@ -103,7 +99,10 @@ Response must be a SINGLE JSON object with this exact structure:
 }}
 """
 
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat_completion(
+            "session_recap",
+            lane=LANE_BACKGROUND,
+            cache_ttl=RECAP_CACHE_TTL,
             model=CHAT_DEPLOYMENT,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
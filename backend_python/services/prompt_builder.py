@@ -0,0 +1,219 @@
+"""
+Prompt Builder - Token-budgeted context assembly for chat prompts
+Ranks contexts, dedupes stored memory against the client's history and fits each section to a budget
+"""
+import os
+from datetime import datetime
+from typing import List, Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Per-section token budgets (override via env or per call)
+DEFAULT_BUDGETS = {
+    "user": int(os.getenv("PROMPT_BUDGET_USER", "100")),
+    "contexts": int(os.getenv("PROMPT_BUDGET_CONTEXTS", "600")),
+    "memory": int(os.getenv("PROMPT_BUDGET_MEMORY", "1200")),
+    "history": int(os.getenv("PROMPT_BUDGET_HISTORY", "2000")),
+}
+
+# gpt-4o uses o200k_base; older tiktoken releases only ship cl100k_base
+TOKENIZER_ENCODING = os.getenv("PROMPT_TOKENIZER_ENCODING", "o200k_base")
+MESSAGE_OVERHEAD_TOKENS = 4  # role + separators per chat message
+STORED_MESSAGE_LIMIT = 50
+
+PRIORITY_RANK = {"high": 0, "medium": 1, "low": 2}
+
+_encoder = None
+_encoder_loaded = False
+
+
+def _get_encoder():
+    """Load the tiktoken encoder once; returns None if tiktoken is unavailable"""
+    global _encoder, _encoder_loaded
+    if _encoder_loaded:
+        return _encoder
+    _encoder_loaded = True
+    try:
+        import tiktoken
+        try:
+            _encoder = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except ValueError:
+            _encoder = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"[Prompt] tiktoken unavailable, using character estimate: {e}")
+        _encoder = None
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text (tiktoken if installed, ~4 chars/token otherwise)"""
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder:
+        return len(encoder.encode(text))
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(msg: Dict) -> int:
+    """Count tokens for a chat message including per-message overhead"""
+    return count_tokens(msg.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Cut text down to at most `budget` tokens"""
+    if budget <= 0 or not text:
+        return ""
+    encoder = _get_encoder()
+    if encoder:
+        tokens = encoder.encode(text)
+        if len(tokens) <= budget:
+            return text
+        return encoder.decode(tokens[:budget])
+    return text[:budget * 4]
+
+
+def _timestamp_value(value) -> float:
+    """Convert a datetime/ISO string timestamp into a sortable number"""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            return 0.0
+    return 0.0
+
+
+def rank_contexts(contexts: List[Dict]) -> List[Dict]:
+    """Order active contexts by priority, then most recently updated first"""
+    active = [ctx for ctx in contexts if ctx.get('status') != 'archived']
+    return sorted(
+        active,
+        key=lambda ctx: (
+            PRIORITY_RANK.get(ctx.get('priority'), len(PRIORITY_RANK)),
+            -_timestamp_value(ctx.get('updated_at') or ctx.get('updatedAt'))
+        )
+    )
+
+
+def fit_contexts(contexts: List[Dict], budget: int) -> str:
+    """Render ranked contexts until the token budget is spent"""
+    from services.context_service import format_context_line
+
+    header = "ACTIVE USER CONTEXTS:"
+    selected = []
+    used = count_tokens(header)
+    for ctx in rank_contexts(contexts):
+        cost = count_tokens(format_context_line(ctx)) + 1
+        if used + cost > budget:
+            continue  # a shorter, lower-ranked context may still fit
+        selected.append(ctx)
+        used += cost
+
+    if not selected:
+        return "No active contexts."
+
+    # Render in an order that ignores updated_at, so touching a context does not
+    # reshuffle the section and invalidate the provider's prompt prefix cache
+    selected.sort(key=lambda ctx: (
+        PRIORITY_RANK.get(ctx.get('priority'), len(PRIORITY_RANK)),
+        (ctx.get('title') or '').lower()
+    ))
+    return "\n".join([header] + [format_context_line(ctx) for ctx in selected])
+
+
+def _message_key(role: str, content: str) -> tuple:
+    """Normalized identity of a message for deduplication"""
+    return (role, " ".join((content or "").lower().split()))
+
+
+def dedupe_stored_messages(stored: List[Dict], history: List[Dict], user_message: str = "") -> List[Dict]:
+    """Drop stored messages that the client already sends as conversation history"""
+    seen = {_message_key(msg["role"], msg["content"]) for msg in history}
+    if user_message:
+        seen.add(_message_key("user", user_message))
+    return [msg for msg in stored if _message_key(msg["role"], msg["content"]) not in seen]
+
+
+def fit_history(history: List[Dict], budget: int) -> List[Dict]:
+    """Keep the newest client history messages that fit the budget (chronological order)"""
+    kept = []
+    used = 0
+    for msg in reversed(history):
+        cost = count_message_tokens(msg)
+        if used + cost > budget:
+            break
+        kept.append({"role": msg["role"], "content": msg["content"]})
+        used += cost
+    return kept[::-1]
+
+
+def fit_memory(stored: List[Dict], budget: int) -> str:
+    """Render the newest stored messages that fit the budget (chronological order)"""
+    from services.memory_service import format_message_line
+
+    header = "RECENT CONVERSATION HISTORY:"
+    lines = []
+    used = count_tokens(header)
+    for msg in reversed(stored):
+        line = format_message_line(msg)
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+
+    if not lines:
+        return ""
+    return "\n".join([header] + lines[::-1])
+
+
+def build_chat_context(user_context: str, conversation_history: List[Dict],
+                       user_message: str = "", budgets: Optional[Dict[str, int]] = None) -> Dict:
+    """
+    Assemble the prompt context and trimmed history for a chat turn.
+
+    The context is split so providers can reuse a cached prompt prefix:
+        stable: user info + contexts, changes rarely (goes right after the persona prompt)
+        volatile: recent stored memory, changes every turn (goes after the history)
+
+    Returns a dict with:
+        stable: text to append to the system prompt
+        volatile: text sent as a late system message
+        history: client history trimmed to its budget
+        tokens: token count per section
+    """
+    from services.context_service import get_all_contexts
+    from services.memory_service import get_recent_messages
+
+    limits = {**DEFAULT_BUDGETS, **(budgets or {})}
+
+    user_section = truncate_to_tokens(user_context.strip(), limits["user"]) if user_context else ""
+    contexts_section = fit_contexts(get_all_contexts(), limits["contexts"])
+
+    history = fit_history(conversation_history, limits["history"])
+    # Dedupe against the budgeted history only, so older turns trimmed from
+    # history can still surface through the memory section
+    stored = dedupe_stored_messages(
+        get_recent_messages(STORED_MESSAGE_LIMIT), history, user_message
+    )
+    memory_section = fit_memory(stored, limits["memory"])
+
+    stable = "\n\n".join(s for s in (user_section, contexts_section) if s)
+    tokens = {
+        "user": count_tokens(user_section),
+        "contexts": count_tokens(contexts_section),
+        "memory": count_tokens(memory_section),
+        "history": sum(count_message_tokens(msg) for msg in history),
+    }
+    print(f"[Prompt] Budgeted context tokens: {tokens} "
+          f"(history {len(history)}/{len(conversation_history)} msgs, memory {len(stored)} candidates)")
+
+    return {
+        "stable": stable,
+        "volatile": memory_section,
+        "history": history,
+        "tokens": tokens,
+    }
@@ -0,0 +1,137 @@
+"""
+Realtime Events - Downstream event projection for realtime relay clients
+Only event types the client subscribes to are forwarded, each cut down to the
+fields it needs (no event_id, usage blocks or echoed session config).
+response.audio.delta, the bulk of the traffic, is projected straight from the
+raw JSON text without a json.loads/json.dumps round trip.
+"""
+import os
+import re
+import json
+from typing import Dict, Iterable, Optional, Tuple
+from dotenv import load_dotenv
+from services import metrics
+
+load_dotenv()
+
+# Fields kept per event type; types not listed here are not forwarded unless
+# the client subscribes to "*" (everything, unprojected)
+EVENT_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "response.audio.delta": ("type", "response_id", "item_id", "delta"),
+    "response.audio.done": ("type", "response_id", "item_id"),
+    "response.audio_transcript.delta": ("type", "response_id", "item_id", "delta"),
+    "response.audio_transcript.done": ("type", "response_id", "item_id", "transcript"),
+    "response.text.delta": ("type", "response_id", "item_id", "delta"),
+    "response.text.done": ("type", "response_id", "item_id", "text"),
+    "response.created": ("type", "response"),
+    "response.done": ("type", "response"),
+    "conversation.item.input_audio_transcription.delta": ("type", "item_id", "delta"),
+    "conversation.item.input_audio_transcription.completed": ("type", "item_id", "transcript"),
+    "conversation.item.input_audio_transcription.failed": ("type", "item_id", "error"),
+    "input_audio_buffer.committed": ("type", "item_id"),
+    "input_audio_buffer.speech_started": ("type", "item_id", "audio_start_ms"),
+    "input_audio_buffer.speech_stopped": ("type", "item_id", "audio_end_ms"),
+    "session.created": ("type",),
+    "session.updated": ("type",),
+    "rate_limits.updated": ("type", "rate_limits"),
+    "error": ("type", "error"),
+}
+# Nested "response" objects keep only these (output items and usage are large)
+RESPONSE_FIELDS = ("id", "status", "status_details")
+
+# Every event the mobile screens (App, HomeScreen, FlowScreen) handle today; keep in
+# sync when a screen starts using a new one. Override with REALTIME_CLIENT_EVENTS or ?events=
+DEFAULT_CLIENT_EVENTS = ",".join((
+    "response.created",
+    "response.audio.delta",
+    "response.audio.done",
+    "response.audio_transcript.delta",
+    "response.audio_transcript.done",
+    "response.done",
+    "conversation.item.input_audio_transcription.delta",
+    "conversation.item.input_audio_transcription.completed",
+    "input_audio_buffer.speech_started",
+    "error",
+))
+REALTIME_CLIENT_EVENTS = os.getenv("REALTIME_CLIENT_EVENTS", DEFAULT_CLIENT_EVENTS)
+
+_TYPE = re.compile(r'"type"\s*:\s*"([^"]+)"')
+_DELTA_KEY = re.compile(r'"delta"\s*:\s*"')
+_ID_FIELDS = [(name, re.compile(r'"%s"\s*:\s*"([^"\\]*)"' % name)) for name in ("response_id", "item_id")]
+
+
+def peek_event_type(msg: str) -> str:
+    """Event type without parsing the (possibly large) message"""
+    match = _TYPE.search(msg, 0, 200) or _TYPE.search(msg)
+    return match.group(1) if match else ""
+
+
+class EventProjector:
+    """Per-connection subscription: which events reach the client, and in what shape"""
+
+    def __init__(self, subscribed: Optional[Iterable[str]] = None):
+        names = subscribed if subscribed is not None else REALTIME_CLIENT_EVENTS.split(",")
+        self.subscribed = {name.strip() for name in names if name.strip()}
+        self.forward_all = "*" in self.subscribed
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.filtered = 0
+
+    @classmethod
+    def from_query(cls, events: Optional[str]) -> "EventProjector":
+        return cls(events.split(",") if events else None)
+
+    def wants(self, event_type: str) -> bool:
+        # The relay's own events (relay.*, context.saved) are queued as-is, not projected
+        return self.forward_all or event_type in self.subscribed
+
+    def _account(self, raw: int, out: Optional[str]) -> Optional[str]:
+        self.bytes_in += raw
+        if out is None:
+            self.filtered += 1
+        else:
+            self.bytes_out += len(out)
+        return out
+
+    def project_audio_delta(self, msg: str) -> Optional[str]:
+        """response.audio.delta rebuilt from the raw text (base64 needs no JSON escaping)"""
+        if not self.wants("response.audio.delta"):
+            return self._account(len(msg), None)
+        if self.forward_all:
+            return self._account(len(msg), msg)
+        key = _DELTA_KEY.search(msg, 0, msg.find('"delta"') + 16)
+        end = msg.find('"', key.end()) if key else -1
+        if end < 0:
+            return self.project(json.loads(msg), len(msg))
+        start = key.start()
+        # Ids come before or after the payload; search only the small envelope
+        envelope = msg[:start] + msg[end:]
+        out = '{"type":"response.audio.delta"'
+        for name, pattern in _ID_FIELDS:
+            match = pattern.search(envelope)
+            if match:
+                out += f',"{name}":"{match.group(1)}"'
+        out += ',"delta":"' + msg[key.end():end + 1] + '}'
+        return self._account(len(msg), out)
+
+    def project(self, event: Dict, raw_size: int) -> Optional[str]:
+        """JSON for the client, or None when the client isn't subscribed to this event"""
+        event_type = event.get("type", "")
+        if not self.wants(event_type):
+            return self._account(raw_size, None)
+        fields = EVENT_FIELDS.get(event_type)
+        if self.forward_all and fields is None:
+            return self._account(raw_size, json.dumps(event, separators=(",", ":")))
+        projected = {name: event[name] for name in (fields or ("type",)) if name in event}
+        if isinstance(projected.get("response"), dict):
+            projected["response"] = {k: v for k, v in projected["response"].items() if k in RESPONSE_FIELDS}
+        return self._account(raw_size, json.dumps(projected, separators=(",", ":")))
+
+    def report(self) -> str:
+        saved = self.bytes_in - self.bytes_out
+        metrics.increment("relay_event_bytes_in", self.bytes_in)
+        metrics.increment("relay_event_bytes_saved", saved)
+        metrics.observe("relay_event_bytes_saved_per_session", saved)
+        ratio = saved / self.bytes_in if self.bytes_in else 0.0
+        return (f"events: {self.bytes_in} bytes from Azure, {self.bytes_out} forwarded "
+                f"({ratio:.0%} saved, {self.filtered} events filtered)")
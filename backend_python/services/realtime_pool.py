@@ -0,0 +1,162 @@
+"""
+Realtime Pool - Pre-connected Azure Realtime sessions for the relay
+Keeps a few upstream sessions per voice already through the TLS/WebSocket
+handshake and the base session.update, so a client connecting to `/` only
+pays for an instructions patch. Idle sessions are replaced before they age
+out; if none is ready the relay connects directly as before.
+"""
+import os
+import time
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from services import metrics
+
+load_dotenv()
+
+# Idle sessions kept per voice (0 disables the pool)
+REALTIME_POOL_SIZE = int(os.getenv("REALTIME_POOL_SIZE", "1"))
+# Voices to keep warm; defaults to the voices the intensities map to
+REALTIME_POOL_VOICES = [v for v in os.getenv("REALTIME_POOL_VOICES", "shimmer,alloy,echo").split(",") if v]
+# Replace idle sessions older than this (Azure ends realtime sessions after 30 min)
+REALTIME_POOL_MAX_AGE = float(os.getenv("REALTIME_POOL_MAX_AGE", "600"))
+REALTIME_POOL_CHECK_INTERVAL = float(os.getenv("REALTIME_POOL_CHECK_INTERVAL", "15"))
+# How long a new session may take to confirm its configuration
+REALTIME_POOL_CONNECT_TIMEOUT = float(os.getenv("REALTIME_POOL_CONNECT_TIMEOUT", "10"))
+
+
+def _is_open(ws) -> bool:
+    return ws.close_code is None
+
+
+class RealtimeSessionPool:
+    """Warm upstream sessions keyed by voice, refilled in the background"""
+
+    def __init__(self, size: int = REALTIME_POOL_SIZE, voices: List[str] = REALTIME_POOL_VOICES,
+                 max_age: float = REALTIME_POOL_MAX_AGE):
+        self.size = size
+        self.voices = voices
+        self.max_age = max_age
+        self.idle: Dict[str, List[Tuple[object, float]]] = {v: [] for v in voices}
+        self.refill = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    async def _open(self, voice: str):
+        """Connect and configure a session, consuming its setup events"""
+        from services.realtime_service import open_realtime_session
+
+        start = time.monotonic()
+        ws = await open_realtime_session(voice)
+        try:
+            await asyncio.wait_for(self._await_configured(ws), REALTIME_POOL_CONNECT_TIMEOUT)
+        except BaseException:
+            await ws.close()
+            raise
+        metrics.observe("realtime_pool_connect_ms", (time.monotonic() - start) * 1000, voice=voice)
+        return ws
+
+    @staticmethod
+    async def _await_configured(ws) -> None:
+        """Consume session.created/session.updated so neither reaches a client later"""
+        async for msg in ws:
+            event_type = json.loads(msg).get("type")
+            if event_type == "session.updated":
+                return
+            if event_type == "error":
+                raise RuntimeError(f"session.update rejected: {msg[:200]}")
+        raise ConnectionError("Closed before the session was configured")
+
+    async def _close(self, ws) -> None:
+        try:
+            await ws.close()
+        except Exception:
+            pass
+
+    async def _maintain(self) -> None:
+        """Drop dead/expiring sessions and top every voice back up to `size`"""
+        while True:
+            now = time.monotonic()
+            for voice, sessions in self.idle.items():
+                for ws, created in list(sessions):
+                    if not _is_open(ws) or now - created > self.max_age:
+                        sessions.remove((ws, created))
+                        await self._close(ws)
+                        metrics.increment("realtime_pool_recycled", voice=voice)
+                while len(sessions) < self.size:
+                    try:
+                        sessions.append((await self._open(voice), time.monotonic()))
+                    except Exception as e:
+                        print(f"[RealtimePool] ⚠️ Could not warm a {voice} session: {e}")
+                        metrics.increment("realtime_pool_errors", voice=voice)
+                        break
+                metrics.set_gauge("realtime_pool_idle", len(sessions), voice=voice)
+
+            self.refill.clear()
+            try:
+                await asyncio.wait_for(self.refill.wait(), REALTIME_POOL_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        from services.realtime_service import AZURE_REALTIME_ENDPOINT
+
+        if not AZURE_REALTIME_ENDPOINT:
+            print("[RealtimePool] AZURE_REALTIME_ENDPOINT not set, pool disabled")
+            return
+        if self.size > 0 and self.task is None:
+            self.task = asyncio.create_task(self._maintain())
+            print(f"[RealtimePool] Keeping {self.size} session(s) warm for: {', '.join(self.voices)}")
+
+    def acquire(self, voice: str):
+        """A ready session for `voice`, or None (the caller connects directly)"""
+        sessions = self.idle.get(voice, [])
+        now = time.monotonic()
+        while sessions:
+            ws, created = sessions.pop(0)
+            if _is_open(ws) and now - created < self.max_age:
+                metrics.increment("realtime_pool_hits", voice=voice)
+                self.refill.set()
+                return ws
+            asyncio.create_task(self._close(ws))
+        metrics.increment("realtime_pool_misses", voice=voice)
+        self.refill.set()
+        return None
+
+    @asynccontextmanager
+    async def session(self, voice: str, instructions: str):
+        """Configured session for one client: pooled (instructions patched in) or freshly opened; closed on exit"""
+        from services.realtime_service import open_realtime_session
+
+        start = time.monotonic()
+        ws = self.acquire(voice)
+        pooled = ws is not None
+        if pooled:
+            await ws.send(json.dumps({"type": "session.update", "session": {"instructions": instructions}}))
+        else:
+            ws = await open_realtime_session(voice, instructions)
+        metrics.observe("realtime_session_ready_ms", (time.monotonic() - start) * 1000, pooled=str(pooled).lower())
+        print(f"[RealtimePool] {'Handed off a warm' if pooled else 'Opened a new'} {voice} session "
+              f"in {(time.monotonic() - start) * 1000:.0f}ms")
+        try:
+            yield ws
+        finally:
+            await self._close(ws)
+
+    async def close(self) -> None:
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        for sessions in self.idle.values():
+            for ws, _ in sessions:
+                await self._close(ws)
+            sessions.clear()
+
+
+# Singleton instance
+realtime_pool = RealtimeSessionPool()
@@ -0,0 +1,160 @@
+"""
+Realtime Relay - Bounded, backpressure-aware forwarding for the realtime WebSocket
+Each direction of a relay connection goes through a bounded queue drained by
+its own sender task, so a slow mobile link no longer stalls reading from Azure
+(and the reverse). When a queue fills, non-essential events are coalesced or
+dropped first; essential ones wait, and a peer that stays stuck past
+RELAY_SEND_TIMEOUT ends the connection instead of growing memory. The relay
+tasks are cancelled together as soon as any one of them finishes.
+"""
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Union
+from dotenv import load_dotenv
+from services import metrics
+
+load_dotenv()
+
+# Messages buffered towards the mobile client / towards Azure
+RELAY_QUEUE_MAX = int(os.getenv("RELAY_QUEUE_MAX", "256"))
+RELAY_UPSTREAM_QUEUE_MAX = int(os.getenv("RELAY_UPSTREAM_QUEUE_MAX", "64"))
+# A single send, or waiting for queue space, longer than this means the peer is stuck
+RELAY_SEND_TIMEOUT = float(os.getenv("RELAY_SEND_TIMEOUT", "10"))
+
+# Events that may be sacrificed under pressure. "coalesce": only the newest
+# pending copy is kept. "drop": discarded when the queue is full (the matching
+# *.done event still carries the complete value).
+EVENT_POLICIES = {
+    "rate_limits.updated": "coalesce",
+    "relay.audio_dropped": "coalesce",
+    "response.audio_transcript.delta": "drop",
+    "response.text.delta": "drop",
+    "conversation.item.input_audio_transcription.delta": "drop",
+}
+
+Message = Union[str, bytes]
+
+
+class RelayStalled(Exception):
+    """The receiving side stopped draining its queue"""
+
+
+class _Item:
+    __slots__ = ("message", "event_type", "policy", "queued_at")
+
+    def __init__(self, message: Message, event_type: Optional[str], policy: Optional[str]):
+        self.message = message
+        self.event_type = event_type
+        self.policy = policy
+        self.queued_at = time.monotonic()
+
+
+class RelayQueue:
+    """One direction of a relay connection: bounded buffer + sender task"""
+
+    def __init__(self, direction: str, send: Callable[[Message], Awaitable[None]],
+                 maxsize: int = RELAY_QUEUE_MAX):
+        self.direction = direction
+        self.send = send
+        self.maxsize = maxsize
+        self.items: Deque[_Item] = deque()
+        self.not_empty = asyncio.Event()
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+        # Per-connection summary, logged when the relay ends
+        self.stats: Dict[str, float] = {"sent": 0, "dropped": 0, "coalesced": 0, "max_depth": 0, "max_lag_ms": 0}
+
+    def _report(self) -> None:
+        depth = len(self.items)
+        self.stats["max_depth"] = max(self.stats["max_depth"], depth)
+        metrics.set_gauge("relay_queue_depth", depth, direction=self.direction)
+        if depth >= self.maxsize:
+            self.not_full.clear()
+        else:
+            self.not_full.set()
+
+    def _evict_droppable(self) -> bool:
+        for item in self.items:
+            if item.policy:
+                self.items.remove(item)
+                self._count("dropped", item.event_type)
+                return True
+        return False
+
+    def _count(self, outcome: str, event_type: Optional[str]) -> None:
+        self.stats[outcome] += 1
+        metrics.increment(f"relay_events_{outcome}", direction=self.direction, event=event_type or "binary")
+
+    async def put(self, message: Message, event_type: Optional[str] = None) -> None:
+        """Queue a message; waits (up to RELAY_SEND_TIMEOUT) only when essential traffic fills the queue"""
+        policy = EVENT_POLICIES.get(event_type)
+        if policy == "coalesce":
+            for item in self.items:
+                if item.event_type == event_type:
+                    item.message = message  # keeps its place (and age) in the queue
+                    self._count("coalesced", event_type)
+                    return
+
+        deadline = time.monotonic() + RELAY_SEND_TIMEOUT
+        while len(self.items) >= self.maxsize and not self._evict_droppable():
+            if policy:
+                self._count("dropped", event_type)
+                return
+            try:
+                await asyncio.wait_for(self.not_full.wait(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                raise RelayStalled(f"{self.direction} queue full for {RELAY_SEND_TIMEOUT:g}s")
+
+        self.items.append(_Item(message, event_type, policy))
+        self.not_empty.set()
+        self._report()
+
+    async def run(self) -> None:
+        """Sender task: drain the queue in order until cancelled"""
+        while True:
+            if not self.items:
+                self.not_empty.clear()
+                await self.not_empty.wait()
+                continue
+            item = self.items.popleft()
+            self._report()
+            try:
+                await asyncio.wait_for(self.send(item.message), RELAY_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise RelayStalled(f"{self.direction} send blocked for {RELAY_SEND_TIMEOUT:g}s")
+            lag_ms = (time.monotonic() - item.queued_at) * 1000
+            self.stats["sent"] += 1
+            self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], lag_ms)
+            metrics.observe("relay_lag_ms", lag_ms, direction=self.direction)
+
+    def summary(self) -> str:
+        s = self.stats
+        return (f"{self.direction}: {s['sent']:.0f} sent, {s['dropped']:.0f} dropped, "
+                f"{s['coalesced']:.0f} coalesced, max depth {s['max_depth']:.0f}, max lag {s['max_lag_ms']:.0f}ms")
+
+
+async def run_relay(**tasks: Awaitable) -> str:
+    """Run the relay loops together; when the first one ends, cancel the rest.
+
+    Returns the name of the loop that ended first (logged with its error, if any).
+    """
+    running = {asyncio.create_task(coro): name for name, coro in tasks.items()}
+    try:
+        done, pending = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    first = next(iter(done))
+    name = running[first]
+    error = None if first.cancelled() else first.exception()
+    if error:
+        print(f"[Relay] {name} ended with {type(error).__name__}: {error}")
+        metrics.increment("relay_connections_ended", reason=type(error).__name__)
+    else:
+        print(f"[Relay] {name} ended, closing the relay")
+        metrics.increment("relay_connections_ended", reason=name)
+    return name
@@ -3,10 +3,19 @@ import websockets
 import json
 import base64
 import os
-import subprocess
-from fastapi import WebSocket
+import time
+from fastapi import WebSocket, WebSocketDisconnect
 from dotenv import load_dotenv
 from datetime import datetime
+from services import metrics
+from services.audio_transcoder import audio_transcoder, REALTIME_SAMPLE_RATE
+from services.audio_analysis import analyze_pcm16, is_silent
+from services.audio_workers import OrderedConverter
+from services.audio_frames import BinaryAudioStream, FrameError, OpusFrameEncoder, opus_available
+from services.realtime_pool import realtime_pool
+from services.realtime_relay import RelayQueue, run_relay
+from services.realtime_events import EventProjector, peek_event_type
+from services.vad import VoiceActivityDetector, VAD_ENABLED, VAD_AUTO_RESPONSE
 
 load_dotenv()
 
@@ -28,110 +37,87 @@ def get_azure_realtime_url():
     return f"{clean_endpoint}/openai/realtime?api-version=2024-10-01-preview&deployment={DEPLOYMENT_NAME}&api-key={AZURE_REALTIME_KEY}"
 
 
-import uuid
+# Select Voice based on Intensity
+# Available OpenAI Realtime voices: alloy, ash, ballad, coral, echo, sage, shimmer, verse
+VOICE_MAP = {
+    "gentle": "shimmer", # Soft, warm female
+    "real": "alloy",     # Neutral, friendly
+    "ruthless": "echo"   # Direct, processed male (closest to tough brother)
+}
+
+
+def build_session_config(voice: str, instructions: str = "") -> dict:
+    """session.update for the relay's fixed audio setup"""
+    return {
+        "type": "session.update",
+        "session": {
+            "modalities": ["audio", "text"],
+            "instructions": instructions,
+            "voice": voice,
+            "input_audio_format": "pcm16",
+            "output_audio_format": "pcm16",
+            "input_audio_transcription": {
+                "model": "whisper-1" 
+            },
+            # Disable Server VAD because we use Push-to-Talk (Manual Commit)
+            "turn_detection": None
+        }
+    }
 
-def convert_audio_to_pcm(base64_audio: str, input_format: str) -> str:
-    """Convert input audio (WAV/M4A) to 24kHz Mono PCM16 for Azure Realtime"""
+
+async def open_realtime_session(voice: str, instructions: str = ""):
+    """Connect to Azure Realtime and send the session config"""
+    azure_ws = await websockets.connect(
+        get_azure_realtime_url(),
+        additional_headers={"OpenAI-Beta": "realtime=v1"}
+    )
+    print("[Azure] ✅ Connected")
+    await azure_ws.send(json.dumps(build_session_config(voice, instructions)))
+    return azure_ws
+
+
+def convert_audio_to_pcm_bytes(base64_audio: str, input_format: str) -> bytes:
+    """Convert input audio (WAV/M4A) to raw 24kHz Mono PCM16 for Azure Realtime"""
     try:
         audio_bytes = base64.b64decode(base64_audio)
-        
-        if input_format == 'wav':
-            # Simply strip the 44-byte WAV header to get raw PCM
-            if len(audio_bytes) > 44:
-                return base64.b64encode(audio_bytes[44:]).decode('utf-8')
-            return None 
-
-        elif input_format == 'm4a':
-            # Use ffmpeg command line to transcode M4A -> PCM 16-bit 24kHz Mono
-            # Use absolute path to avoid CWD issues
-            temp_input = os.path.abspath(f"temp_{uuid.uuid4().hex}.m4a")
-            temp_output = os.path.abspath(f"temp_{uuid.uuid4().hex}.pcm")
-            
-            try:
-                # 1. Write M4A to disk
-                with open(temp_input, "wb") as f:
-                    f.write(audio_bytes)
-
-                print(f"🎤 Input Audio Size: {len(audio_bytes)} bytes (Saved to {temp_input})")
-
-                # 2. Convert using ffmpeg command line
-                # Resolve FFmpeg Path explicitly
-                ffmpeg_exe = "ffmpeg"
-                runtime_ffmpeg = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "ffmpeg_runtime", "bin", "ffmpeg.exe"))
-                if os.path.exists(runtime_ffmpeg):
-                     ffmpeg_exe = runtime_ffmpeg
-                     print(f"🔧 Using Local FFmpeg: {ffmpeg_exe}")
-
-                cmd = [
-                    ffmpeg_exe,
-                    '-y', # Overwrite output
-                    '-i', temp_input,
-                    '-f', 's16le',
-                    '-acodec', 'pcm_s16le',
-                    '-ac', '1',
-                    '-ar', '24000',
-                    temp_output
-                ]
-                print(f"Running FFmpeg: {cmd[0]} ...")
-                
-                result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
-                
-                if result.returncode != 0:
-                    print(f"⚠️ FFmpeg failed: {result.stderr}")
-                    return None
-
-                # 3. Read converted PCM
-                with open(temp_output, 'rb') as f:
-                    pcm_data = f.read()
-
-                if len(pcm_data) == 0:
-                    print(f"⚠️ FFmpeg produced 0 bytes! Stderr: {result.stderr}")
-                    return None
-
-                # CHECK FOR SILENCE (RMS)
-                import math
-                import struct
-                # PCM16 is signed 16-bit little endian
-                count = len(pcm_data) // 2
-                sum_squares = 0.0
-                for i in range(count):
-                    sample = struct.unpack_from('<h', pcm_data, i * 2)[0]
-                    sum_squares += sample * sample
-                
-                rms = math.sqrt(sum_squares / count) if count > 0 else 0
-                print(f"🔊 Converted M4A -> PCM ({len(pcm_data)} bytes) | RMS Amplitude: {rms:.2f}")
-
-                if rms < 100: # Threshold for absolute silence/near silence
-                    print(f"⚠️ WARNING: Audio appears to be SILENT (RMS < 100)")
-                    print(f"   First 20 samples: {[struct.unpack_from('<h', pcm_data, i * 2)[0] for i in range(min(20, count))]}")
-
-                return base64.b64encode(pcm_data).decode('utf-8')
-
-            except FileNotFoundError:
-                print("❌ FFmpeg not found! Please ensure FFmpeg is in PATH")
-                return None
-            except Exception as ffmpeg_err:
-                print(f"⚠️ FFmpeg Exception: {ffmpeg_err}")
-                return None
-            finally:
-                # 3. Cleanup
-                if os.path.exists(temp_input):
-                    os.remove(temp_input)
-                if os.path.exists(temp_output):
-                    os.remove(temp_output)
-
-        # Fallback/Unknown
-        print(f"⚠️ Unknown format: {input_format}")
-        return None
+
+        if input_format not in ("wav", "m4a"):
+            # Fallback/Unknown
+            print(f"⚠️ Unknown format: {input_format}")
+            return None
+
+        pcm_data = audio_transcoder.to_pcm16(audio_bytes, input_format)
+        if not pcm_data:
+            print(f"⚠️ Conversion produced no audio ({input_format}, {len(audio_bytes)} bytes in)")
+            return None
+
+        # CHECK FOR SILENCE (RMS)
+        stats = analyze_pcm16(pcm_data, REALTIME_SAMPLE_RATE)
+        print(f"🔊 Converted {input_format.upper()} -> PCM ({len(pcm_data)} bytes, {audio_transcoder.backend}) | "
+              f"RMS {stats['rms']:.2f} | peak {stats['peak']} | clipped {stats['clipping_ratio']:.2%} | "
+              f"silent {stats['silence_fraction']:.0%}")
+
+        if is_silent(stats): # Threshold for absolute silence/near silence
+            print(f"⚠️ WARNING: Audio appears to be SILENT (RMS < 100)")
+        elif stats["clipping_ratio"] > 0.01:
+            print(f"⚠️ WARNING: Audio is clipping ({stats['clipping_ratio']:.1%} of samples at full scale)")
+
+        return pcm_data
 
     except Exception as e:
         print(f"⚠️ Conversion General Error: {e}")
         return None
 
 
+def convert_audio_to_pcm(base64_audio: str, input_format: str) -> str:
+    """Convert input audio (WAV/M4A) to base64 24kHz Mono PCM16 for Azure Realtime"""
+    pcm_data = convert_audio_to_pcm_bytes(base64_audio, input_format)
+    return base64.b64encode(pcm_data).decode('utf-8') if pcm_data else None
+
 
-async def monitor_recap_task(ws, task):
-    """Wait for recap to finish and notify frontend"""
+
+async def monitor_recap_task(downstream: RelayQueue, task):
+    """Wait for recap to finish and notify frontend (through the connection's downstream queue)"""
     try:
         print("[Realtime] ⏳ Monitoring background recap...")
         recap = await task
@@ -146,20 +132,69 @@ async def monitor_recap_task(ws, task):
              if changes:
                  msg = f"Brain Updated: {' | '.join(changes)}"
                  print(f"[Realtime] 🧠 {msg}")
-                 await ws.send_text(json.dumps({
+                 await downstream.put(json.dumps({
                      "type": "context.saved",
                      "message": msg,
                      "details": recap
-                 }))
+                 }), "context.saved")
     except Exception as e:
         print(f"[Realtime] ⚠️ Recap monitor failed: {e}")
 
 
-async def setup_realtime_websocket(mobile_ws: WebSocket, intensity: str = "real"):
+# Writers still saving after their connection closed (keeps their tasks referenced)
+_active_writers = set()
+
+
+class TranscriptWriter:
+    """Per-connection background writer for transcripts.
+
+    Saving a message reloads and rewrites the session store and may call the LLM
+    for session metadata; the Azure receive loop only enqueues, so audio keeps
+    flowing. Writes run one at a time in arrival order and finish even after
+    the client has gone.
+    """
+
+    def __init__(self, downstream: RelayQueue):
+        self.downstream = downstream
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+        _active_writers.add(self.task)
+        self.task.add_done_callback(_active_writers.discard)
+
+    def submit(self, role: str, transcript: str) -> None:
+        # Timestamped now, not when the write happens
+        timestamp = datetime.utcnow().isoformat() + 'Z'
+        self.queue.put_nowait((role, transcript, timestamp, time.monotonic()))
+        metrics.set_gauge("transcript_queue_depth", self.queue.qsize())
+
+    def close(self) -> None:
+        """No more transcripts; queued ones are still written"""
+        self.queue.put_nowait(None)
+
+    async def _run(self) -> None:
+        from services.session_service import add_message_to_active_session
+
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            role, transcript, timestamp, queued_at = item
+            try:
+                recap_task = await add_message_to_active_session(role, transcript, timestamp=timestamp, is_audio=True)
+                if recap_task:
+                    asyncio.create_task(monitor_recap_task(self.downstream, recap_task))
+            except Exception as save_err:
+                print(f"⚠️ Failed to save history (non-fatal): {save_err}")
+                metrics.increment("transcript_save_errors")
+            metrics.observe("transcript_save_lag_ms", (time.monotonic() - queued_at) * 1000)
+            metrics.set_gauge("transcript_queue_depth", self.queue.qsize())
+
+
+async def setup_realtime_websocket(mobile_ws: WebSocket, intensity: str = "real", output_audio: str = "pcm16",
+                                   events: str = None):
     # ... setup code ...
     from services.ai_service import get_system_prompt
     from services.context_service import get_structured_context
-    from services.session_service import add_message_to_active_session
 
     print(f"\n{'='*60}")
     print(f"[WS] 🚀 STARTING REALTIME WEBSOCKET SETUP")
@@ -188,47 +223,59 @@ async def setup_realtime_websocket(mobile_ws: WebSocket, intensity: str = "real"
             system_instr += f"\n\nCONTEXT:\n{ace_context}"
             pass
         
-        # Select Voice based on Intensity
-        # Available OpenAI Realtime voices: alloy, ash, ballad, coral, echo, sage, shimmer, verse
-        voice_map = {
-            "gentle": "shimmer", # Soft, warm female
-            "real": "alloy",     # Neutral, friendly
-            "ruthless": "echo"   # Direct, processed male (closest to tough brother)
-        }
-        selected_voice = voice_map.get(intensity, "alloy")
+        selected_voice = VOICE_MAP.get(intensity, "alloy")
         print(f"[WS] Selected Voice: {selected_voice}")
         
-        async with websockets.connect(
-            azure_url,
-            additional_headers={"OpenAI-Beta": "realtime=v1"}
-        ) as azure_ws:
-            print("[Azure] ✅ Connected")
-            
-            # 1. Initialize Session
-            session_config = {
-                "type": "session.update",
-                "session": {
-                    "modalities": ["audio", "text"],
-                    "instructions": system_instr,
-                    "voice": selected_voice,
-                    "input_audio_format": "pcm16",
-                    "output_audio_format": "pcm16",
-                    "input_audio_transcription": {
-                        "model": "whisper-1" 
-                    },
-                    # Disable Server VAD because we use Push-to-Talk (Manual Commit)
-                    "turn_detection": None
-                }
-            }
-            await azure_ws.send(json.dumps(session_config))
+        # 1. Initialize Session (a pre-warmed one if the pool has it)
+        async with realtime_pool.session(selected_voice, system_instr) as azure_ws:
+            # Downstream audio: JSON base64 PCM16 deltas, or binary Opus frames when asked for
+            opus_encoder = None
+            if output_audio == "opus":
+                if opus_available():
+                    try:
+                        opus_encoder = OpusFrameEncoder(REALTIME_SAMPLE_RATE)
+                    except Exception as e:
+                        print(f"[WS] ⚠️ Could not open the Opus encoder ({e}), sending PCM16")
+                else:
+                    print("[WS] ⚠️ Opus requested but PyAV/libopus is not available, sending PCM16")
+            await mobile_ws.send_text(json.dumps({
+                "type": "relay.session",
+                "outputAudio": "opus" if opus_encoder else "pcm16"
+            }))
             
             # 2. Relay Loops
+            async def send_to_mobile(message):
+                if isinstance(message, bytes):
+                    await mobile_ws.send_bytes(message)
+                else:
+                    await mobile_ws.send_text(message)
+
+            # Azure -> Mobile goes through a bounded queue so a slow phone never stalls reading Azure
+            downstream = RelayQueue("downstream", send_to_mobile)
+            # Only subscribed events reach the phone, stripped to the fields it uses
+            projector = EventProjector.from_query(events)
+            # Transcripts are saved in the background, in order, off the receive loop
+            transcripts = TranscriptWriter(downstream)
+
             async def azure_receiver():
                 """Receive from Azure -> Send to Mobile"""
                 try:
                     async for msg in azure_ws:
+                        event_type = peek_event_type(msg)
+
+                        # Audio deltas are most of the traffic: skip the full parse/re-serialize
+                        if event_type == "response.audio.delta":
+                            if opus_encoder:
+                                delta = json.loads(msg).get("delta", "")
+                                for frame in opus_encoder.encode(base64.b64decode(delta)):
+                                    await downstream.put(frame)
+                            else:
+                                projected = projector.project_audio_delta(msg)
+                                if projected:
+                                    await downstream.put(projected, event_type)
+                            continue
+
                         event = json.loads(msg)
-                        event_type = event.get("type", "")
                         
                         # Log ALL events to see what Azure is sending
                         if event_type not in ["response.audio.delta", "response.audio_transcript.delta"]:
@@ -258,44 +305,134 @@ async def setup_realtime_websocket(mobile_ws: WebSocket, intensity: str = "real"
                             
                             print("="*60 + "\n")
                         
+                        if opus_encoder:
+                            if event_type in ("response.audio.done", "response.done") and opus_encoder.active:
+                                for frame in opus_encoder.finish():
+                                    await downstream.put(frame)
+
                         if event_type == "response.done":
                             print("\n[Azure] Response Done")
                             
                         # ============================================
                         # PERSISTENCE: Save to Session History
                         # ============================================
-                        try:
-                            if event_type == "conversation.item.input_audio_transcription.completed":
-                                transcript = event.get("transcript", "")
-                                if transcript:
-                                    print(f"💾 Saving USER message: {transcript}")
-                                    recap_task = await add_message_to_active_session("user", transcript, is_audio=True)
-                                    if recap_task:
-                                        asyncio.create_task(monitor_recap_task(mobile_ws, recap_task))
-                                    
-                            elif event_type == "response.audio_transcript.done":
-                                transcript = event.get("transcript", "")
-                                if transcript:
-                                    print(f"💾 Saving AI message: {transcript}")
-                                    recap_task = await add_message_to_active_session("assistant", transcript, is_audio=True)
-                                    if recap_task:
-                                        asyncio.create_task(monitor_recap_task(mobile_ws, recap_task))
-                        except Exception as save_err:
-                            print(f"⚠️ Failed to save history (non-fatal): {save_err}")
-
-                        # Forward ALL events to mobile
-                        await mobile_ws.send_text(msg)
+                        if event_type == "conversation.item.input_audio_transcription.completed":
+                            transcript = event.get("transcript", "")
+                            if transcript:
+                                print(f"💾 Saving USER message: {transcript}")
+                                transcripts.submit("user", transcript)
+                                
+                        elif event_type == "response.audio_transcript.done":
+                            transcript = event.get("transcript", "")
+                            if transcript:
+                                print(f"💾 Saving AI message: {transcript}")
+                                transcripts.submit("assistant", transcript)
+
+                        # Forward subscribed events to mobile
+                        projected = projector.project(event, len(msg))
+                        if projected:
+                            await downstream.put(projected, event_type)
                         
                 except Exception as e:
                     print(f"[Azure Rx] Error: {e}")
-
+                    raise
+
+
+            # Speech gate: silent appends never reach Azure, turns can end server-side
+            vad = VoiceActivityDetector(REALTIME_SAMPLE_RATE) if VAD_ENABLED else None
+
+            async def send_to_azure(event):
+                event_type = event.get("type")
+                if event_type == "input_audio_buffer.append" and isinstance(event.get("audio"), bytes):
+                    pcm_data = event["audio"]
+                    pieces = vad.process(pcm_data) if vad else [(pcm_data, False)]
+                    forwarded = sum(len(audio) for audio, _ in pieces)
+                    if vad and len(pcm_data) < vad.frame_bytes:
+                        pass  # shorter than a VAD frame: held until the next append
+                    elif forwarded == 0:
+                        print("   🔇 SKIPPING AUDIO: No speech in chunk")
+                    elif forwarded < len(pcm_data):
+                        print(f"   🔇 VAD trimmed {len(pcm_data) - forwarded} of {len(pcm_data)} bytes")
+                    for audio, ends_turn in pieces:
+                        if audio:
+                            await azure_ws.send(json.dumps({
+                                **event, "audio": base64.b64encode(audio).decode('utf-8')
+                            }))
+                            print(f"   ✅ Sent {len(audio)} bytes (PCM) to Azure")
+                        if ends_turn:
+                            print("   🎙️ VAD end of speech: auto-committing")
+                            await azure_ws.send(json.dumps({"type": "input_audio_buffer.commit"}))
+                            if VAD_AUTO_RESPONSE:
+                                await azure_ws.send(json.dumps({"type": "response.create"}))
+                    return
+
+                if event_type == "input_audio_buffer.commit" and vad:
+                    tail = vad.flush()
+                    if tail:
+                        await azure_ws.send(json.dumps({
+                            "type": "input_audio_buffer.append", "audio": base64.b64encode(tail).decode('utf-8')
+                        }))
+                    if not vad.should_forward_commit():
+                        print("   🔇 SKIPPING COMMIT: Nothing new since the last commit")
+                        await downstream.put(json.dumps({
+                            "type": "relay.commit_skipped",
+                            "reason": "auto_committed" if vad.auto_committed else "no_speech"
+                        }))
+                        return
+                    vad.mark_committed()
+
+                await azure_ws.send(json.dumps(event))
+                if event_type == "input_audio_buffer.commit":
+                    print("   ✅ Commit sent successfully")
+
+            async def notify_dropped(event):
+                await downstream.put(json.dumps({
+                    "type": "relay.audio_dropped",
+                    "reason": "server_overloaded"
+                }), "relay.audio_dropped")
+
+            # Conversions run on the shared worker pool; events reach Azure in arrival order
+            forwarder = OrderedConverter(send_to_azure, on_shed=notify_dropped)
+
+            # Binary frames (raw PCM16 / Opus) are decoded in arrival order on the loop
+            binary_audio = BinaryAudioStream(REALTIME_SAMPLE_RATE)
+
+            async def submit_commit(event):
+                print("\n" + "="*60)
+                print("📤 COMMITTING AUDIO BUFFER TO AZURE")
+                print("="*60)
+                print("   ⏳ Waiting for Azure to transcribe...")
+                tail = binary_audio.end_turn()
+                if tail:
+                    await forwarder.submit_event({"type": "input_audio_buffer.append", "audio": tail})
+                await forwarder.submit_event(event)
+                print("="*60 + "\n")
 
             async def mobile_receiver():
                 """Receive from Mobile -> Send to Azure"""
                 try:
                     while True:
-                        data = await mobile_ws.receive_text()
-                        event = json.loads(data)
+                        message = await mobile_ws.receive()
+                        if message["type"] == "websocket.disconnect":
+                            raise WebSocketDisconnect(message.get("code", 1000))
+
+                        if message.get("bytes") is not None:
+                            try:
+                                pcm_data, commit = binary_audio.decode(message["bytes"])
+                            except FrameError as e:
+                                print(f"[Frames] ❌ Rejected frame: {e}")
+                                await downstream.put(json.dumps({
+                                    "type": "relay.error",
+                                    "error": {"type": "invalid_frame", "message": str(e)}
+                                }))
+                                continue
+                            if pcm_data:
+                                await forwarder.submit_event({"type": "input_audio_buffer.append", "audio": pcm_data})
+                            if commit:
+                                await submit_commit({"type": "input_audio_buffer.commit"})
+                            continue
+
+                        event = json.loads(message["text"])
                         
                         # Forward Input Audio
                         if event.get("type") == "input_audio_buffer.append":
@@ -304,43 +441,41 @@ async def setup_realtime_websocket(mobile_ws: WebSocket, intensity: str = "real"
                                 print(f"\n📥 [Mobile] Received audio buffer (format: {fmt})")
                                 print(f"   📊 Original audio size: {len(event['audio'])} bytes (base64)")
                                 
-                                converted_audio = convert_audio_to_pcm(event["audio"], fmt)
-                                
-                                if converted_audio:
-                                    event["audio"] = converted_audio
-                                    print(f"   ✅ Converted audio size: {len(converted_audio)} bytes (base64)")
-                                    print(f"   📤 Sending to Azure...")
-                                    await azure_ws.send(json.dumps(event))
-                                    print(f"   ✅ Sent to Azure successfully")
-                                else:
-                                    # Conversion failed - log it!
-                                    print("   ❌ SKIPPING AUDIO: Conversion failed")
+                                await forwarder.submit_audio(event, convert_audio_to_pcm_bytes, event["audio"], fmt)
                             
                             
                         # Forward Interruptions / Commit events
                         elif event.get("type") == "input_audio_buffer.commit":
-                             print("\n" + "="*60)
-                             print("📤 COMMITTING AUDIO BUFFER TO AZURE")
-                             print("="*60)
-                             print("   ⏳ Waiting for Azure to transcribe...")
-                             await azure_ws.send(json.dumps(event))
-                             print("   ✅ Commit sent successfully")
-                             print("="*60 + "\n")
+                             await submit_commit(event)
                         
                         # Forward 'response.create' and others
                         else:
                             if event.get("type") == "response.create":
                                 print(f"\n📤 [Mobile] Requesting response from Azure")
                                 print(f"   📦 Payload: {json.dumps(event)}")
-                            await azure_ws.send(json.dumps(event))
+                            await forwarder.submit_event(event)
 
                              
+                except WebSocketDisconnect:
+                    print("[Mobile Rx] Client disconnected")
                 except Exception as e:
                     print(f"[Mobile Rx] Error: {e}")
+                    raise
 
 
-            # Run relays
-            await asyncio.gather(azure_receiver(), mobile_receiver())
+            # Run relays: receivers and senders for both directions; the first to end cancels the rest
+            try:
+                await run_relay(
+                    azure_receiver=azure_receiver(),
+                    mobile_receiver=mobile_receiver(),
+                    upstream_sender=forwarder.run(),
+                    downstream_sender=downstream.run(),
+                )
+            finally:
+                transcripts.close()
+                print(f"[Relay] {downstream.summary()}")
+                print(f"[Relay] {projector.report()}")
+                print(f"[Relay] upstream: {forwarder.shed} shed, max lag {forwarder.max_lag_ms:.0f}ms")
 
     except Exception as e:
         print(f"\n{'='*60}")
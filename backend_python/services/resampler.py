@@ -0,0 +1,117 @@
+"""
+Resampler - Streaming polyphase resampling and downmixing on NumPy
+Converts any input rate to the realtime relay's 24 kHz by a rational factor L/M
+with a Kaiser-windowed sinc filter split into L phases, so only the taps that
+land on real input samples are computed. State carries across chunks, so a
+stream resampled piece by piece matches the one-shot result.
+"""
+from math import gcd
+from functools import lru_cache
+import numpy as np
+
+# Input samples on each side of an output sample (scaled up when decimating)
+RESAMPLER_HALF_TAPS = 16
+KAISER_BETA = 8.6
+# Passband edge as a fraction of the lower Nyquist frequency
+ROLLOFF = 0.94
+
+
+def downmix(samples: np.ndarray) -> np.ndarray:
+    """(frames, channels) → mono float32"""
+    if samples.ndim == 1:
+        return samples.astype(np.float32, copy=False)
+    if samples.shape[1] == 1:
+        return samples[:, 0].astype(np.float32)
+    return samples.astype(np.float32).mean(axis=1)
+
+
+def to_pcm16(samples: np.ndarray) -> bytes:
+    """Float samples in int16 scale → clipped little-endian PCM16 bytes"""
+    return np.clip(np.rint(samples), -32768, 32767).astype("<i2").tobytes()
+
+
+@lru_cache(maxsize=16)
+def filter_bank(up: int, down: int, half: int) -> np.ndarray:
+    """(L, taps) filter bank; row p holds the taps for output phase p. Cached per ratio."""
+    taps = 2 * half + 1
+    n = np.arange(2 * half * up + 1) - half * up
+    cutoff = ROLLOFF * 0.5 / max(up, down)  # cycles per upsampled sample
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(len(n), KAISER_BETA)
+    h *= up / h.sum()  # unity DC gain through the zero-stuffed input
+    h = np.concatenate((h, np.zeros(taps * up - len(h))))
+    # Phase p, tap k multiplies input sample (centre + half - k)
+    bank = h.reshape(taps, up).T[:, ::-1].astype(np.float32).copy()
+    bank.setflags(write=False)
+    return bank
+
+
+class PolyphaseResampler:
+    """Mono streaming resampler from in_rate to out_rate"""
+
+    def __init__(self, in_rate: int, out_rate: int):
+        g = gcd(in_rate, out_rate)
+        self.up = out_rate // g      # L
+        self.down = in_rate // g     # M
+        self.half = RESAMPLER_HALF_TAPS * max(1, -(-self.down // self.up))
+        self.taps = 2 * self.half + 1
+        self.phases = filter_bank(self.up, self.down, self.half)
+
+        # Input history; buffer[0] is global input sample `offset` (starts in the zero padding)
+        self.buffer = np.zeros(self.half, dtype=np.float32)
+        self.offset = -self.half
+        self.produced = 0
+        self.consumed = 0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Feed mono samples; returns every output sample that is now fully determined"""
+        if self.up == self.down:
+            self.consumed += len(samples)
+            self.produced += len(samples)
+            return samples.astype(np.float32, copy=False)
+
+        self.consumed += len(samples)
+        self.buffer = np.concatenate((self.buffer, samples.astype(np.float32, copy=False)))
+        last = self.offset + len(self.buffer) - 1
+
+        # Output n needs input up to floor(n*M/L) + half
+        stop = ((last - self.half + 1) * self.up - 1) // self.down + 1
+        if stop <= self.produced:
+            return np.zeros(0, dtype=np.float32)
+
+        n = np.arange(self.produced, stop, dtype=np.int64)
+        position = n * self.down
+        centre = position // self.up
+        phase = position % self.up
+        start = centre - self.half - self.offset
+        windows = np.lib.stride_tricks.sliding_window_view(self.buffer, self.taps)[start]
+        out = np.einsum("ij,ij->i", windows, self.phases[phase])
+
+        self.produced = stop
+        # Drop history no later output can reach
+        keep_from = (self.produced * self.down) // self.up - self.half - self.offset
+        if keep_from > 0:
+            self.buffer = self.buffer[keep_from:]
+            self.offset += keep_from
+        return out
+
+    def flush(self) -> np.ndarray:
+        """Emit the tail held back for look-ahead (end of stream)"""
+        if self.up == self.down:
+            return np.zeros(0, dtype=np.float32)
+        target = -(-self.consumed * self.up // self.down)
+        out = self.process(np.zeros(self.half, dtype=np.float32))
+        self.consumed -= self.half
+        excess = self.produced - target
+        if excess > 0:
+            out = out[:len(out) - excess]
+            self.produced = target
+        return out
+
+
+def resample_pcm16(samples: np.ndarray, in_rate: int, out_rate: int) -> bytes:
+    """One-shot downmix + resample of a whole buffer to mono PCM16 bytes"""
+    mono = downmix(samples)
+    if in_rate == out_rate:
+        return to_pcm16(mono)
+    resampler = PolyphaseResampler(in_rate, out_rate)
+    return to_pcm16(np.concatenate((resampler.process(mono), resampler.flush())))
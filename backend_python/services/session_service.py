@@ -5,23 +5,18 @@ Groups messages into sessions with AI-generated titles
 import json
 from typing import List, Dict
 from datetime import datetime, timedelta
-from openai import AsyncAzureOpenAI
 import os
 import asyncio
 from dotenv import load_dotenv
+from services.llm_gateway import llm_gateway
+from services.llm_scheduler import LANE_BACKGROUND
 from services.database import db_service
 
 load_dotenv()
 
-# Initialize Azure OpenAI client
-client = AsyncAzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_KEY"),
-    api_version="2024-08-01-preview",
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-)
-
 CHAT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-4o")
 SESSION_GAP_HOURS = 2  # New session after 2 hour gap
+METADATA_CACHE_TTL = int(os.getenv("SESSION_METADATA_CACHE_TTL", "3600"))
 
 def _load_sessions() -> List[Dict]:
     """Load conversation sessions from PostgreSQL app_state"""
@@ -85,7 +80,10 @@ Response format (JSON only):
   "tags": ["tag1", "tag2"]
 }}"""
         
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat_completion(
+            "session_metadata",
+            lane=LANE_BACKGROUND,
+            cache_ttl=METADATA_CACHE_TTL,
             model=CHAT_DEPLOYMENT,
             messages=[{"role": "user", "content": prompt}],
             max_tokens=60,
@@ -122,23 +120,17 @@ def detect_session_end(messages: List[Dict]) -> bool:
     
     return any(keyword in content_lower for keyword in goodbye_keywords)
 
-async def create_session_from_messages(messages: List[Dict], session_id: str = None) -> Dict:
-    """Create a session object from messages with AI-generated title"""
+def _build_session(messages: List[Dict], metadata: Dict, session_id: str = None) -> Dict:
+    """Session object for `messages` with the given title/priority/tags"""
     import uuid
     
-    if not messages:
-        return None
-    
-    # Generate metadata using AI
-    metadata = await generate_session_metadata(messages)
-    
     # Append date to title for better organization
     base_title = metadata.get('title', 'New Conversation')
     first_msg_time = datetime.fromisoformat(messages[0]['timestamp'].replace('Z', '+00:00'))
     date_str = first_msg_time.strftime('%b %d')
     final_title = f"{base_title} - {date_str}"
     
-    session = {
+    return {
         'id': session_id or f"sess_{uuid.uuid4().hex[:8]}",
         'title': final_title,
         'priority': metadata.get('priority', 'low'),
@@ -148,8 +140,51 @@ async def create_session_from_messages(messages: List[Dict], session_id: str = N
         'lastMessageTime': messages[-1]['timestamp'],
         'messages': messages
     }
+
+async def create_session_from_messages(messages: List[Dict], session_id: str = None) -> Dict:
+    """Create a session object from messages with AI-generated title"""
+    if not messages:
+        return None
     
-    return session
+    # Generate metadata using AI
+    metadata = await generate_session_metadata(messages)
+    return _build_session(messages, metadata, session_id)
+
+# Latest metadata refresh scheduled per session id (older results are discarded)
+_metadata_pending: Dict[str, int] = {}
+_metadata_tasks = set()
+
+def _schedule_metadata_refresh(session: Dict) -> None:
+    """Title the session in the background so the reply path never waits on the LLM"""
+    session_id = session['id']
+    count = session['messageCount']
+    _metadata_pending[session_id] = count
+    task = asyncio.create_task(_refresh_session_metadata(session_id, list(session['messages']), count))
+    _metadata_tasks.add(task)
+    task.add_done_callback(_metadata_tasks.discard)
+
+async def _refresh_session_metadata(session_id: str, messages: List[Dict], count: int) -> None:
+    try:
+        metadata = await generate_session_metadata(messages)
+        if _metadata_pending.get(session_id) != count:
+            return  # a newer message scheduled its own refresh
+        _metadata_pending.pop(session_id, None)
+        
+        # Reload: other messages may have been saved while the LLM was running
+        sessions = _load_sessions()
+        session = next((s for s in sessions if s['id'] == session_id), None)
+        if session is None:
+            return
+        
+        # [FIX]: Preserve the date-stamp when updating the title
+        new_base_title = metadata.get('title', session['title'].split(' - ')[0])
+        first_msg_time = datetime.fromisoformat(session['timestamp'].replace('Z', '+00:00'))
+        session['title'] = f"{new_base_title} - {first_msg_time.strftime('%b %d')}"
+        session['priority'] = metadata.get('priority', 'low')
+        session['tags'] = metadata.get('tags', [])
+        _save_sessions(sessions)
+    except Exception as e:
+        print(f"[Sessions] ⚠️ Metadata refresh failed for {session_id}: {e}")
 
 async def group_messages_into_sessions(messages: List[Dict]) -> List[Dict]:
     """Group flat message list into conversation sessions"""
@@ -229,20 +264,11 @@ async def add_message_to_active_session(role: str, content: str, timestamp: str
             last_session['messageCount'] = len(last_session['messages'])
             last_session['lastMessageTime'] = timestamp
             
+            _save_sessions(sessions)
+            
             # Regenerate metadata if session is still growing
             if len(last_session['messages']) <= 10:
-                metadata = await generate_session_metadata(last_session['messages'])
-                
-                # [FIX]: Preserve the date-stamp when updating the title
-                new_base_title = metadata.get('title', last_session['title'].split(' - ')[0])
-                first_msg_time = datetime.fromisoformat(last_session['timestamp'].replace('Z', '+00:00'))
-                date_str = first_msg_time.strftime('%b %d')
-                
-                last_session['title'] = f"{new_base_title} - {date_str}"
-                last_session['priority'] = metadata.get('priority', 'low')
-                last_session['tags'] = metadata.get('tags', [])
-            
-            _save_sessions(sessions)
+                _schedule_metadata_refresh(last_session)
             
             # Auto-Recap: If goodbye detected, run analysis in background
             if detect_session_end([new_message]):
@@ -260,11 +286,13 @@ async def add_message_to_active_session(role: str, content: str, timestamp: str
         from services.perspective_service import generate_session_recap
         recap_task = asyncio.create_task(generate_session_recap(last_session['messages']))
         
-    new_session = await create_session_from_messages([new_message])
+    # Saved under a placeholder title; the AI title follows in the background
+    new_session = _build_session([new_message], {})
     sessions.append(new_session)
     _save_sessions(sessions)
+    _schedule_metadata_refresh(new_session)
     
-    print(f"[Sessions] Created new session in PostgreSQL: {new_session['title']}")
+    print(f"[Sessions] Created new session in PostgreSQL: {new_session['id']}")
     return recap_task
 
 async def force_end_active_session() -> bool:
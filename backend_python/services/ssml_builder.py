@@ -0,0 +1,196 @@
+"""
+SSML Builder - Voice presets, escaped SSML and segmented synthesis helpers
+Replies are XML-escaped before going into SSML, long replies are split into
+sentence-aligned segments that share one voice/prosody preset, and segment
+audio is joined without re-encoding (raw PCM/WAV and MP3 only; Ogg replies are
+synthesized in one request)
+"""
+import os
+import re
+import struct
+from typing import Dict, List
+from xml.sax.saxutils import escape, quoteattr
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Replies longer than this are synthesized as several concurrent segments
+TTS_SEGMENT_MAX_CHARS = int(os.getenv("TTS_SEGMENT_MAX_CHARS", "400"))
+TTS_SEGMENT_CONCURRENCY = int(os.getenv("TTS_SEGMENT_CONCURRENCY", "3"))
+
+VOICE_PRESETS: Dict[str, Dict] = {
+    # Gentle: Soft, motherly, peaceful voice (Female, calm)
+    "gentle": {
+        "voice_name": "hi-IN-SwaraNeural",  # Soft female voice
+        "rate": "-5%",  # Slower for calm
+        "pitch": "+2Hz",  # Slightly higher for warmth
+        "volume": "default",
+        "style": None,
+    },
+    # Real: Friendly but firm (Female, friendly)
+    "real": {
+        "voice_name": "hi-IN-SwaraNeural",  # Same voice but different style
+        "rate": "+5%",  # Slightly faster than gentle
+        "pitch": "+0Hz",  # Normal pitch
+        "volume": "default",
+        "style": None,
+    },
+    # Ruthless (Valentine Mode): Deep, Warm, Intellectual Male Voice
+    # Using AndrewNeural (US) - Warm and articulate
+    "ruthless": {
+        "voice_name": "en-US-AndrewNeural",
+        "rate": "-5%",  # Slightly slower for thoughtfulness
+        "pitch": "-5Hz",  # Deeper for warmth/masculinity
+        "volume": "+5%",
+        "style": "empathetic",  # Valentine style: Empathetic, Warm
+    },
+}
+
+# Sentence end (incl. Hindi danda) followed by whitespace, or a line break
+SENTENCE_END = re.compile(r'(?<=[.!?।…])["\'”’)\]]*\s+|\n+')
+# Softer break points for sentences that are too long on their own
+_CLAUSE_END = re.compile(r'(?<=[,;:—])\s+')
+
+
+def get_voice_preset(intensity: str) -> Dict:
+    """Voice and prosody for an intensity (real is the default)"""
+    return dict(VOICE_PRESETS.get(intensity, VOICE_PRESETS["real"]))
+
+
+def build_ssml(text: str, settings: Dict) -> str:
+    """SSML request with prosody control; `text` is escaped"""
+    body = escape(text.strip())
+    voice = quoteattr(settings["voice_name"])
+    rate = quoteattr(settings["rate"])
+    pitch = quoteattr(settings["pitch"])
+    if settings["style"]:
+        return (
+            "<speak version='1.0' xml:lang='en-US' xmlns:mstts='https://www.w3.org/2001/mstts'>"
+            f"<voice name={voice}>"
+            f"<mstts:express-as style={quoteattr(settings['style'])} styledegree='1.2'>"
+            f"<prosody rate={rate} pitch={pitch} volume={quoteattr(settings['volume'])}>"
+            f"{body}"
+            "</prosody></mstts:express-as></voice></speak>"
+        )
+    return (
+        "<speak version='1.0' xml:lang='en-US'>"
+        f"<voice name={voice}>"
+        f"<prosody rate={rate} pitch={pitch}>"
+        f"{body}"
+        "</prosody></voice></speak>"
+    )
+
+
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    """Break an over-long sentence at clause boundaries, then at spaces"""
+    pieces = []
+    for clause in _CLAUSE_END.split(sentence):
+        while len(clause) > max_chars:
+            cut = clause.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(clause[:cut])
+            clause = clause[cut:].lstrip()
+        if clause:
+            pieces.append(clause)
+    return pieces
+
+
+def split_segments(text: str, max_chars: int = TTS_SEGMENT_MAX_CHARS) -> List[str]:
+    """Pack whole sentences into segments of at most `max_chars` characters"""
+    text = text.strip()
+    if len(text) <= max_chars:
+        return [text] if text else []
+
+    units = []
+    for sentence in SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        units.extend(_split_long(sentence, max_chars) if len(sentence) > max_chars else [sentence])
+
+    segments = []
+    current = ""
+    for unit in units:
+        if current and len(current) + 1 + len(unit) > max_chars:
+            segments.append(current)
+            current = unit
+        else:
+            current = f"{current} {unit}" if current else unit
+    if current:
+        segments.append(current)
+    return segments
+
+
+# ---- audio concatenation (no re-encoding) ---------------------------------
+
+def _wav_parts(data: bytes):
+    """(fmt chunk body, PCM data) from a RIFF/WAVE file"""
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("not a RIFF/WAVE file")
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id, size = struct.unpack_from("<4sI", data, offset)
+        body_start = offset + 8
+        if chunk_id == b"fmt ":
+            fmt = data[body_start:body_start + size]
+        elif chunk_id == b"data":
+            # Streamed WAVs may carry a placeholder size: take the rest of the file
+            end = len(data) if size in (0, 0xFFFFFFFF) else min(len(data), body_start + size)
+            return fmt, data[body_start:end]
+        offset = body_start + size + (size & 1)
+    raise ValueError("WAV file has no data chunk")
+
+
+def _concat_wav(parts: List[bytes]) -> bytes:
+    fmt, first = _wav_parts(parts[0])
+    pcm = [first]
+    for part in parts[1:]:
+        part_fmt, data = _wav_parts(part)
+        if part_fmt != fmt:
+            raise ValueError("WAV segments have different formats")
+        pcm.append(data)
+    data = b"".join(pcm)
+    header = (
+        b"RIFF" + struct.pack("<I", 4 + 8 + len(fmt) + 8 + len(data)) + b"WAVE"
+        + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+        + b"data" + struct.pack("<I", len(data))
+    )
+    return header + data
+
+
+def _strip_id3(data: bytes) -> bytes:
+    """Drop a leading ID3v2 tag so only MPEG frames are appended"""
+    if data[:3] != b"ID3" or len(data) < 10:
+        return data
+    size = ((data[6] & 0x7F) << 21) | ((data[7] & 0x7F) << 14) | ((data[8] & 0x7F) << 7) | (data[9] & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return data[10 + size + footer:]
+
+
+def can_concat(output_format: str) -> bool:
+    """Whether segments of this Azure output format can be joined by concat_audio.
+
+    Not Ogg: appended Ogg files are chained streams, each with its own headers
+    and pre-skip, and many decoders (AVFoundation among them) play only the first.
+    """
+    return output_format.startswith(("riff", "raw")) or output_format.endswith("mp3")
+
+
+def concat_audio(parts: List[bytes], output_format: str) -> bytes:
+    """Join segment audio of one Azure output format without re-encoding.
+
+    riff: PCM data chunks are merged under a rebuilt header.
+    raw: headerless PCM is appended as-is.
+    mp3: MPEG frames are self-delimiting, so segments are appended (ID3 tags stripped).
+    """
+    parts = [p for p in parts if p]
+    if len(parts) <= 1:
+        return parts[0] if parts else b""
+    if not can_concat(output_format):
+        raise ValueError(f"Can't concatenate output format '{output_format}'")
+    if output_format.startswith("riff"):
+        return _concat_wav(parts)
+    if output_format.endswith("mp3"):
+        return parts[0] + b"".join(_strip_id3(p) for p in parts[1:])
+    return b"".join(parts)
@@ -0,0 +1,241 @@
+"""
+TTS Cache - Content-addressed cache of synthesized speech
+Keyed by text, voice settings and output format; in-process LRU tier bounded by
+bytes plus an optional size-bounded on-disk tier (set TTS_CACHE_DIR). Canned
+phrases are prewarmed at startup and pinned in memory.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+from dotenv import load_dotenv
+from services import metrics
+
+load_dotenv()
+
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "")  # empty = memory tier only
+TTS_CACHE_DISK_MAX_BYTES = int(os.getenv("TTS_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+TTS_PREWARM_CONCURRENCY = int(os.getenv("TTS_PREWARM_CONCURRENCY", "4"))
+
+
+def make_tts_key(text: str, settings: Dict, output_format: str) -> str:
+    """Hash everything that changes the synthesized audio into a stable key"""
+    material = [
+        text.strip(),
+        settings.get("voice_name"),
+        settings.get("rate"),
+        settings.get("pitch"),
+        settings.get("volume"),
+        settings.get("style"),
+        output_format,
+    ]
+    return hashlib.sha256(json.dumps(material, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class TTSAudioCache:
+    """Two-tier (memory LRU + optional disk) cache of synthesized audio bytes"""
+
+    def __init__(self, max_bytes: int = TTS_CACHE_MAX_BYTES, cache_dir: str = TTS_CACHE_DIR,
+                 disk_max_bytes: int = TTS_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self.memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self.memory_bytes = 0
+        self.pinned: Dict[str, bytes] = {}  # prewarmed canned phrases, never evicted
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self.lookups = 0
+        self.hits = 0
+        self.disk_bytes: Optional[int] = None  # computed lazily on first disk write
+        self.disk_lock = threading.Lock()
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # ---- disk tier -------------------------------------------------------
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.audio"
+
+    def _disk_read(self, key: str) -> Optional[bytes]:
+        path = self._disk_path(key)
+        try:
+            audio = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mtime doubles as last-access time for eviction
+        except OSError:
+            pass
+        return audio
+
+    def _disk_usage(self) -> int:
+        return sum(p.stat().st_size for p in self.cache_dir.glob("*/*.audio"))
+
+    def _disk_evict(self) -> None:
+        """Delete least recently used files until the disk tier fits its budget"""
+        files = sorted(self.cache_dir.glob("*/*.audio"), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            if self.disk_bytes <= self.disk_max_bytes:
+                break
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                self.disk_bytes -= size
+                metrics.increment("tts_cache_disk_evictions")
+            except OSError:
+                pass
+
+    def _disk_write(self, key: str, audio: bytes) -> None:
+        with self.disk_lock:
+            if self.disk_bytes is None:
+                self.disk_bytes = self._disk_usage()
+            path = self._disk_path(key)
+            if path.exists():
+                return
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(audio)
+            os.replace(tmp_path, path)
+            self.disk_bytes += len(audio)
+            if self.disk_bytes > self.disk_max_bytes:
+                self._disk_evict()
+            metrics.set_gauge("tts_cache_disk_bytes", self.disk_bytes)
+
+    # ---- memory tier -----------------------------------------------------
+
+    def _memory_put(self, key: str, audio: bytes) -> None:
+        if key in self.pinned or len(audio) > self.max_bytes:
+            return
+        previous = self.memory.pop(key, None)
+        if previous is not None:
+            self.memory_bytes -= len(previous)
+        self.memory[key] = audio
+        self.memory_bytes += len(audio)
+        while self.memory_bytes > self.max_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+        metrics.set_gauge("tts_cache_memory_bytes", self.memory_bytes)
+
+    def _record(self, tier: Optional[str]) -> None:
+        self.lookups += 1
+        if tier:
+            self.hits += 1
+            metrics.increment("tts_cache_hits", tier=tier)
+        else:
+            metrics.increment("tts_cache_misses")
+        metrics.set_gauge("tts_cache_hit_ratio", self.hits / self.lookups)
+
+    # ---- lookups ---------------------------------------------------------
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Return cached audio or None"""
+        audio = self.pinned.get(key)
+        if audio is not None:
+            self._record("pinned")
+            return audio
+
+        audio = self.memory.get(key)
+        if audio is not None:
+            self.memory.move_to_end(key)
+            self._record("memory")
+            return audio
+
+        if self.cache_dir:
+            try:
+                audio = await asyncio.to_thread(self._disk_read, key)
+            except Exception as e:
+                print(f"[TTS Cache] Disk read error: {e}")
+                audio = None
+            if audio:
+                self._memory_put(key, audio)
+                self._record("disk")
+                return audio
+
+        self._record(None)
+        return None
+
+    async def set(self, key: str, audio: bytes, pin: bool = False) -> None:
+        if pin:
+            self.pinned[key] = audio
+            stale = self.memory.pop(key, None)
+            if stale is not None:
+                self.memory_bytes -= len(stale)
+        else:
+            self._memory_put(key, audio)
+        if self.cache_dir:
+            try:
+                await asyncio.to_thread(self._disk_write, key, audio)
+            except Exception as e:
+                print(f"[TTS Cache] Disk write error: {e}")
+
+    async def get_or_synthesize(self, key: str, synthesize: Callable[[], Awaitable[bytes]],
+                                pin: bool = False) -> bytes:
+        """Return cached audio, or run `synthesize()` once for concurrent identical requests.
+
+        Empty results (synthesis failures) are returned but never cached.
+        """
+        audio = await self.get(key)
+        if audio is not None:
+            if pin and key not in self.pinned:
+                await self.set(key, audio, pin=True)
+            return audio
+
+        pending = self.in_flight.get(key)
+        if pending:
+            metrics.increment("tts_cache_coalesced")
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise  # this caller was cancelled
+            # The turn that was synthesizing it went away: take over (or join whoever did first)
+            return await self.get_or_synthesize(key, synthesize, pin)
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            audio = await synthesize()
+            if audio:
+                await self.set(key, audio, pin=pin)
+            future.set_result(audio)
+            return audio
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            del self.in_flight[key]
+
+    async def prewarm(self, items: Iterable, synthesize: Callable[..., Awaitable[bytes]]) -> int:
+        """Synthesize and pin (text, intensity) pairs; returns how many are now cached.
+
+        `synthesize(text, intensity, pin=True)` is the normal cached synthesis path.
+        """
+        semaphore = asyncio.Semaphore(TTS_PREWARM_CONCURRENCY)
+        start = time.monotonic()
+
+        async def warm(text: str, intensity: str) -> bool:
+            async with semaphore:
+                try:
+                    return bool(await synthesize(text, intensity, pin=True))
+                except Exception as e:
+                    print(f"[TTS Cache] Prewarm failed for {text[:30]!r} ({intensity}): {e}")
+                    return False
+
+        results = await asyncio.gather(*(warm(text, intensity) for text, intensity in items))
+        warmed = sum(results)
+        print(f"[TTS Cache] Prewarmed {warmed}/{len(results)} phrases in {time.monotonic() - start:.1f}s")
+        return warmed
+
+
+# Singleton instance
+tts_cache = TTSAudioCache()
@@ -0,0 +1,123 @@
+"""
+TTS Client - Long-lived pooled HTTP client for Azure Speech synthesis
+Keeps HTTP/2 (when available) keep-alive connections to the regional TTS host,
+warmed up at startup and shared by every synthesis call site
+"""
+import os
+import re
+import time
+from typing import Optional
+import httpx
+from dotenv import load_dotenv
+from services import metrics
+
+load_dotenv()
+
+AZURE_TTS_KEY = os.getenv("AZURE_TTS_KEY") or os.getenv("AZURE_OPENAI_KEY")
+AZURE_TTS_ENDPOINT = os.getenv("AZURE_TTS_ENDPOINT") or os.getenv("AZURE_OPENAI_ENDPOINT") or ""
+
+TTS_POOL_SIZE = int(os.getenv("TTS_POOL_SIZE", "10"))
+TTS_KEEPALIVE_EXPIRY = float(os.getenv("TTS_KEEPALIVE_EXPIRY", "120"))
+TTS_TIMEOUT = float(os.getenv("TTS_TIMEOUT", "15"))
+TTS_HTTP2 = os.getenv("TTS_HTTP2", "1") == "1"
+
+KNOWN_REGIONS = ["swedencentral", "northcentralus", "eastus", "westus"]
+DEFAULT_REGION = "swedencentral"  # where all services are deployed
+
+
+def resolve_region(endpoint: str) -> str:
+    """Work out the Speech region once from AZURE_TTS_REGION or the endpoint URL"""
+    explicit = os.getenv("AZURE_TTS_REGION")
+    if explicit:
+        return explicit
+    # Regional Speech endpoints look like https://<region>.tts.speech.microsoft.com/...
+    match = re.match(r"https?://([a-z0-9]+)\.(?:tts|stt|api)\.(?:speech|cognitive)\.microsoft\.com", endpoint or "")
+    if match:
+        return match.group(1)
+    for region in KNOWN_REGIONS:
+        if region in (endpoint or ""):
+            return region
+    return DEFAULT_REGION
+
+
+def _http2_available() -> bool:
+    if not TTS_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        print("[TTS] 'h2' not installed, using HTTP/1.1 keep-alive")
+        return False
+
+
+class TTSClient:
+    """Shared Azure Speech REST client"""
+
+    def __init__(self):
+        self.region = resolve_region(AZURE_TTS_ENDPOINT)
+        self.base_url = f"https://{self.region}.tts.speech.microsoft.com"
+        self.tts_url = f"{self.base_url}/cognitiveservices/v1"
+        self.http_client: Optional[httpx.AsyncClient] = None
+
+    def _client(self) -> httpx.AsyncClient:
+        if self.http_client is None or self.http_client.is_closed:
+            self.http_client = httpx.AsyncClient(
+                http2=_http2_available(),
+                limits=httpx.Limits(
+                    max_connections=TTS_POOL_SIZE,
+                    max_keepalive_connections=TTS_POOL_SIZE,
+                    keepalive_expiry=TTS_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(TTS_TIMEOUT, connect=5.0),
+                headers={"Ocp-Apim-Subscription-Key": AZURE_TTS_KEY or "", "User-Agent": "SnehBackend"},
+            )
+        return self.http_client
+
+    async def warm_up(self) -> None:
+        """Open a connection (DNS + TCP + TLS) to the TTS host before the first request"""
+        start = time.monotonic()
+        try:
+            response = await self._client().get(f"{self.base_url}/cognitiveservices/voices/list")
+            elapsed = (time.monotonic() - start) * 1000
+            print(f"[TTS] Warmed up {self.region} in {elapsed:.0f}ms "
+                  f"(status {response.status_code}, {response.http_version})")
+            metrics.observe("tts_warmup_ms", elapsed)
+        except Exception as e:
+            print(f"[TTS] Warm-up failed: {e}")
+
+    async def synthesize(self, ssml: str, output_format: str) -> bytes:
+        """POST SSML and return the audio bytes (b"" on failure)"""
+        start = time.monotonic()
+        try:
+            response = await self._client().post(
+                self.tts_url,
+                headers={
+                    "Content-Type": "application/ssml+xml",
+                    "X-Microsoft-OutputFormat": output_format,
+                },
+                content=ssml.encode("utf-8"),
+            )
+        except Exception as e:
+            metrics.increment("tts_errors", error=type(e).__name__)
+            print(f"❌ Azure TTS Error: {e}")
+            return b""
+
+        elapsed = (time.monotonic() - start) * 1000
+        metrics.observe("tts_request_ms", elapsed, format=output_format)
+        if response.status_code != 200:
+            metrics.increment("tts_errors", error=str(response.status_code))
+            print(f"❌ Azure TTS Failed: {response.status_code} - {response.text}")
+            return b""
+
+        metrics.observe("tts_audio_bytes", len(response.content), format=output_format)
+        print(f"[TTS] Synthesized {len(response.content)} bytes in {elapsed:.0f}ms ({response.http_version})")
+        return response.content
+
+    async def aclose(self) -> None:
+        if self.http_client is not None:
+            await self.http_client.aclose()
+
+
+# Singleton instance
+tts_client = TTSClient()
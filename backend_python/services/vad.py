@@ -0,0 +1,129 @@
+"""
+VAD - Energy-based voice activity detection for the realtime relay
+Runs per connection on converted 24 kHz PCM16: drops appends that are entirely
+silence, trims silence before and after speech within a turn, and can commit
+the input buffer itself when the speaker stops (VAD_AUTO_COMMIT=1)
+"""
+import os
+from typing import List, Tuple
+from dotenv import load_dotenv
+from services import metrics
+from services.audio_analysis import as_samples, frame_rms
+
+load_dotenv()
+
+VAD_ENABLED = os.getenv("VAD_ENABLED", "1") == "1"
+# Frame RMS (int16 units) above which a 20 ms frame counts as speech
+VAD_SPEECH_RMS = float(os.getenv("VAD_SPEECH_RMS", "300"))
+# Audio kept before the first speech frame so onsets aren't clipped
+VAD_PREROLL_MS = int(os.getenv("VAD_PREROLL_MS", "200"))
+# Pauses shorter than this inside speech are forwarded as-is
+VAD_HANGOVER_MS = int(os.getenv("VAD_HANGOVER_MS", "400"))
+# Silence after speech that ends the turn (auto-commit)
+VAD_END_OF_SPEECH_MS = int(os.getenv("VAD_END_OF_SPEECH_MS", "800"))
+VAD_AUTO_COMMIT = os.getenv("VAD_AUTO_COMMIT", "0") == "1"
+# Ask for a reply right after an auto-commit (turn_detection is off upstream)
+VAD_AUTO_RESPONSE = os.getenv("VAD_AUTO_RESPONSE", "1") == "1"
+
+FRAME_MS = 20
+
+
+class VoiceActivityDetector:
+    """Per-connection speech gate over a stream of PCM16 appends"""
+
+    def __init__(self, sample_rate: int = 24000, auto_commit: bool = VAD_AUTO_COMMIT):
+        self.sample_rate = sample_rate
+        self.auto_commit = auto_commit
+        self.frame_bytes = sample_rate * FRAME_MS // 1000 * 2
+        self.preroll_bytes = VAD_PREROLL_MS // FRAME_MS * self.frame_bytes
+        self.pending = b""          # partial frame carried into the next append
+        self.preroll = b""          # recent silence before speech starts
+        self.held = b""             # silence after speech, sent only if speech resumes
+        self.in_speech = False
+        self.silence_ms = 0
+        self.bytes_in_turn = 0      # audio forwarded since the last commit
+        self.auto_committed = False
+
+    def process(self, pcm: bytes) -> List[Tuple[bytes, bool]]:
+        """Gate one append into (audio to forward, ends_turn) pieces.
+
+        Without auto-commit there is at most one piece and ends_turn is False.
+        With it, each end of speech closes a piece with ends_turn=True so the
+        caller can commit there; speech after it starts the next turn.
+        """
+        # Clients may send appends shorter than a frame (10 ms Opus, small PCM
+        # chunks): analyse whole frames only and carry the rest into the next call
+        pcm = self.pending + pcm
+        usable = len(pcm) - len(pcm) % self.frame_bytes
+        self.pending = pcm[usable:]
+        voiced = frame_rms(as_samples(pcm[:usable]), self.sample_rate, FRAME_MS) > VAD_SPEECH_RMS
+        pieces = []
+        out = bytearray()
+
+        for i, is_voiced in enumerate(voiced):
+            frame = pcm[i * self.frame_bytes:(i + 1) * self.frame_bytes]
+            if is_voiced:
+                if not self.in_speech:
+                    out += self.preroll  # leading silence trimmed to the pre-roll
+                    self.preroll = b""
+                    self.in_speech = True
+                    self.auto_committed = False
+                out += self.held  # a short pause inside speech: keep it
+                self.held = b""
+                self.silence_ms = 0
+                out += frame
+            elif self.in_speech:
+                self.silence_ms += FRAME_MS
+                if self.silence_ms <= VAD_HANGOVER_MS:
+                    self.held += frame
+                if self.silence_ms >= VAD_END_OF_SPEECH_MS:
+                    # Trailing silence: whatever is still held is dropped
+                    self.held = b""
+                    self.in_speech = False
+                    if self.auto_commit:
+                        self.bytes_in_turn += len(out)
+                        pieces.append((bytes(out), self.bytes_in_turn > 0))
+                        out = bytearray()
+                        if self.bytes_in_turn:
+                            self.bytes_in_turn = 0
+                            self.auto_committed = True
+                            metrics.increment("vad_auto_commits")
+            else:
+                self.preroll = (self.preroll + frame)[-self.preroll_bytes:] if self.preroll_bytes else b""
+
+        self.bytes_in_turn += len(out)
+        pieces.append((bytes(out), False))
+
+        forwarded = sum(len(audio) for audio, _ in pieces)
+        dropped = usable - forwarded
+        if dropped > 0:
+            metrics.increment("vad_bytes_dropped", dropped)
+        if usable and not forwarded:
+            metrics.increment("vad_silent_appends")
+        return [(audio, ends_turn) for audio, ends_turn in pieces if audio or ends_turn]
+
+    def flush(self) -> bytes:
+        """Audio still held as a partial frame, at a client commit (forwarded if inside speech)"""
+        tail, self.pending = self.pending, b""
+        if not (tail and self.in_speech and self.silence_ms == 0):
+            return b""
+        self.bytes_in_turn += len(tail)
+        return tail
+
+    def should_forward_commit(self) -> bool:
+        """False when a client commit has nothing to commit (the buffer would be empty upstream)"""
+        if self.bytes_in_turn == 0:
+            metrics.increment("vad_commits_suppressed",
+                              reason="auto_committed" if self.auto_committed else "no_speech")
+            return False
+        return True
+
+    def mark_committed(self) -> None:
+        """Client committed: the next append starts a new turn"""
+        self.pending = b""
+        self.preroll = b""
+        self.held = b""
+        self.in_speech = False
+        self.silence_ms = 0
+        self.bytes_in_turn = 0
+
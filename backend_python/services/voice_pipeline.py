@@ -0,0 +1,275 @@
+"""
+Voice Pipeline - Sentence-pipelined streaming voice turns
+Whisper STT → streaming chat → per-sentence TTS, sent to the client over a
+WebSocket as ordered audio chunks while the rest of the reply is still generating.
+Each chunk passes the guardrail (run alongside its TTS) before its audio is sent.
+"""
+import os
+import time
+import base64
+import binascii
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from fastapi import WebSocket
+from dotenv import load_dotenv
+from services import metrics
+from services.ssml_builder import SENTENCE_END
+
+load_dotenv()
+
+# Sentences shorter than this are merged with the next one to avoid tiny TTS requests
+MIN_SENTENCE_CHARS = int(os.getenv("VOICE_MIN_SENTENCE_CHARS", "16"))
+# Concurrent TTS requests per voice turn
+TTS_CONCURRENCY = int(os.getenv("VOICE_TTS_CONCURRENCY", "3"))
+
+
+def split_sentences(buffer: str) -> Tuple[List[str], str]:
+    """Split complete sentences off the front of a streaming text buffer.
+
+    Returns (sentences, remainder) where remainder is the unfinished tail.
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(buffer):
+        candidate = buffer[start:match.end()].strip()
+        if len(candidate) < MIN_SENTENCE_CHARS:
+            continue  # keep accumulating into the next boundary
+        sentences.append(candidate)
+        start = match.end()
+    return sentences, buffer[start:]
+
+
+class AudioChunkSender:
+    """Synthesizes sentences concurrently and sends the audio in submission order"""
+
+    def __init__(self, websocket: WebSocket, intensity: str, audio_format: str):
+        from services.ai_service import TTS_FORMATS
+
+        self.websocket = websocket
+        self.intensity = intensity
+        self.audio_format = audio_format
+        self.output_format, self.mime_type = TTS_FORMATS[audio_format]
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
+        self.seq = 0
+        self.generation = 0
+        self.blocked = False  # a chunk failed the guardrail; the reply was replaced
+        self.finished = False
+        self.started_at = time.monotonic()
+        self.first_audio_ms: Optional[float] = None
+
+    async def _synthesize(self, text: str) -> bytes:
+        from services.ai_service import synthesize_speech
+
+        async with self.semaphore:
+            return await synthesize_speech(text, self.intensity, self.output_format)
+
+    async def _produce(self, text: str, check: bool) -> Tuple[bool, bytes]:
+        """(passed the guardrail, audio); both requests run side by side"""
+        from services.ai_service import validate_response
+
+        if not check:
+            return True, await self._synthesize(text)
+        validation, audio = await asyncio.gather(validate_response(text), self._synthesize(text))
+        return validation.get("status") != "UNSAFE", audio
+
+    def submit(self, text: str, check: bool = True) -> None:
+        """Start checking and synthesizing a sentence now; it is sent after all earlier ones.
+
+        `check=False` is for our own canned replies, which skip the guardrail.
+        """
+        task = asyncio.create_task(self._produce(text, check))
+        self.queue.put_nowait((self.generation, self.seq, text, task))
+        self.seq += 1
+
+    def replace(self, text: str) -> None:
+        """Drop everything not yet sent and speak `text` (a canned reply) instead"""
+        self.generation += 1
+        self.submit(text, check=False)
+
+    def finish(self) -> None:
+        self.queue.put_nowait(None)
+
+    async def run(self) -> None:
+        """Send chunks in order until finish() is called and nothing is left.
+
+        A chunk blocked after finish() queues its replacement behind the
+        sentinel, so the sentinel alone doesn't end the loop.
+        """
+        while not (self.finished and self.queue.empty()):
+            item = await self.queue.get()
+            if item is None:
+                self.finished = True
+                continue
+            generation, seq, text, task = item
+            if generation != self.generation:
+                task.cancel()
+                continue
+            safe, audio = await task
+            if generation != self.generation:
+                continue
+            if not safe:
+                from services.ai_service import GUARDRAIL_REPLACEMENT
+
+                print(f"[VoiceStream] !!! GUARDRAIL TRIGGERED on chunk {seq}, replacing the reply")
+                self.blocked = True
+                await self.websocket.send_json({"type": "response.replaced", "response": GUARDRAIL_REPLACEMENT})
+                self.replace(GUARDRAIL_REPLACEMENT)
+                continue
+            if not audio:
+                print(f"[VoiceStream] ⚠️ No audio for chunk {seq}, sending text only")
+            elif self.first_audio_ms is None:
+                self.first_audio_ms = (time.monotonic() - self.started_at) * 1000
+                metrics.observe("voice_stream_first_audio_ms", self.first_audio_ms, intensity=self.intensity)
+                print(f"[VoiceStream] First audio after {self.first_audio_ms:.0f}ms")
+            await self.websocket.send_json({
+                "type": "audio.chunk",
+                "seq": seq,
+                "text": text,
+                "audio": base64.b64encode(audio).decode("utf-8") if audio else "",
+                "audioFormat": self.audio_format,
+                "mimeType": self.mime_type,
+                "replaces": generation > 0,
+            })
+
+
+async def send_canned_reply(websocket: WebSocket, text: str, intensity: str, audio_format: str,
+                            transcription: str = "") -> None:
+    """Speak one of our fixed replies (TTS-cached once prewarmed), then end the turn"""
+    sender = AudioChunkSender(websocket, intensity, audio_format)
+    sender.submit(text, check=False)
+    sender.finish()
+    await sender.run()
+    await websocket.send_json({"type": "response.done", "transcription": transcription,
+                               "response": text, "intensity": intensity})
+
+
+async def run_voice_turn(websocket: WebSocket, audio_bytes: bytes,
+                         conversation_history: List[Dict], intensity: str = "real",
+                         audio_format: str = "mp3") -> None:
+    """Run one STT → streaming chat → streaming TTS turn over `websocket`"""
+    from services.ai_service import (
+        transcribe_audio, check_safety, prepare_chat_prompt, stream_response,
+        finalize_response, VOICE_EMPTY_RESPONSE, VOICE_STT_ERROR_RESPONSE,
+    )
+
+    sender = AudioChunkSender(websocket, intensity, audio_format)
+
+    # 1. Speech-to-Text
+    try:
+        user_text = await transcribe_audio(audio_bytes)
+    except Exception as e:
+        print(f"[VoiceStream] STT Error: {e}")
+        await websocket.send_json({"type": "transcription", "text": ""})
+        await send_canned_reply(websocket, VOICE_STT_ERROR_RESPONSE, intensity, audio_format)
+        return
+    print(f"[VoiceStream] Transcription: {user_text}")
+    await websocket.send_json({"type": "transcription", "text": user_text})
+    if not user_text:
+        await send_canned_reply(websocket, VOICE_EMPTY_RESPONSE, intensity, audio_format)
+        return
+
+    sender_task = asyncio.create_task(sender.run())
+    try:
+        canned = await check_safety(user_text)
+        if canned:
+            # Canned replies are spoken whole: their audio is prewarmed in the TTS cache
+            final_response = canned["response"]
+            sender.submit(final_response, check=False)
+        else:
+            # 2. Streaming chat; each finished sentence goes to TTS right away
+            prompt = await prepare_chat_prompt(user_text, conversation_history, "", intensity)
+            intensity = prompt["intensity"]
+            sender.intensity = intensity
+            prompt_context = prompt["context"]
+
+            buffer = ""
+            parts = []
+            stream = stream_response(
+                user_text,
+                prompt["system_prompt"],
+                "NEUTRAL",
+                prompt_context["history"],
+                prompt_context["volatile"],
+                stable_context=prompt_context["stable"]
+            )
+            try:
+                async for delta in stream:
+                    if sender.blocked:
+                        break  # the reply was replaced: stop generating it
+                    parts.append(delta)
+                    buffer += delta
+                    sentences, buffer = split_sentences(buffer)
+                    for sentence in sentences:
+                        sender.submit(sentence)
+            finally:
+                await stream.aclose()
+            if buffer.strip() and not sender.blocked:
+                sender.submit(buffer.strip())
+            response = "".join(parts)
+
+            # 3. Every chunk is checked before its audio is sent; the full reply is
+            # checked again here (context can make a sequence of safe sentences
+            # unsafe) and stored. If it is replaced now, unsent chunks are dropped
+            # and the client is told to stop playback of the original.
+            if sender.blocked:
+                final_response = await finalize_response(user_text, response, validation={"status": "UNSAFE"})
+            else:
+                final_response = await finalize_response(user_text, response)
+            if final_response != response and not sender.blocked:
+                await websocket.send_json({"type": "response.replaced", "response": final_response})
+                sender.replace(final_response)
+    finally:
+        sender.finish()
+        await sender_task
+
+    if sender.blocked:
+        from services.ai_service import GUARDRAIL_REPLACEMENT
+        final_response = GUARDRAIL_REPLACEMENT
+
+    await websocket.send_json({
+        "type": "response.done",
+        "transcription": user_text,
+        "response": final_response,
+        "intensity": intensity,
+    })
+
+
+async def handle_voice_stream(websocket: WebSocket) -> None:
+    """Serve voice turns on an accepted WebSocket until the client disconnects.
+
+    Client sends: {"type": "voice.request", "audioBase64": "...", "conversationHistory": [...],
+                   "intensity": "real", "audioFormat": "opus,mp3"}
+    Server sends: transcription → audio.chunk (seq 0..n) → response.done
+    """
+    from services.ai_service import VOICE_UNCLEAR_RESPONSE, negotiate_audio_format
+
+    while True:
+        request = await websocket.receive_json()
+        if request.get("type") != "voice.request":
+            await websocket.send_json({"type": "error", "message": f"Unknown event: {request.get('type')}"})
+            continue
+
+        intensity = request.get("intensity") or "real"
+        audio_format = negotiate_audio_format(request.get("audioFormat"))
+        audio_base64 = request.get("audioBase64", "")
+        if "," in audio_base64:
+            audio_base64 = audio_base64.split(",")[1]
+        if len(audio_base64) < 100:
+            await send_canned_reply(websocket, VOICE_UNCLEAR_RESPONSE, intensity, audio_format)
+            continue
+        try:
+            audio_bytes = base64.b64decode(audio_base64)
+        except (binascii.Error, ValueError) as e:
+            print(f"[VoiceStream] Invalid audioBase64: {e}")
+            await websocket.send_json({"type": "error", "message": "audioBase64 is not valid base64"})
+            continue
+        del audio_base64
+
+        history = [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in request.get("conversationHistory", [])
+        ]
+        started = time.monotonic()
+        await run_voice_turn(websocket, audio_bytes, history, intensity, audio_format)
+        metrics.observe("voice_stream_turn_ms", (time.monotonic() - started) * 1000)
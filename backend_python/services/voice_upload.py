@@ -0,0 +1,154 @@
+"""
+Voice Upload - Binary audio uploads for /voice/upload
+Accepts multipart/form-data or a raw audio body and hands the audio to STT as a
+spooled file object, so a request holds about one copy of the recording
+"""
+import os
+import json
+import base64
+import tempfile
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from fastapi import HTTPException, Request
+from starlette.datastructures import UploadFile
+from dotenv import load_dotenv
+from services import metrics
+
+load_dotenv()
+
+# Whisper rejects files over 25 MB
+MAX_UPLOAD_BYTES = int(os.getenv("VOICE_MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+# Same cut-off as the base64 path (100 base64 chars ≈ 75 bytes)
+MIN_UPLOAD_BYTES = int(os.getenv("VOICE_MIN_UPLOAD_BYTES", "75"))
+# Uploads larger than this spill from memory to a temp file
+SPOOL_MAX_MEMORY = int(os.getenv("VOICE_SPOOL_MAX_MEMORY", str(1024 * 1024)))
+
+DEFAULT_FILENAME = "audio.m4a"
+DEFAULT_CONTENT_TYPE = "audio/m4a"
+
+
+class VoiceUpload:
+    """An uploaded recording plus the request options that came with it"""
+
+    def __init__(self, file: BinaryIO, size: int, filename: str, content_type: str,
+                 history: List[Dict], intensity: str, audio_format: Optional[str]):
+        self.file = file
+        self.size = size
+        self.filename = filename
+        self.content_type = content_type
+        self.history = history
+        self.intensity = intensity
+        self.audio_format = audio_format
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def parse_history(raw: Optional[str]) -> List[Dict]:
+    """Conversation history from a JSON form field / header value.
+
+    Header values may be base64-encoded JSON, since headers can't carry non-Latin text.
+    """
+    if not raw:
+        return []
+    try:
+        if not raw.lstrip().startswith("["):
+            raw = base64.b64decode(raw).decode("utf-8")
+        messages = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="conversationHistory must be a JSON array")
+    if not isinstance(messages, list):
+        raise HTTPException(status_code=400, detail="conversationHistory must be a JSON array")
+    return [
+        {"role": msg["role"], "content": msg["content"]}
+        for msg in messages
+        if isinstance(msg, dict) and "role" in msg and "content" in msg
+    ]
+
+
+def _check_declared_length(request: Request) -> None:
+    """Reject oversized bodies before reading them"""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > MAX_UPLOAD_BYTES:
+        metrics.increment("voice_upload_rejected", reason="too_large")
+        raise HTTPException(status_code=413, detail=f"Audio exceeds {MAX_UPLOAD_BYTES} bytes")
+
+
+def _file_size(file: BinaryIO) -> int:
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    return size
+
+
+async def _read_raw_body(request: Request) -> Tuple[BinaryIO, int]:
+    """Spool a raw request body, enforcing the size limit while it streams in"""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    size = 0
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                metrics.increment("voice_upload_rejected", reason="too_large")
+                raise HTTPException(status_code=413, detail=f"Audio exceeds {MAX_UPLOAD_BYTES} bytes")
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, size
+
+
+async def read_voice_upload(request: Request) -> VoiceUpload:
+    """Parse a multipart or raw-body voice upload.
+
+    multipart/form-data: `audio` file part, optional `conversationHistory` (JSON),
+    `intensity` and `audioFormat` fields.
+    Raw body (e.g. audio/m4a): options come from the query string
+    (`intensity`, `audioFormat`) and the X-Conversation-History header.
+    """
+    _check_declared_length(request)
+    content_type = request.headers.get("content-type", "")
+
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("audio")
+        if not isinstance(upload, UploadFile):
+            await form.close()
+            raise HTTPException(status_code=400, detail="Missing 'audio' file part")
+        try:
+            history = parse_history(form.get("conversationHistory"))
+        except HTTPException:
+            await form.close()
+            raise
+        result = VoiceUpload(
+            file=upload.file,
+            size=_file_size(upload.file),
+            filename=upload.filename or DEFAULT_FILENAME,
+            content_type=upload.content_type or DEFAULT_CONTENT_TYPE,
+            history=history,
+            intensity=form.get("intensity") or "real",
+            audio_format=form.get("audioFormat"),
+        )
+    else:
+        history = parse_history(request.headers.get("x-conversation-history"))
+        file, size = await _read_raw_body(request)
+        audio_type = content_type.split(";")[0].strip() or DEFAULT_CONTENT_TYPE
+        if audio_type == "application/octet-stream":
+            audio_type = DEFAULT_CONTENT_TYPE
+        extension = audio_type.split("/")[-1].replace("x-", "").replace("mpeg", "mp3")
+        result = VoiceUpload(
+            file=file,
+            size=size,
+            filename=f"audio.{extension}",
+            content_type=audio_type,
+            history=history,
+            intensity=request.query_params.get("intensity") or "real",
+            audio_format=request.query_params.get("audioFormat"),
+        )
+
+    if result.size > MAX_UPLOAD_BYTES:
+        result.close()
+        metrics.increment("voice_upload_rejected", reason="too_large")
+        raise HTTPException(status_code=413, detail=f"Audio exceeds {MAX_UPLOAD_BYTES} bytes")
+    metrics.observe("voice_upload_bytes", result.size)
+    return result
@@ -0,0 +1,101 @@
+"""
+WAV Parser - RIFF/WAVE chunk parsing for client recordings
+Walks the real chunk layout (fmt, data, plus LIST/fact/JUNK and odd-size padding)
+instead of assuming a 44-byte header, and decodes PCM 8/16/24/32-bit and IEEE
+float samples to NumPy arrays
+"""
+import struct
+from typing import Optional
+import numpy as np
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Streaming writers leave the size fields at 0 or 0xFFFFFFFF until the recording ends
+UNKNOWN_SIZES = (0, 0xFFFFFFFF)
+
+
+class WavAudio:
+    """Format of a parsed WAV file plus a zero-copy view of its sample data"""
+
+    def __init__(self, format_tag: int, channels: int, sample_rate: int,
+                 bits_per_sample: int, block_align: int, data: memoryview):
+        self.format_tag = format_tag
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.bits_per_sample = bits_per_sample
+        self.block_align = block_align
+        self.data = data
+
+    @property
+    def frames(self) -> int:
+        return len(self.data) // self.block_align
+
+    @property
+    def duration_ms(self) -> float:
+        return self.frames / self.sample_rate * 1000
+
+    def is_pcm16(self, sample_rate: int, channels: int = 1) -> bool:
+        """Already in the target layout (raw bytes can be sent as-is)"""
+        return (self.format_tag == WAVE_FORMAT_PCM and self.bits_per_sample == 16
+                and self.sample_rate == sample_rate and self.channels == channels)
+
+    def samples(self) -> np.ndarray:
+        """Interleaved samples as (frames, channels), int16 or float32 in int16 scale"""
+        raw = self.data[:self.frames * self.block_align]
+        width = self.block_align // self.channels
+
+        if self.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+            dtype = "<f4" if width == 4 else "<f8"
+            samples = np.frombuffer(raw, dtype=dtype).astype(np.float32) * 32767.0
+        elif width == 2:
+            samples = np.frombuffer(raw, dtype="<i2")
+        elif width == 1:
+            # 8-bit WAV is unsigned
+            samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.int16) - 128) << 8
+        elif width == 3:
+            b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+            samples = (((b[:, 2] << 24) | (b[:, 1] << 16) | (b[:, 0] << 8)) >> 16).astype(np.int16)
+        elif width == 4:
+            samples = (np.frombuffer(raw, dtype="<i4") >> 16).astype(np.int16)
+        else:
+            raise ValueError(f"Unsupported sample width: {width} bytes")
+        return samples.reshape(-1, self.channels)
+
+
+def parse_wav(audio_bytes: bytes) -> Optional[WavAudio]:
+    """Parse a RIFF/WAVE file; None if it isn't one or holds a codec other than PCM/float"""
+    if len(audio_bytes) < 12 or audio_bytes[:4] != b"RIFF" or audio_bytes[8:12] != b"WAVE":
+        return None
+
+    view = memoryview(audio_bytes)
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(audio_bytes):
+        chunk_id = bytes(view[offset:offset + 4])
+        size = struct.unpack_from("<I", audio_bytes, offset + 4)[0]
+        body = offset + 8
+
+        if chunk_id == b"fmt ":
+            if size < 16:
+                return None
+            format_tag, channels, sample_rate, _, block_align, bits = struct.unpack_from("<HHIIHH", audio_bytes, body)
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and size >= 40:
+                # The real format is the first two bytes of the SubFormat GUID
+                format_tag = struct.unpack_from("<H", audio_bytes, body + 24)[0]
+            fmt = (format_tag, channels, sample_rate, bits, block_align)
+        elif chunk_id == b"data":
+            if fmt is None:
+                return None
+            format_tag, channels, sample_rate, bits, block_align = fmt
+            if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+                return None
+            if channels < 1 or sample_rate < 1 or block_align < channels:
+                return None
+            end = len(audio_bytes) if size in UNKNOWN_SIZES else min(len(audio_bytes), body + size)
+            return WavAudio(format_tag, channels, sample_rate, bits, block_align, view[body:end])
+
+        # Chunks are word-aligned: odd sizes carry one pad byte
+        offset = body + size + (size & 1)
+    return None
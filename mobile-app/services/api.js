@@ -73,7 +73,8 @@ export const sendAudioToBackend = async (audioBase64, conversationHistory = [])
         const response = await axios.post(`${BASE_URL}/voice`, {
             audioBase64,
             conversationHistory,
-            intensity
+            intensity,
+            audioFormat: 'mp3' // played from a .mp3 file on both iOS and Android
         }, { timeout: 30000 }); // Longer timeout for audio processing
         return response.data;
     } catch (error) {